@@ -0,0 +1,247 @@
+"""!
+@file generate_dataset.py
+@brief Generate a synthetic GeoIP dataset shaped like the GeoLite2 country CSVs,
+since the real files (and config.py) can't be published:
+    countries.csv   GeoLite2-Country-Locations-en columns
+    blocks.csv      GeoLite2-Country-Blocks-IPv4 columns, non overlapping networks
+    packets.pcap    the senders SYN frames from those blocks (plus some unmatched sources)
+    config.py       a config for the host/remote code pointing at the files above
+    python generate_dataset.py --out bench_data --blocks 1000000 --packets 200000
+"""
+
+# Standard libraries we need
+import os
+import sys
+import math
+import random
+import struct
+import argparse
+import importlib.util
+from itertools import accumulate
+
+# The senders frame builder so the packets are exactly what the remote sends
+# (loaded by path, remote/src can't go on sys.path next to the hosts modules of the same names)
+REMOTE_SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "remote", "src")
+
+
+"""!
+@brief Import a module from a file under a name of our choosing
+"""
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+FrameTemplate = load_module("remote_frame_builder", os.path.join(REMOTE_SRC, "frame_builder.py")).FrameTemplate
+
+# Defaults, roughly the size of the real GeoLite2 country database
+DEFAULT_COUNTRIES = 250
+DEFAULT_BLOCKS = 400000
+DEFAULT_PACKETS = 100000
+# Share of packets coming from addresses outside every block
+UNMATCHED_SHARE = 0.1
+# Share of the address space left between blocks (never matched)
+GAP_SHARE = 0.1
+# Unicast space the blocks are spread over (1.0.0.0 - 223.255.255.255)
+ADDRESS_SPACE_START = 1 << 24
+ADDRESS_SPACE_END = 224 << 24
+# Traffic between countries is skewed like real traffic, weight of the country ranked k is 1 / k**ZIPF_S
+ZIPF_S = 1.1
+
+# Where the synthetic packets are sent
+RECEIVER_IP = "10.0.0.2"
+RECEIVER_MAC = "02:00:00:00:00:02"
+SENDER_MAC = "02:00:00:00:00:01"
+DEST_PORT = 8080
+
+COUNTRY_COLUMNS = (
+    "geoname_id", "locale_code", "continent_code", "continent_name",
+    "country_iso_code", "country_name", "is_in_european_union",
+)
+BLOCK_COLUMNS = (
+    "network", "geoname_id", "registered_country_geoname_id",
+    "represented_country_geoname_id", "is_anonymous_proxy", "is_satellite_provider",
+)
+CONTINENTS = (("AF", "Africa"), ("AS", "Asia"), ("EU", "Europe"), ("NA", "North America"),
+              ("OC", "Oceania"), ("SA", "South America"))
+
+CONFIG_TEMPLATE = '''"""Generated by proj/bench/generate_dataset.py, synthetic data only"""
+from sqlalchemy import text
+
+COUNTRY_CVS = {country_csv!r}
+BLOCKS_CVS = {blocks_csv!r}
+GEO_IP_DB_PATH = {db_path!r}
+FREQ_MIN = 1
+DECREMENT_INTERVAL = 1
+NATURALEARTH_LOWRES_PATH = None
+COUNTRY_FIX_LIST = []
+QUERY_COUNTRIES_RECORD_STMT = text("SELECT country_name, geoname_id FROM countries")
+
+RECEIVER_IP = {receiver_ip!r}
+RECEIVER_MAC = {receiver_mac!r}
+DEST_PORT = {dest_port!r}
+SUBNET = "10.0.0.0/24"
+SCAPY_DELAY = 0.1
+countries_list_selected = {selected!r}
+'''
+
+
+"""!
+@brief Countries with unique geoname_ids, names and two letter codes
+Returns: list of (geoname_id, iso_code, country_name, continent)
+"""
+def generate_countries(count, rng):
+    countries = []
+    geoname_ids = rng.sample(range(100000, 9999999), count)
+    for i, geoname_id in enumerate(geoname_ids):
+        iso_code = chr(65 + (i // 26) % 26) + chr(65 + i % 26)
+        countries.append((geoname_id, iso_code, f"Synthland {i + 1:03d}", CONTINENTS[i % len(CONTINENTS)]))
+    return countries
+
+
+"""!
+@brief Zipf weights for every country (shuffled so the biggest country isnt always the first)
+"""
+def country_weights(count, rng):
+    weights = [1.0 / (rank ** ZIPF_S) for rank in range(1, count + 1)]
+    rng.shuffle(weights)
+    return weights
+
+
+"""!
+@brief Walk the address space handing out aligned, non overlapping blocks
+Returns: list of (network_start, prefix_len, country index)
+"""
+def generate_blocks(count, countries, weights, rng):
+    # Pick prefix lengths so `count` blocks (plus the gaps) roughly fill the space
+    space = ADDRESS_SPACE_END - ADDRESS_SPACE_START
+    average_size = space * (1.0 - GAP_SHARE) / count
+    base_prefix = min(max(32 - int(math.log2(max(average_size, 1.0))), 8), 30)
+    prefixes = [p for p in range(base_prefix, min(base_prefix + 4, 32) + 1)]
+
+    blocks = []
+    cursor = ADDRESS_SPACE_START
+    country_indexes = list(range(len(countries)))
+    cum_weights = list(accumulate(weights))
+    while len(blocks) < count:
+        prefix = rng.choice(prefixes)
+        size = 1 << (32 - prefix)
+        # Align the cursor to the block size
+        cursor = (cursor + size - 1) & ~(size - 1)
+        if rng.random() < GAP_SHARE:
+            cursor += size
+            continue
+        if cursor + size > ADDRESS_SPACE_END:
+            break
+        country = rng.choices(country_indexes, cum_weights=cum_weights)[0]
+        blocks.append((cursor, prefix, country))
+        cursor += size
+    return blocks
+
+
+def write_countries_csv(path, countries):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write(",".join(COUNTRY_COLUMNS) + "\n")
+        for geoname_id, iso_code, name, (continent_code, continent_name) in countries:
+            f.write(f"{geoname_id},en,{continent_code},{continent_name},{iso_code},{name},0\n")
+
+
+def write_blocks_csv(path, blocks, countries):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write(",".join(BLOCK_COLUMNS) + "\n")
+        for start, prefix, country in blocks:
+            network = f"{start >> 24}.{(start >> 16) & 255}.{(start >> 8) & 255}.{start & 255}/{prefix}"
+            geoname_id = countries[country][0]
+            f.write(f"{network},{geoname_id},{geoname_id},,0,0\n")
+
+
+"""!
+@brief Write packets from the blocks as a classic (microsecond) pcap file
+Returns: number of packets matching a block
+"""
+def write_packets_pcap(path, count, blocks, countries, weights, rng, pps=10000):
+    template = FrameTemplate(SENDER_MAC, RECEIVER_MAC, RECEIVER_IP, DEST_PORT)
+    # Blocks of every country so the packets follow the country weights
+    country_blocks = [[] for _ in countries]
+    for start, prefix, country in blocks:
+        country_blocks[country].append((start, prefix))
+    used = [i for i, country in enumerate(country_blocks) if country]
+    used_cum_weights = list(accumulate(weights[i] for i in used))
+
+    matched = 0
+    with open(path, "wb") as f:
+        f.write(struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1))
+        for i in range(count):
+            if rng.random() < UNMATCHED_SHARE:
+                # Somewhere outside the blocks we hand out (multicast/reserved space)
+                block = template.prepare_block(rng.randrange(ADDRESS_SPACE_END, 0xF0000000) & ~0xFF, 24)
+            else:
+                start, prefix = rng.choice(country_blocks[rng.choices(used, cum_weights=used_cum_weights)[0]])
+                block = template.prepare_block(start, prefix)
+                matched += 1
+            frame = template.build(block, rng.randint(1024, 65535))
+            ts = i / pps
+            f.write(struct.pack("<IIII", int(ts), int(ts % 1 * 1e6), len(frame), len(frame)))
+            f.write(frame)
+    return matched
+
+
+"""!
+@brief Generate every file of the dataset into out_dir
+Returns: dictionary describing what was written
+"""
+def generate_dataset(out_dir, countries=DEFAULT_COUNTRIES, blocks=DEFAULT_BLOCKS, packets=DEFAULT_PACKETS, seed=0):
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    country_list = generate_countries(countries, rng)
+    weights = country_weights(countries, rng)
+    block_list = generate_blocks(blocks, country_list, weights, rng)
+
+    paths = {
+        "country_csv": os.path.join(out_dir, "countries.csv"),
+        "blocks_csv": os.path.join(out_dir, "blocks.csv"),
+        "packets_pcap": os.path.join(out_dir, "packets.pcap"),
+        "db_path": os.path.join(out_dir, "geoIP.db"),
+        "config": os.path.join(out_dir, "config.py"),
+    }
+    write_countries_csv(paths["country_csv"], country_list)
+    write_blocks_csv(paths["blocks_csv"], block_list, country_list)
+    matched = write_packets_pcap(paths["packets_pcap"], packets, block_list, country_list, weights, rng)
+
+    # The most weighted countries are the ones the remote sends from
+    top = sorted(range(countries), key=lambda i: -weights[i])[:10]
+    with open(paths["config"], "w", encoding="utf-8") as f:
+        f.write(CONFIG_TEMPLATE.format(
+            country_csv=os.path.abspath(paths["country_csv"]),
+            blocks_csv=os.path.abspath(paths["blocks_csv"]),
+            db_path=os.path.abspath(paths["db_path"]),
+            receiver_ip=RECEIVER_IP,
+            receiver_mac=RECEIVER_MAC,
+            dest_port=DEST_PORT,
+            selected=[(country_list[i][2], country_list[i][0]) for i in top],
+        ))
+
+    summary = dict(paths, countries=countries, blocks=len(block_list), packets=packets, matched_packets=matched, seed=seed)
+    print(
+        f"[Dataset] {countries} countries, {len(block_list)} blocks, "
+        f"{packets} packets ({matched} matching a block) in {out_dir}"
+    )
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic GeoIP dataset and packet capture")
+    parser.add_argument("--out", default="bench_data", help="directory to write the dataset to")
+    parser.add_argument("--countries", type=int, default=DEFAULT_COUNTRIES)
+    parser.add_argument("--blocks", type=int, default=DEFAULT_BLOCKS)
+    parser.add_argument("--packets", type=int, default=DEFAULT_PACKETS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    generate_dataset(args.out, args.countries, args.blocks, args.packets, args.seed)
+
+
+if __name__ == "__main__":
+    main()
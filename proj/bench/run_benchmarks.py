@@ -0,0 +1,362 @@
+"""!
+@file run_benchmarks.py
+@brief Micro-benchmarks of the receiver and sender hot paths on a synthetic dataset
+(see generate_dataset.py). Results are written as JSON so two releases can be compared:
+    python run_benchmarks.py --blocks 400000 --output results.json
+    python run_benchmarks.py --output new.json --compare results.json
+Every benchmark runs against the real host/remote modules with a generated config.py.
+Timings only mean something next to other runs on the same machine, so results are
+never committed (bench_results.json is ignored by git), the machine is recorded in
+"meta" and --compare warns when the two runs come from different machines
+"""
+
+# Standard libraries we need
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+
+# Local libraries we need
+from generate_dataset import generate_dataset, load_module, DEFAULT_BLOCKS, DEFAULT_COUNTRIES, DEFAULT_PACKETS
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+HOST_SRC = os.path.join(BENCH_DIR, "..", "host", "src")
+REMOTE_SRC = os.path.join(BENCH_DIR, "..", "remote", "src")
+
+# Timed repeats per measurement, the fastest run is kept
+DEFAULT_REPEAT = 5
+# Decay ticks / GUI refresh ticks measured per repeat
+TICKS = 100
+# Synthetic map size for the projection benchmark (the Natural Earth lowres map is ~10k vertices)
+MAP_POLYGONS = 300
+MAP_VERTICES_PER_POLYGON = 40
+
+
+"""!
+@brief Run fn `repeat` times
+Returns: the fastest run in seconds and the last result
+"""
+def best_of(fn, repeat=DEFAULT_REPEAT):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+"""!
+@brief Throughput entry for `ops` operations done in `seconds`
+"""
+def rate(ops, seconds):
+    return {"ops": ops, "seconds": seconds, "per_sec": ops / seconds if seconds > 0 else None}
+
+
+"""!
+@brief Read the source address of every packet in the datasets pcap
+"""
+def load_packets(dataset):
+    from pcap_replay import read_capture
+    from fast_capture import parse_frame
+
+    with open(dataset["packets_pcap"], "rb") as f:
+        frames = [frame for _, _, frame in read_capture(f)]
+    sources = [parse_frame(frame)[0] for frame in frames]
+    return frames, sources
+
+
+def bench_csv_ingest(dataset, repeat):
+    from sqlalchemy import create_engine
+    from csv_ingest import load_csv_to_sqlite, NETWORK_RANGE_COLUMNS
+
+    engine = create_engine(f"sqlite:///{os.path.join(os.path.dirname(dataset['db_path']), 'ingest.db')}")
+
+    def load(force):
+        rows = load_csv_to_sqlite(
+            dataset["country_csv"], "countries", engine,
+            indexes=("geoname_id", "country_name"), force=force
+        )
+        rows += load_csv_to_sqlite(
+            dataset["blocks_csv"], "blocks", engine,
+            computed_columns=NETWORK_RANGE_COLUMNS,
+            indexes=("network", "geoname_id", "network_start"), force=force
+        )
+        return rows
+
+    # A full load is slow, it is only timed once
+    started = time.perf_counter()
+    rows = load(force=True)
+    full = time.perf_counter() - started
+    unchanged, _ = best_of(lambda: load(force=False), repeat)
+    engine.dispose()
+    return {"full_load": rate(rows, full), "unchanged_skip_seconds": unchanged}
+
+
+def bench_lookup(dataset, repeat):
+    from db import get_geoip_session
+    from ip_lookup import build_ip_lookup, CachedIPLookup
+    from fast_capture import parse_frame
+
+    session = get_geoip_session()
+    try:
+        build_seconds, ip_lookup = best_of(lambda: build_ip_lookup(session), 1)
+    finally:
+        session.close()
+    frames, sources = load_packets(dataset)
+
+    lookup = ip_lookup.lookup
+    lookup_seconds, matched = best_of(lambda: sum(lookup(src) is not None for src in sources), repeat)
+
+    def parse_and_lookup():
+        return sum(lookup(parse_frame(frame)[0]) is not None for frame in frames)
+    frame_seconds, _ = best_of(parse_and_lookup, repeat)
+
+    # Same sources through the address cache (warm after the first run, best_of keeps the warm ones)
+    cached = CachedIPLookup(ip_lookup)
+    cached_lookup = cached.lookup
+    cached_seconds, _ = best_of(lambda: sum(cached_lookup(src) is not None for src in sources), repeat)
+
+    return {
+        "build_seconds": build_seconds,
+        "intervals": len(ip_lookup),
+        "lookup": rate(len(sources), lookup_seconds),
+        "parse_and_lookup": rate(len(frames), frame_seconds),
+        "cached_lookup": rate(len(sources), cached_seconds),
+        "cached_addresses": cached.cached_addresses(),
+        "matched_share": matched / len(sources) if sources else 0.0,
+    }
+
+
+def bench_counters(dataset, repeat):
+    import db
+    from ip_lookup import get_ip_lookup
+
+    session = db.get_geoip_session()
+    try:
+        ip_lookup = get_ip_lookup(session)
+    finally:
+        session.close()
+    _, sources = load_packets(dataset)
+    geoname_ids = [gid for gid in map(ip_lookup.lookup, sources) if gid is not None]
+
+    increment = db.increment_packet_freq
+
+    def count_and_flush():
+        started = time.perf_counter()
+        for geoname_id in geoname_ids:
+            increment(geoname_id)
+        counted = time.perf_counter() - started
+        started = time.perf_counter()
+        db.flush_packet_freq()
+        return counted, time.perf_counter() - started
+
+    db.reset_packet_table()
+    runs = [count_and_flush() for _ in range(repeat)]
+    increment_seconds = min(run[0] for run in runs)
+    flush_seconds = min(run[1] for run in runs)
+    window_seconds, _ = best_of(lambda: db.PACKET_WINDOWS.counts(60), repeat)
+    return {
+        "increment": rate(len(geoname_ids), increment_seconds),
+        "flush_seconds": flush_seconds,
+        "flushed_countries": len(set(geoname_ids)),
+        "window_counts_seconds": window_seconds,
+    }
+
+
+def bench_decay(dataset, repeat):
+    # The remote db module shares its name with the hosts, load it under another one
+    remote_db = load_module("remote_db", os.path.join(REMOTE_SRC, "db.py"))
+    rng = random.Random(0)
+
+    with open(dataset["country_csv"], encoding="utf-8") as f:
+        next(f)
+        geoname_ids = [int(line.split(",", 1)[0]) for line in f]
+    remote_db.load_packet_table_sqlite()
+    remote_db.increment_packet_freqs({gid: rng.randint(1, 1000) for gid in geoname_ids})
+
+    def ticks():
+        for _ in range(TICKS):
+            remote_db.decrement_packet_frequencies()
+
+    remote_db.decay_config["mode"] = "linear"
+    linear_seconds, _ = best_of(ticks, repeat)
+    # Exponential decay has no tick, its cost is applying the decay when a batch is counted
+    remote_db.decay_config["mode"] = "exponential"
+    batch = {gid: 1 for gid in geoname_ids}
+    exponential_seconds, _ = best_of(lambda: remote_db.increment_packet_freqs(batch), repeat)
+    remote_db.decay_config["mode"] = "linear"
+    return {
+        "rows": len(geoname_ids),
+        "linear_tick_seconds": linear_seconds / TICKS,
+        "exponential_batch_seconds": exponential_seconds,
+    }
+
+
+"""!
+@brief Random star shaped polygons spread over the -180..180 / -90..90 map
+"""
+def synthetic_polygons(rng):
+    import numpy as np
+
+    angles = np.linspace(0, 2 * np.pi, MAP_VERTICES_PER_POLYGON, endpoint=False)
+    polygons = []
+    for _ in range(MAP_POLYGONS):
+        cx, cy = rng.uniform(-170, 170), rng.uniform(-80, 80)
+        radius = rng.uniform(0.5, 10) * (0.7 + 0.3 * np.sin(angles * rng.randint(2, 7)))
+        polygons.append(np.column_stack((cx + radius * np.cos(angles), cy + radius * np.sin(angles))))
+    vertices = np.concatenate(polygons)
+    offsets = np.arange(0, len(vertices) + 1, MAP_VERTICES_PER_POLYGON)
+    return vertices, offsets
+
+
+def bench_projection(dataset, repeat):
+    from projection import CanvasProjection
+
+    vertices, offsets = synthetic_polygons(random.Random(0))
+    build_seconds, projection = best_of(lambda: CanvasProjection(vertices, offsets), repeat)
+    startup_seconds, _ = best_of(lambda: projection.project_polygons(1920, 1080), repeat)
+    resize_seconds, _ = best_of(lambda: projection.project(1280, 720), repeat)
+    return {
+        "vertices": len(vertices),
+        "polygons": len(offsets) - 1,
+        "build_seconds": build_seconds,
+        "project_polygons_seconds": startup_seconds,
+        "resize_seconds": resize_seconds,
+    }
+
+
+def bench_color_refresh(dataset, repeat):
+    import numpy as np
+    from color_scale import palette_indices, SCALES
+
+    rng = np.random.default_rng(0)
+    countries = dataset["countries"]
+    # Counts that move a little every tick, like a live capture
+    counts = rng.zipf(1.5, countries).astype(np.float64)
+    steps = rng.integers(0, 5, size=(TICKS, countries))
+    results = {}
+    for scale in SCALES:
+        def ticks():
+            last = np.full(countries, -1, dtype=np.int64)
+            changed = 0
+            current = counts.copy()
+            for tick in range(TICKS):
+                current += steps[tick]
+                indices = palette_indices(current, scale, None)
+                changed += int(np.count_nonzero(indices != last))
+                last = indices
+            return changed
+        seconds, changed = best_of(ticks, repeat)
+        results[scale] = {"tick_seconds": seconds / TICKS, "changed_per_tick": changed / TICKS}
+    return results
+
+
+BENCHMARKS = {
+    "csv_ingest": bench_csv_ingest,
+    "lookup": bench_lookup,
+    "counters": bench_counters,
+    "decay": bench_decay,
+    "projection": bench_projection,
+    "color_refresh": bench_color_refresh,
+}
+
+
+"""!
+@brief Flatten nested results to "a.b.c" -> value for comparing
+"""
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+"""!
+@brief Print how every timing/throughput changed against a previous results file
+"""
+def compare(results, baseline_path, machine=None):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline_report = json.load(f)
+    baseline = flatten(baseline_report["results"])
+    baseline_machine = baseline_report.get("meta", {}).get("machine")
+    if machine and baseline_machine != machine:
+        print(f"[Bench] WARNING: {baseline_path} was measured on another machine, the changes below mean little")
+    current = flatten(results)
+    print(f"\n{'metric':<50} {'baseline':>14} {'current':>14} {'change':>8}")
+    for key, value in current.items():
+        old = baseline.get(key)
+        if not old or not (key.endswith("seconds") or key.endswith("per_sec")):
+            continue
+        # Positive is always better: less time, or more per second
+        change = (old / value - 1.0) if key.endswith("seconds") else (value / old - 1.0)
+        print(f"{key:<50} {old:>14.6g} {value:>14.6g} {change:>+8.1%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the GeoIP map hot paths on synthetic data")
+    parser.add_argument("--work-dir", default=None, help="where the dataset is generated (default: a temporary directory)")
+    parser.add_argument("--countries", type=int, default=DEFAULT_COUNTRIES)
+    parser.add_argument("--blocks", type=int, default=DEFAULT_BLOCKS)
+    parser.add_argument("--packets", type=int, default=DEFAULT_PACKETS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="run only these benchmarks")
+    parser.add_argument("--output", default="bench_results.json", help="JSON file to write the results to")
+    parser.add_argument("--compare", default=None, help="previous results JSON file to compare against")
+    args = parser.parse_args(argv)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="geoip_bench_")
+    dataset = generate_dataset(work_dir, args.countries, args.blocks, args.packets, args.seed)
+
+    # The generated config.py comes first so every module imports it instead of the real one
+    sys.path.insert(0, work_dir)
+    sys.path.insert(1, HOST_SRC)
+    # Every benchmark after the ingest one works on the loaded database
+    names = args.only or list(BENCHMARKS)
+    if any(name != "csv_ingest" for name in names):
+        from db import initalize_engines
+        initalize_engines(force=True)
+
+    results = {}
+    for name in names:
+        print(f"[Bench] {name}...")
+        try:
+            results[name] = BENCHMARKS[name](dataset, args.repeat)
+        except ImportError as e:
+            # e.g. numpy missing for the GUI benchmarks on a capture only box
+            print(f"[Bench] Skipping {name}: {e}")
+            results[name] = {"skipped": str(e)}
+
+    machine = {
+        "node": platform.node(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+    report = {
+        "meta": {
+            "time": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": machine,
+            "repeat": args.repeat,
+        },
+        "dataset": {key: dataset[key] for key in ("countries", "blocks", "packets", "matched_packets", "seed")},
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"[Bench] Results written to {args.output}")
+    if args.compare:
+        compare(results, args.compare, machine)
+
+
+if __name__ == "__main__":
+    main()
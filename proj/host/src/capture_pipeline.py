@@ -0,0 +1,320 @@
+"""!
+@file capture_pipeline.py
+@brief Staged receive path: capture -> classify -> aggregate.
+The capture stage only reads raw frames and queues them, a pool of classifier
+workers parses them and looks up the country, and a single aggregator owns every
+counter update. Stages are joined by bounded queues, so a slow database flush
+backs up (or drops, depending on the policy) in our queues instead of stalling
+the capture socket and making the kernel drop packets
+"""
+
+# Standard libraries we need
+import time
+import threading
+from collections import deque
+
+# Local libraries we need
+from fast_capture import (
+    RawSocketCapture, parse_frame, PACKETS_CAPTURED, PACKETS_PARSED,
+    PACKETS_MATCHED, PACKETS_UNMATCHED, LOOKUP_SECONDS,
+)
+import metrics
+
+# How the pipeline is sized
+# workers: number of classifier threads
+# queue_size: frame batches (capture -> classify) or count batches (classify -> aggregate) a queue holds
+# batch_size: frames the capture stage collects before queueing them
+# max_batch_age: seconds the first frame of a partial batch may wait before the batch is queued anyway
+# policy: what the full capture -> classify queue does with a new batch
+#   "block": wait for room (backpressure reaches the capture socket)
+#   "drop_newest": throw away the new batch
+#   "drop_oldest": throw away the oldest queued batch to make room
+# aggregate_policy: same for the classify -> aggregate queue (dropping there loses already matched packets)
+# drain_timeout: seconds a stop waits for the later stages to empty their queues before giving up on them
+pipeline_config = {
+    "workers": 2,
+    "queue_size": 1024,
+    "batch_size": 64,
+    "max_batch_age": 0.05,
+    "policy": "block",
+    "aggregate_policy": "block",
+    "drain_timeout": 5.0,
+}
+POLICIES = ("block", "drop_newest", "drop_oldest")
+# How long a stage waits for work before checking if it was asked to stop
+STAGE_POLL_TIMEOUT = 0.5
+
+# Packets thrown away by a full queue (any stage)
+PACKETS_DROPPED = metrics.counter("packets_dropped", "Packets dropped by a full pipeline queue")
+
+# The pipeline that is running right now (None when the pipeline mode is not in use)
+CURRENT_PIPELINE = None
+
+
+class StageQueue:
+    """A bounded queue of batches with a backpressure policy and drop/depth counters."""
+
+    def __init__(self, name, maxsize, policy="block"):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy {policy!r}, expected one of {POLICIES}")
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self.items = deque()
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+        # Counters (in items, a batch of 64 frames counts as 64)
+        self.enqueued = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    """!
+    @brief Queue a batch of `size` items following the queue policy. A "block" queue
+    waits in STAGE_POLL_TIMEOUT steps and drops the batch once stop_event is set,
+    so a stalled later stage can't keep the caller from stopping
+    Returns: False if a batch was dropped (either this one or the oldest one)
+    """
+    def put(self, batch, size=1, stop_event=None):
+        with self.lock:
+            accepted = True
+            if len(self.items) >= self.maxsize:
+                if self.policy == "drop_newest":
+                    self.dropped += size
+                    PACKETS_DROPPED.add(size)
+                    return False
+                if self.policy == "drop_oldest":
+                    _, old_size = self.items.popleft()
+                    self.dropped += old_size
+                    PACKETS_DROPPED.add(old_size)
+                    accepted = False
+                else:
+                    while len(self.items) >= self.maxsize:
+                        if stop_event is not None and stop_event.is_set():
+                            self.dropped += size
+                            PACKETS_DROPPED.add(size)
+                            return False
+                        self.not_full.wait(STAGE_POLL_TIMEOUT)
+            self.items.append((batch, size))
+            self.enqueued += size
+            self.max_depth = max(self.max_depth, len(self.items))
+            self.not_empty.notify()
+            return accepted
+
+    """!
+    @brief Take the oldest batch, waiting at most `timeout` seconds
+    Returns: the batch or None if the queue stayed empty
+    """
+    def get(self, timeout=STAGE_POLL_TIMEOUT):
+        with self.lock:
+            if not self.items:
+                self.not_empty.wait(timeout)
+                if not self.items:
+                    return None
+            batch, _ = self.items.popleft()
+            self.not_full.notify()
+            return batch
+
+    def stats(self):
+        return {
+            "depth": len(self.items),
+            "max_depth": self.max_depth,
+            "capacity": self.maxsize,
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+        }
+
+
+class CapturePipeline:
+    """Capture, classifier and aggregator threads joined by two StageQueues."""
+
+    def __init__(self, ip_lookup, increment_packet_freq, config=pipeline_config):
+        self.ip_lookup = ip_lookup
+        self.increment_packet_freq = increment_packet_freq
+        self.config = config
+        self.frames = StageQueue("classify", config["queue_size"], config["policy"])
+        self.counts = StageQueue("aggregate", config["queue_size"], config["aggregate_policy"])
+        # Set once the capture stage stopped, the later stages drain their queue and stop
+        self.capture_done = threading.Event()
+        self.classify_done = threading.Event()
+        # Set when the drain timed out, blocked stages stop waiting for room and drop instead
+        self.abort = threading.Event()
+        self.threads = []
+        self.aggregator = None
+        # Per stage counters, only ever written by the stage that owns them
+        # (classifier workers each keep their own and are summed in stats())
+        self.captured = 0
+        self.worker_stats = [
+            {"parsed": 0, "not_tcp": 0, "matched": 0, "unmatched": 0}
+            for _ in range(config["workers"])
+        ]
+        self.aggregated = 0
+
+    """!
+    @brief Queue frames from any source (a raw socket, a scapy callback, a pcap file...)
+    @param stop_event stop waiting for room (and drop the frames) once this is set
+    """
+    def submit(self, frames, stop_event=None):
+        self.captured += len(frames)
+        PACKETS_CAPTURED.add(len(frames))
+        self.frames.put(frames, len(frames), stop_event)
+
+    """!
+    @brief Capture stage: read frames into a buffer and queue copies of them in batches.
+    A batch is queued when it is full or when its first frame is max_batch_age old,
+    so a slow trickle of frames is still counted within max_batch_age
+    """
+    def capture_loop(self, stop_event, iface=None, capture_filter=None):
+        max_batch_age = self.config["max_batch_age"]
+        # Wake up at least every max_batch_age even when no frame arrives
+        capture = RawSocketCapture(
+            iface, timeout=min(max_batch_age, STAGE_POLL_TIMEOUT), capture_filter=capture_filter
+        )
+        batch_size = self.config["batch_size"]
+        try:
+            view = capture.view
+            batch = []
+            batch_started = 0.0
+            while not stop_event.is_set():
+                length = capture.recv()
+                if length:
+                    if not batch:
+                        batch_started = time.monotonic()
+                    batch.append(bytes(view[:length]))
+                    if len(batch) < batch_size and time.monotonic() - batch_started < max_batch_age:
+                        continue
+                # Full batch, old batch or the link went quiet, hand over what we have
+                if batch:
+                    self.submit(batch, stop_event)
+                    batch = []
+            if batch:
+                self.submit(batch, stop_event)
+        finally:
+            capture.close()
+
+    """!
+    @brief Classifier stage: parse every frame, look up its country and queue
+    the per-country counts of the batch
+    """
+    def classify_loop(self, worker):
+        stats = self.worker_stats[worker]
+        lookup = self.ip_lookup.lookup
+        while True:
+            frames = self.frames.get()
+            if frames is None:
+                if self.capture_done.is_set() and not len(self.frames):
+                    return
+                continue
+            counts = {}
+            parsed_count = unmatched = 0
+            timed = False
+            for frame in frames:
+                parsed = parse_frame(frame)
+                if parsed is None:
+                    continue
+                parsed_count += 1
+                if timed:
+                    geoname_id = lookup(parsed[0])
+                else:
+                    # Only the first lookup of a batch is timed
+                    started = time.perf_counter()
+                    geoname_id = lookup(parsed[0])
+                    LOOKUP_SECONDS.observe(time.perf_counter() - started)
+                    timed = True
+                if geoname_id is None:
+                    unmatched += 1
+                    continue
+                counts[geoname_id] = counts.get(geoname_id, 0) + 1
+            matched = parsed_count - unmatched
+            stats["not_tcp"] += len(frames) - parsed_count
+            stats["parsed"] += parsed_count
+            stats["unmatched"] += unmatched
+            stats["matched"] += matched
+            PACKETS_PARSED.add(parsed_count)
+            PACKETS_UNMATCHED.add(unmatched)
+            PACKETS_MATCHED.add(matched)
+            if counts:
+                self.counts.put(counts, sum(counts.values()), self.abort)
+
+    """!
+    @brief Aggregator stage: the only place packet counts are updated
+    """
+    def aggregate_loop(self):
+        while True:
+            counts = self.counts.get()
+            if counts is None:
+                if self.classify_done.is_set() and not len(self.counts):
+                    return
+                continue
+            for geoname_id, count in counts.items():
+                self.increment_packet_freq(geoname_id, count)
+                self.aggregated += count
+
+    """!
+    @brief Start the classifier workers and the aggregator
+    """
+    def start(self):
+        for worker in range(self.config["workers"]):
+            self.threads.append(threading.Thread(target=self.classify_loop, args=(worker,), daemon=True))
+        self.aggregator = threading.Thread(target=self.aggregate_loop, daemon=True)
+        for thread in self.threads:
+            thread.start()
+        self.aggregator.start()
+
+    """!
+    @brief Let the later stages drain whatever is still queued and wait for them,
+    at most drain_timeout seconds. After that blocked classifiers drop their counts
+    and a stalled aggregator is left behind (it is a daemon thread)
+    """
+    def drain(self):
+        self.capture_done.set()
+        deadline = time.monotonic() + self.config["drain_timeout"]
+        for thread in self.threads:
+            thread.join(max(deadline - time.monotonic(), 0.0))
+        if any(thread.is_alive() for thread in self.threads):
+            print("[Pipeline] WARNING: the aggregator is not keeping up, dropping the counts still queued")
+            self.abort.set()
+            for thread in self.threads:
+                thread.join()
+        self.classify_done.set()
+        self.aggregator.join(max(deadline - time.monotonic(), STAGE_POLL_TIMEOUT))
+        if self.aggregator.is_alive():
+            print(f"[Pipeline] WARNING: the aggregator did not stop, {len(self.counts)} count batches were not applied")
+
+    """!
+    @brief Per stage counters and queue depths
+    """
+    def stats(self):
+        classify = {key: sum(stats[key] for stats in self.worker_stats) for key in self.worker_stats[0]}
+        classify.update(self.frames.stats())
+        aggregate = {"aggregated": self.aggregated}
+        aggregate.update(self.counts.stats())
+        return {
+            "capture": {"captured": self.captured},
+            "classify": classify,
+            "aggregate": aggregate,
+        }
+
+
+"""!
+@brief Run the staged pipeline on a raw socket until stop_event is set
+"""
+def pipeline_capture_loop(ip_lookup, increment_packet_freq, stop_event, iface=None, capture_filter=None):
+    global CURRENT_PIPELINE
+    pipeline = CapturePipeline(ip_lookup, increment_packet_freq)
+    CURRENT_PIPELINE = pipeline
+    pipeline.start()
+    started = time.monotonic()
+    try:
+        pipeline.capture_loop(stop_event, iface, capture_filter)
+    finally:
+        pipeline.drain()
+        stats = pipeline.stats()
+        print(
+            f"[Pipeline] {stats['capture']['captured']} frames in {time.monotonic() - started:.1f}s | "
+            f"matched {stats['classify']['matched']} unmatched {stats['classify']['unmatched']} | "
+            f"dropped {stats['classify']['dropped'] + stats['aggregate']['dropped']}"
+        )
@@ -0,0 +1,77 @@
+"""!
+@file color_scale.py
+@brief Heat map colors from a precomputed palette. The green -> red gradient
+is built once, and every tick all country counts are mapped to palette
+indices in one vectorized pass with a pluggable scale (linear, log, percentile)
+"""
+
+# Standard libraries we need
+import colorsys
+
+# Package libraries we need
+import numpy as np
+
+# Number of palette entries, entry 0 is reserved for countries without packets
+PALETTE_SIZE = 256
+# Color of a country without packets
+NO_DATA_COLOR = (255, 255, 255, 255)
+# Scales the GUI can pick between
+SCALES = ("linear", "log", "percentile")
+
+
+"""!
+@brief Build the palette: index 0 is white, 1..PALETTE_SIZE-1 go from green (120°) to red (0°)
+Returns: list of RGBA tuples that can be handed straight to DearPyGui
+"""
+def build_palette(size=PALETTE_SIZE):
+    palette = [NO_DATA_COLOR]
+    for i in range(size - 1):
+        step = i / (size - 2)
+        # Interpolate hue: green (120°) → red (0°)
+        hue = (120 * (1 - step)) / 360.0
+        r_f, g_f, b_f = colorsys.hsv_to_rgb(hue, 1, 1)
+        # Convert floats to 0-255
+        palette.append((int(r_f * 255), int(g_f * 255), int(b_f * 255), 255))
+    return palette
+
+
+# One global palette, only ever built once
+PALETTE = build_palette()
+
+
+"""!
+@brief Normalize counts to 0-1 with the chosen scale
+"""
+def normalize_counts(counts, scale="linear", freq_max=10.0):
+    counts = np.asarray(counts, dtype=np.float64)
+    if freq_max is None or freq_max <= 0:
+        # Scale to the busiest country
+        freq_max = counts.max() if counts.size else 1.0
+        freq_max = max(freq_max, 1.0)
+
+    if scale == "log":
+        # Thousands of packets still spread over the whole gradient
+        return np.minimum(np.log1p(counts) / np.log1p(freq_max), 1.0)
+    if scale == "percentile":
+        # Rank of every country among the countries that have packets
+        steps = np.zeros_like(counts)
+        nonzero = counts > 0
+        active = counts[nonzero]
+        if active.size:
+            ranks = np.searchsorted(np.sort(active), active, side="right")
+            steps[nonzero] = ranks / active.size
+        return steps
+    # Linear (the original behavior)
+    return np.minimum(counts / freq_max, 1.0)
+
+
+"""!
+@brief Map every count to a palette index in one pass (0 means no packets)
+Returns: numpy array of palette indices
+"""
+def palette_indices(counts, scale="linear", freq_max=10.0, size=PALETTE_SIZE):
+    counts = np.asarray(counts, dtype=np.float64)
+    steps = normalize_counts(counts, scale, freq_max)
+    indices = 1 + np.rint(steps * (size - 2)).astype(np.int64)
+    indices[counts <= 0] = 0
+    return indices
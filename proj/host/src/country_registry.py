@@ -0,0 +1,90 @@
+"""!
+@file country_registry.py
+@brief Dense country index built once at startup. Every country in the countries
+table gets an integer 0..n-1 and its geoname_id and name are kept in parallel
+arrays, so counts, colors and polygon handles can live in plain arrays indexed
+by it instead of dictionaries keyed by names or geoname_ids
+"""
+
+# Standard libraries we need
+from array import array
+from threading import Lock
+
+# Package libraries we need
+from sqlalchemy import text
+
+
+# Common database statements (commands)
+# Every country in a stable order so the indexes are the same on every start
+QUERY_REGISTRY_COUNTRIES_STMT = text(
+    "SELECT geoname_id, country_name FROM countries ORDER BY geoname_id"
+)
+
+# One global registry shared by the GUI and the counting side
+COUNTRY_REGISTRY = None
+COUNTRY_REGISTRY_LOCK = Lock()
+
+
+class CountryRegistry:
+    """geoname_id <-> dense index <-> country name."""
+
+    def __init__(self, countries):
+        # Parallel arrays: country i is geoname_ids[i] called names[i]
+        self.geoname_ids = array("q")
+        self.names = []
+        self.index_by_id = {}
+        # Lower case names, the map and the countries table dont always agree on case
+        self.index_by_name = {}
+        for geoname_id, country_name in countries:
+            # Rows without an id (empty/NaN) or repeated ids can't get an index
+            if geoname_id is None or geoname_id != geoname_id or int(geoname_id) in self.index_by_id:
+                continue
+            index = len(self.names)
+            self.geoname_ids.append(int(geoname_id))
+            self.names.append(country_name)
+            self.index_by_id[int(geoname_id)] = index
+            if country_name is not None:
+                self.index_by_name.setdefault(country_name.lower(), index)
+
+    def __len__(self):
+        return len(self.names)
+
+    """!
+    @brief Dense index of a geoname_id or None
+    """
+    def index(self, geoname_id):
+        return self.index_by_id.get(geoname_id)
+
+    """!
+    @brief Dense index of a country name (any case) or None
+    """
+    def index_of_name(self, country_name):
+        return self.index_by_name.get(country_name.lower())
+
+    """!
+    @brief Dense index of every geoname_id, -1 for ids that aren't in the registry
+    Returns: array of indexes in the same order
+    """
+    def indexes(self, geoname_ids):
+        index_by_id = self.index_by_id
+        return array("q", (index_by_id.get(geoname_id, -1) for geoname_id in geoname_ids))
+
+
+"""!
+@brief Build a CountryRegistry from the countries table of a session
+"""
+def build_country_registry(geoip_session):
+    registry = CountryRegistry(geoip_session.execute(QUERY_REGISTRY_COUNTRIES_STMT))
+    print(f"[Registry] Indexed {len(registry)} countries")
+    return registry
+
+
+"""!
+@brief Return the shared CountryRegistry, building it from the database the first time
+"""
+def get_country_registry(geoip_session, rebuild=False):
+    global COUNTRY_REGISTRY
+    with COUNTRY_REGISTRY_LOCK:
+        if COUNTRY_REGISTRY is None or rebuild:
+            COUNTRY_REGISTRY = build_country_registry(geoip_session)
+        return COUNTRY_REGISTRY
@@ -6,30 +6,102 @@ and provide factories to start sessions for our sqllite engines
 
 #Standards libraries needed 
 import time
-from threading import Lock
+from threading import Lock, Event
 
 # Other libraries needed
-import pandas as pd
-from sqlalchemy import create_engine, Column, Integer, Float, String, Boolean, MetaData, Table, text 
+from sqlalchemy import create_engine, event, Column, Integer, Float, MetaData, Table, text 
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool, QueuePool
 
 # Local Libraries we need
+from csv_ingest import load_csv_to_sqlite, NETWORK_RANGE_COLUMNS
+from rolling_counter import RollingWindowCounter
+from freq_snapshot import SnapshotPublisher
+import metrics
 # Per the user agreement I signed I cannot upload the databases I used to the internet
-from config import COUNTRY_CVS, BLOCKS_CVS, GEO_IP_DB_PATH, FREQ_MIN 
+from config import COUNTRY_CVS, BLOCKS_CVS, GEO_IP_DB_PATH
 # -----------------------
 # Database setup
 # -----------------------
-# One  global engines for our main databases  
-GEOIP_ENGINE = create_engine(f"sqlite:///{GEO_IP_DB_PATH}", echo=False)
+# How every connection is set up
+# WAL lets readers (the GUI, stats) read while the writer (the flush thread) commits.
+# synchronous NORMAL only fsyncs at checkpoints in WAL mode, cache_size is in KB when negative,
+# readers: connections kept open for reads, cached_statements: prepared statements kept per connection
+sqlite_config = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -16384,
+    "busy_timeout": 5000,
+    "readers": 4,
+    "cached_statements": 256,
+}
+CONNECT_ARGS = {"check_same_thread": False, "cached_statements": sqlite_config["cached_statements"]}
 
-# One global session for accessing geo IP data
+# The writer: one dedicated connection for loading the CSVs and every packet table write.
+# Writes are serialized by PACKET_LOCK, reads never take it
+GEOIP_ENGINE = create_engine(
+    f"sqlite:///{GEO_IP_DB_PATH}", echo=False, poolclass=StaticPool, connect_args=CONNECT_ARGS
+)
+# The readers: a pool of query only connections, each keeps its prepared statements between calls
+READER_ENGINE = create_engine(
+    f"sqlite:///{GEO_IP_DB_PATH}", echo=False, poolclass=QueuePool,
+    pool_size=sqlite_config["readers"], max_overflow=sqlite_config["readers"], connect_args=CONNECT_ARGS
+)
+
+
+"""!
+@brief PRAGMAs every new connection gets (journal_mode is stored in the database file)
+"""
+def set_connection_pragmas(dbapi_connection, query_only):
+    cursor = dbapi_connection.cursor()
+    try:
+        if not query_only:
+            cursor.execute(f"PRAGMA journal_mode = {sqlite_config['journal_mode']}")
+        cursor.execute(f"PRAGMA synchronous = {sqlite_config['synchronous']}")
+        cursor.execute(f"PRAGMA cache_size = {int(sqlite_config['cache_size'])}")
+        cursor.execute(f"PRAGMA busy_timeout = {int(sqlite_config['busy_timeout'])}")
+        if query_only:
+            cursor.execute("PRAGMA query_only = ON")
+    finally:
+        cursor.close()
+
+@event.listens_for(GEOIP_ENGINE, "connect")
+def on_writer_connect(dbapi_connection, connection_record):
+    set_connection_pragmas(dbapi_connection, query_only=False)
+
+@event.listens_for(READER_ENGINE, "connect")
+def on_reader_connect(dbapi_connection, connection_record):
+    set_connection_pragmas(dbapi_connection, query_only=True)
+
+
+# One global session for accessing geo IP data (read only)
 """ Used with helper function to create session query instance"""
-SESS_GEOIP_FACTORY = sessionmaker(bind=GEOIP_ENGINE)
-# Another session for updating table frequency table
-PACKET_SESSION_FACTORY = sessionmaker(bind=GEOIP_ENGINE)
-# Lock to be extra careful with threading for the packet table
+SESS_GEOIP_FACTORY = sessionmaker(bind=READER_ENGINE)
+# Serializes the writers of the packet table (the writer connection is shared between threads)
 PACKET_LOCK = Lock()
 
+# In memory packet counts waiting to be flushed to the packet table
+# geoname_id -> number of packets since the last flush
+PENDING_COUNTS = {}
+# geoname_id -> time the last packet for that country was counted
+PENDING_TIMES = {}
+PENDING_TOTAL = 0
+# Hot path metrics (see metrics.py)
+FLUSH_SECONDS = metrics.histogram("db_flush_seconds", "Time to write a batch of counts to the packet table")
+PACKETS_FLUSHED = metrics.counter("packets_flushed", "Packets written to the packet table")
+# Lock for the pending counts, only ever held for a dictionary update or swap
+PENDING_LOCK = Lock()
+# Set when enough packets are pending that the flush thread should not wait for its interval
+FLUSH_EVENT = Event()
+# How often (seconds) or after how many packets the pending counts are flushed
+flush_config = {"interval": 1.0, "batch_size": 1000}
+# Packets per country over the last 10s/60s/300s, never needs a destructive reset
+PACKET_WINDOWS = RollingWindowCounter()
+# Every countries count as of the last flush, published for lock free readers (see freq_snapshot.py)
+FREQUENCY_SNAPSHOTS = SnapshotPublisher(PACKET_WINDOWS.windows)
+# Set once the totals were loaded from the packet table (see seed_frequency_snapshot())
+FREQUENCY_SNAPSHOTS_SEEDED = False
+
 # Common database statements (commands)
 #-- Used by decrement_packet_frequencies()--#
 # Search for all packet records and return the records with geoname_id and frequency
@@ -58,6 +130,22 @@ PACKET_ADD_STMT = text(
 PACKET_UPDATE_STMT = text(
     "UPDATE packet SET frequency = :frequency, request_time = :request_time WHERE geoname_id = :gid"
 )
+#-- Used by flush_packet_freq()--#
+# Add a batch of packet counts, creating the records that dont exist yet
+PACKET_UPSERT_STMT = text(
+    "INSERT INTO packet (geoname_id, frequency, request_time) VALUES (:geoname_id, :frequency, :request_time) "
+    "ON CONFLICT(geoname_id) DO UPDATE SET frequency = frequency + excluded.frequency, request_time = excluded.request_time"
+)
+#-- Used by get_country_frequencies()--#
+# Every country that has packets and its frequency in one joined query
+PACKET_COUNTRY_FREQ_STMT = text(
+    "SELECT c.country_name, p.frequency FROM packet p JOIN countries c ON c.geoname_id = p.geoname_id"
+)
+#-- Used by seed_frequency_snapshot()--#
+# Every countries count kept in the packet table
+PACKET_ALL_FREQ_STMT = text(
+    "SELECT geoname_id, frequency FROM packet"
+)
 #-- generic packet search query for packet table--# 
 PACKET_SEARCH_ID_STMT = text(
     "SELECT geoname_id, frequency, request_time FROM packet WHERE geoname_id = :gid"
@@ -65,15 +153,6 @@ PACKET_SEARCH_ID_STMT = text(
 
 
 
-"""!
-@brief Load a passed csv_file into a engine
-"""
-def load_csv_to_sqlite(csv_file, table_name, engine):
-    """Load CSV into SQLite using pandas"""
-    df = pd.read_csv(csv_file)
-    df.to_sql(table_name, engine, if_exists="replace", index=False)
-    print(f"Loaded {len(df)} rows into table '{table_name}'")
-    
 """!
 @brief Load packet table to the database
 """
@@ -99,20 +178,27 @@ def load_packet_table_sqlite():
 """!
 @brief Initialize our two databases with our two csv files
 """
-def initalize_engines(): 
-    # 2. Load CSVs into DBs
+def initalize_engines(force=False): 
+    # 2. Load CSVs into DBs (skipped for a CSV that hasn't changed since the last load)
     print("Loading GEOIP_ENGINE with CSV data")
-    load_csv_to_sqlite(COUNTRY_CVS, "countries", GEOIP_ENGINE)
-    load_csv_to_sqlite(BLOCKS_CVS, "blocks", GEOIP_ENGINE)
+    load_csv_to_sqlite(
+        COUNTRY_CVS, "countries", GEOIP_ENGINE,
+        indexes=("geoname_id", "country_name"), force=force
+    )
+    load_csv_to_sqlite(
+        BLOCKS_CVS, "blocks", GEOIP_ENGINE,
+        computed_columns=NETWORK_RANGE_COLUMNS,
+        indexes=("network", "geoname_id", "network_start"), force=force
+    )
     load_packet_table_sqlite()
     print("Initialization complete.")
 
 """!
-@brief helper function to return a  GEOIP_ENGINE session to 
+@brief helper function to return a read only session to 
 query the engine
 """
 def get_geoip_session():
-    """Returns a new session bound to the combined GEOIP_ENGINE database."""
+    """Returns a new session bound to the pooled reader connections."""
     return SESS_GEOIP_FACTORY()
 
 
@@ -123,75 +209,137 @@ def reset_packet_table():
     """
     Clears the packet table completely, removing all records.
     """
+    global PENDING_TOTAL
+    with PACKET_LOCK:
+        # Counts that havent been flushed yet belong to the table being wiped
+        with PENDING_LOCK:
+            PENDING_COUNTS.clear()
+            PENDING_TIMES.clear()
+            PENDING_TOTAL = 0
+        PACKET_WINDOWS.clear()
+        FREQUENCY_SNAPSHOTS.clear()
+        publish_frequency_snapshot()
+        with GEOIP_ENGINE.connect() as conn:
+            try:
+                # Delete all rows from the packet table
+                conn.execute(PACKET_DELETE_ALL_STMT)
+                conn.commit()
+                print("[Reset] All rows deleted from packet table.")
+            except Exception as e:
+                conn.rollback()
+                print(f"[Error] Failed to delete packet table: {e}")
+
+"""!
+@brief Fetch the packet frequency of every country in one query
+Returns: dictionary of country_name -> frequency (countries without packets are left out)
+"""
+def get_country_frequencies():
+    # WAL readers see the last commit without waiting for (or blocking) the writer
+    with READER_ENGINE.connect() as conn:
+        records = conn.execute(PACKET_COUNTRY_FREQ_STMT).fetchall()
+    return {country_name: frequency for country_name, frequency in records}
+
+"""!
+@brief Publish the counts as of now for get_frequency_snapshot() readers,
+called by the writer (with PACKET_LOCK held) after every flush
+"""
+def publish_frequency_snapshot():
+    return FREQUENCY_SNAPSHOTS.publish({window: PACKET_WINDOWS.counts(window) for window in PACKET_WINDOWS.windows})
+
+"""!
+@brief Lay the published counts out in CountryRegistry order, so slot i of every
+snapshot array is registry index i (countries outside the registry come after)
+"""
+def use_country_registry(registry):
+    with PACKET_LOCK:
+        FREQUENCY_SNAPSHOTS.reserve(registry.geoname_ids)
+        return publish_frequency_snapshot()
+
+"""!
+@brief Load the counts the packet table kept from the last run into the published
+totals, with one query, and publish them. Only the first call at startup reads the
+table, later calls just return the current snapshot
+"""
+def seed_frequency_snapshot():
+    global FREQUENCY_SNAPSHOTS_SEEDED
     with PACKET_LOCK:
-        session = PACKET_SESSION_FACTORY()
-        try:
-            # Delete all rows from the packet table
-            session.execute(PACKET_DELETE_ALL_STMT)
-            session.commit()
-            print("[Reset] All rows deleted from packet table.")
-        except Exception as e:
-            session.rollback()
-            print(f"[Error] Failed to delete packet table: {e}")
-        finally:
-            session.close()
+        if FREQUENCY_SNAPSHOTS_SEEDED:
+            return FREQUENCY_SNAPSHOTS.latest()
+        # Every flush commits with PACKET_LOCK held, so the table holds every flushed count
+        # and replacing the running totals with it never counts a packet twice
+        with READER_ENGINE.connect() as conn:
+            records = conn.execute(PACKET_ALL_FREQ_STMT).fetchall()
+        FREQUENCY_SNAPSHOTS.clear()
+        FREQUENCY_SNAPSHOTS.add({geoname_id: frequency for geoname_id, frequency in records if frequency})
+        FREQUENCY_SNAPSHOTS_SEEDED = True
+        print(f"[Snapshot] Seeded counts of {len(records)} countries from the packet table")
+        return publish_frequency_snapshot()
+
+"""!
+@brief The latest published counts (a FrequencySnapshot), never blocks and never queries.
+Compare its generation with the last one seen to skip work when nothing changed
+"""
+def get_frequency_snapshot():
+    return FREQUENCY_SNAPSHOTS.latest()
 
 """!
-@brief Increment or create a record for a geonome_id  
+@brief Count `count` packets for a geonome_id in memory, the count is written 
+to the packet table by the next flush_packet_freq()
 """
-def increment_packet_freq(geoname_id):
-    #print("incrementing packet frequency")
+def increment_packet_freq(geoname_id, count=1):
+    global PENDING_TOTAL
+    curr_time = time.time()
+    with PENDING_LOCK:
+        PENDING_COUNTS[geoname_id] = PENDING_COUNTS.get(geoname_id, 0) + count
+        PENDING_TIMES[geoname_id] = curr_time
+        PENDING_TOTAL += count
+        # Wake the flush thread early if the batch is full
+        if PENDING_TOTAL >= flush_config["batch_size"]:
+            FLUSH_EVENT.set()
+    PACKET_WINDOWS.add(geoname_id, count)
+
+"""!
+@brief Write every pending packet count to the packet table in one transaction.
+Also used as the drain hook before shutdown
+Returns: the number of packets flushed
+"""
+def flush_packet_freq():
+    global PENDING_TOTAL
     with PACKET_LOCK:
-        session = PACKET_SESSION_FACTORY()
-        try:
-            # 1. Get the current time and see if a record for a current country already exists
-            curr_time = time.time()
-            result = session.execute(PACKET_ADD_SEARCH_FREQ_STMT, {"gid": geoname_id}).fetchone()
-
-            if result is None:
-                # 2. If a record wasnt found, create one, stage the change
-                old_freq = 0
-                new_freq = 1
-                session.execute(
-                    PACKET_ADD_STMT,
-                    {"geoname_id": geoname_id, "frequency": new_freq, "request_time": curr_time},
-                )
-                #action = "Inserted"
-                #print(f"---added new for gid{geoname_id}")
-            else:
-                # 2. if a record was found, update it, stage the change 
-                old_freq, _ = result
-                new_freq = old_freq + 1
-                session.execute(
-                    PACKET_UPDATE_STMT,
-                    {"frequency": new_freq, "request_time": curr_time, "gid": geoname_id},
-                )
-                #action = "Updated"
-                #print(f"---updated for gid: {geoname_id}")
-
-            # Push the changes
-            session.commit()
-            #print("commited incrementing packet frequency")
-            #---DEBUG---#
-            # Fetch and print the updated record 
-            # Fetch updated record for debug
-            #updated_row = session.execute(PACKET_SEARCH_ID_STMT, {"gid": geoname_id}).fetchone()
-            #if updated_row:
-            #    updated_gid, freq_after, req_time_after = updated_row
-            #    print(
-            #        f"[{action}] row: geoname_id={updated_gid} | old_freq={old_freq} → new_freq={freq_after} | request_time={req_time_after}"
-            #    )
-            #else:
-            #    print(f"[{action}] ERROR: Cannot find packet record after operation for geoname_id={geoname_id}")
-
-
-
-        except Exception as e:
-            # If the changes werent accepted roll back what might have happened
-            #---DEBUG---#
-            #print(f"failed update or add a packet record for geoname_id={geoname_id}: {e}")
-            session.rollback()
-        finally:
-            # Close the session
-            #print("finished incrementing packet frequency")
-            session.close()
\ No newline at end of file
+        # 1. Swap out the pending counts so counting can continue while we write
+        with PENDING_LOCK:
+            counts = dict(PENDING_COUNTS)
+            times = dict(PENDING_TIMES)
+            total = PENDING_TOTAL
+            PENDING_COUNTS.clear()
+            PENDING_TIMES.clear()
+            PENDING_TOTAL = 0
+        if not counts:
+            # Nothing new to write, but the sliding windows may have moved
+            publish_frequency_snapshot()
+            return 0
+
+        # 2. Build one row per country and upsert them all with a single executemany
+        rows = [
+            {"geoname_id": geoname_id, "frequency": count, "request_time": times[geoname_id]}
+            for geoname_id, count in counts.items()
+        ]
+        with GEOIP_ENGINE.connect() as conn:
+            try:
+                with FLUSH_SECONDS.time():
+                    conn.execute(PACKET_UPSERT_STMT, rows)
+                    conn.commit()
+                PACKETS_FLUSHED.add(total)
+                FREQUENCY_SNAPSHOTS.add(counts)
+                publish_frequency_snapshot()
+                return total
+            except Exception as e:
+                # If the changes werent accepted put the counts back for the next flush
+                conn.rollback()
+                print(f"[Error] Failed to flush packet counts: {e}")
+                with PENDING_LOCK:
+                    for geoname_id, count in counts.items():
+                        PENDING_COUNTS[geoname_id] = PENDING_COUNTS.get(geoname_id, 0) + count
+                        PENDING_TIMES.setdefault(geoname_id, times[geoname_id])
+                    PENDING_TOTAL += total
+                return 0
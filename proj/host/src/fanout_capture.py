@@ -0,0 +1,200 @@
+"""!
+@file fanout_capture.py
+@brief Multi-core capture. N worker processes each open a raw socket in the
+same PACKET_FANOUT group, so the kernel spreads the traffic over them. Every
+worker parses and looks up its own packets (no GIL to share) and keeps local
+per-country counts that are merged into the shared packet counts periodically.
+The receiver already runs the flush, reset and GUI threads when the workers start,
+and fork() only copies the calling thread: a lock another thread held at that moment
+(the logging, database or lookup cache locks) stays locked forever in the child.
+So the workers come from a forkserver (a clean single threaded process) and get
+the flattened lookup tables pickled instead of inheriting them
+"""
+
+# Standard libraries we need
+import os
+import time
+import queue
+import multiprocessing
+
+# Local libraries we need
+from fast_capture import (
+    RawSocketCapture, parse_frame, PACKETS_CAPTURED, PACKETS_PARSED, PACKETS_MATCHED, PACKETS_UNMATCHED,
+)
+from ip_lookup import LOOKUP_CACHE_HITS, LOOKUP_CACHE_MISSES, LOOKUP_CACHE_EVICTIONS
+
+# How the fanout capture runs
+# workers: number of capture processes (None uses every CPU)
+# mode: how the kernel picks a worker for a packet, "hash" keeps a flow on one worker,
+#       "cpu" uses the CPU that received the packet, "lb" is round robin
+# merge_interval: seconds between a worker sending its counts to the receiver process
+# start_method: how worker processes are created, "forkserver" or "spawn" (both pickle the lookup tables)
+fanout_config = {"workers": None, "mode": "hash", "merge_interval": 0.5, "start_method": "forkserver"}
+
+# Worker counters -> the receivers metrics they are merged into
+WORKER_METRICS = {
+    "captured": PACKETS_CAPTURED,
+    "parsed": PACKETS_PARSED,
+    "matched": PACKETS_MATCHED,
+    "unmatched": PACKETS_UNMATCHED,
+    "cache_hits": LOOKUP_CACHE_HITS,
+    "cache_misses": LOOKUP_CACHE_MISSES,
+    "cache_evictions": LOOKUP_CACHE_EVICTIONS,
+}
+# Worker counters read from the workers own copy of the metrics
+CACHE_STATS = ("cache_hits", "cache_misses", "cache_evictions")
+
+# The fanout capture that is running right now (None when the fanout mode is not in use)
+CURRENT_FANOUT = None
+
+
+"""!
+@brief Worker process: capture our share of the fanout group and send the
+per-country counts to the receiver every merge_interval
+"""
+def fanout_worker(worker, ip_lookup, iface, capture_filter, group_id, mode, merge_interval, results, stop_event):
+    capture = RawSocketCapture(iface, capture_filter=capture_filter)
+    capture.join_fanout(group_id, mode)
+    # A CachedIPLookup arrives with an empty cache of its own (the kernel hash keeps a source on one worker).
+    # It is a copy: a GeoIP reload in the receiver only reaches the workers when the capture restarts
+    lookup = ip_lookup.lookup
+    buffer = capture.buffer
+    counts = {}
+    stats = {"captured": 0, "parsed": 0, "matched": 0, "unmatched": 0}
+    # Only send what this worker adds to its own copy of the cache counters
+    cache_base = {key: WORKER_METRICS[key].value for key in CACHE_STATS}
+
+    def worker_stats():
+        for key in CACHE_STATS:
+            stats[key] = WORKER_METRICS[key].value - cache_base[key]
+        return dict(stats)
+    next_merge = time.monotonic() + merge_interval
+    try:
+        while not stop_event.is_set():
+            length = capture.recv()
+            if length:
+                stats["captured"] += 1
+                parsed = parse_frame(buffer, length)
+                if parsed is not None:
+                    stats["parsed"] += 1
+                    geoname_id = lookup(parsed[0])
+                    if geoname_id is None:
+                        stats["unmatched"] += 1
+                    else:
+                        stats["matched"] += 1
+                        counts[geoname_id] = counts.get(geoname_id, 0) + 1
+            now = time.monotonic()
+            if now >= next_merge:
+                results.put((worker, counts, worker_stats()))
+                counts = {}
+                next_merge = now + merge_interval
+    finally:
+        # Whatever was counted since the last merge
+        results.put((worker, counts, worker_stats()))
+        capture.close()
+
+
+class FanoutCapture:
+    """The worker processes of one fanout group and the merge of their counts."""
+
+    def __init__(self, ip_lookup, increment_packet_freq, iface=None, capture_filter=None, config=fanout_config):
+        self.ip_lookup = ip_lookup
+        self.increment_packet_freq = increment_packet_freq
+        self.iface = iface
+        self.capture_filter = capture_filter
+        self.config = config
+        self.worker_count = config["workers"] or os.cpu_count() or 1
+        # Fanout group ids are per network namespace, use our pid so two receivers never share one
+        self.group_id = os.getpid() & 0xFFFF
+        # Never plain fork, the receiver is multithreaded by now (see the module docstring)
+        self.context = multiprocessing.get_context(config["start_method"])
+        self.results = self.context.Queue()
+        self.stop_event = self.context.Event()
+        self.processes = []
+        # Latest counters reported by every worker
+        self.worker_stats = [{} for _ in range(self.worker_count)]
+        self.merged = 0
+
+    def start(self):
+        for worker in range(self.worker_count):
+            process = self.context.Process(
+                target=fanout_worker,
+                args=(
+                    worker, self.ip_lookup, self.iface, self.capture_filter, self.group_id,
+                    self.config["mode"], self.config["merge_interval"], self.results, self.stop_event,
+                ),
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+        print(f"[Fanout] Started {self.worker_count} capture workers ({self.config['mode']} mode)")
+
+    """!
+    @brief Apply one workers counts to the shared packet counts
+    """
+    def merge(self, result):
+        worker, counts, stats = result
+        for geoname_id, count in counts.items():
+            self.increment_packet_freq(geoname_id, count)
+            self.merged += count
+        # Workers have their own copy of the metrics, add what changed since their last report
+        previous = self.worker_stats[worker]
+        for key, metric in WORKER_METRICS.items():
+            metric.add(stats[key] - previous.get(key, 0))
+        self.worker_stats[worker] = stats
+
+    """!
+    @brief Merge worker counts until stop_event is set, then stop the workers and merge what is left
+    """
+    def run(self, stop_event):
+        while not stop_event.is_set():
+            try:
+                self.merge(self.results.get(timeout=self.config["merge_interval"]))
+            except queue.Empty:
+                pass
+            if not any(process.is_alive() for process in self.processes):
+                print("[Fanout] Every capture worker exited")
+                break
+        self.stop()
+
+    def stop(self):
+        self.stop_event.set()
+        # Keep reading while the workers exit, a worker can't exit before its queue is flushed
+        while any(process.is_alive() for process in self.processes):
+            try:
+                self.merge(self.results.get(timeout=0.1))
+            except queue.Empty:
+                pass
+        while True:
+            try:
+                self.merge(self.results.get_nowait())
+            except queue.Empty:
+                break
+        for process in self.processes:
+            process.join()
+
+    """!
+    @brief Counters of every worker summed up
+    """
+    def stats(self):
+        totals = {"workers": self.worker_count, "merged": self.merged}
+        for stats in self.worker_stats:
+            for key, value in stats.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+
+"""!
+@brief Capture with a fanout group of worker processes until stop_event is set
+"""
+def fanout_capture_loop(ip_lookup, increment_packet_freq, stop_event, iface=None, capture_filter=None):
+    global CURRENT_FANOUT
+    fanout = FanoutCapture(ip_lookup, increment_packet_freq, iface, capture_filter)
+    CURRENT_FANOUT = fanout
+    fanout.start()
+    fanout.run(stop_event)
+    stats = fanout.stats()
+    print(
+        f"[Fanout] {stats.get('captured', 0)} frames on {stats['workers']} workers | "
+        f"matched {stats.get('matched', 0)} unmatched {stats.get('unmatched', 0)}"
+    )
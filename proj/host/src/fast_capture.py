@@ -0,0 +1,263 @@
+"""!
+@file fast_capture.py
+@brief Scapy-free capture path for the receiver. Frames are read from an
+AF_PACKET socket into one preallocated buffer and the Ethernet/IPv4/TCP
+headers are parsed with struct offsets, only pulling out the fields we need
+(source address, destination port, TCP flags and where the payload is)
+"""
+
+# Standard libraries we need
+import time
+import ctypes
+import socket
+import struct
+
+# Local libraries we need
+import metrics
+
+# Ethernet types we understand
+ETH_TYPE_IPV4 = 0x0800
+ETH_TYPE_VLAN = 0x8100
+ETH_P_IP = 0x0800
+ETH_HEADER_LEN = 14
+VLAN_TAG_LEN = 4
+IP_PROTO_TCP = 6
+# Big enough for any frame on the wire (jumbo frames included)
+CAPTURE_BUFFER_SIZE = 65535
+# How long a recv blocks before checking if we were asked to stop
+CAPTURE_POLL_TIMEOUT = 0.5
+# Only every Nth lookup is timed, timing costs about as much as the lookup itself
+LOOKUP_SAMPLE_EVERY = 16
+# PACKET_FANOUT socket option (linux/if_packet.h), not exported by the socket module
+SOL_PACKET = 263
+PACKET_FANOUT = 18
+FANOUT_MODES = {"hash": 0, "lb": 1, "cpu": 2}
+# Classic BPF (linux/filter.h): attach option and the instruction codes our filter uses
+SO_ATTACH_FILTER = 26
+BPF_LD_H_ABS = 0x28     # A = 16 bits at [k]
+BPF_LD_B_ABS = 0x30     # A = 8 bits at [k]
+BPF_LD_W_ABS = 0x20     # A = 32 bits at [k]
+BPF_LD_H_IND = 0x48     # A = 16 bits at [X + k]
+BPF_LD_B_IND = 0x50     # A = 8 bits at [X + k]
+BPF_LDX_B_MSH = 0xB1    # X = 4 * ([k] & 0x0F), the IP header length
+BPF_JEQ_K = 0x15        # A == k ? jt : jf
+BPF_JSET_K = 0x45       # A & k ? jt : jf
+BPF_RET_K = 0x06        # accept k bytes (0 drops the frame)
+BPF_ACCEPT_LEN = 0x40000
+TCP_FLAG_SYN = 0x02
+
+# Hot path metrics (see metrics.py), the same ones every capture mode records
+PACKETS_CAPTURED = metrics.counter("packets_captured", "Frames read from the capture")
+PACKETS_PARSED = metrics.counter("packets_parsed", "Frames that were IPv4/TCP")
+PACKETS_MATCHED = metrics.counter("packets_matched", "Packets matched to a country")
+PACKETS_UNMATCHED = metrics.counter("packets_unmatched", "Packets without a matching block")
+LOOKUP_SECONDS = metrics.histogram("lookup_seconds", "Source address to country lookup time")
+
+# Precompiled struct readers (unpack_from reads straight out of the buffer, no slicing)
+_ETH_TYPE = struct.Struct("!H")
+_IP_HEADER = struct.Struct("!BxHxxHBB2xII")     # version/ihl, total length, fragment, ttl, protocol, src, dst
+_TCP_HEADER = struct.Struct("!HH8xBB")          # src port, dst port, data offset, flags
+
+
+"""!
+@brief Parse an Ethernet/IPv4/TCP frame
+@param frame bytes, bytearray or memoryview holding the frame
+@param length number of valid bytes in frame (defaults to all of it)
+Returns: (src_ip as an integer, dst_port, tcp_flags, payload_offset, payload_end)
+or None if the frame isnt IPv4/TCP or is truncated
+"""
+def parse_frame(frame, length=None):
+    if length is None:
+        length = len(frame)
+    if length < ETH_HEADER_LEN + 20 + 20:
+        return None
+
+    # 1. Ethernet (skip one 802.1Q tag if there is one)
+    offset = ETH_HEADER_LEN
+    (eth_type,) = _ETH_TYPE.unpack_from(frame, 12)
+    if eth_type == ETH_TYPE_VLAN:
+        (eth_type,) = _ETH_TYPE.unpack_from(frame, 16)
+        offset += VLAN_TAG_LEN
+    if eth_type != ETH_TYPE_IPV4:
+        return None
+
+    # 2. IPv4, only unfragmented (or first fragment) TCP
+    if length < offset + 20:
+        return None
+    version_ihl, total_len, fragment, _, protocol, src_ip, _ = _IP_HEADER.unpack_from(frame, offset)
+    if version_ihl >> 4 != 4 or protocol != IP_PROTO_TCP or fragment & 0x1FFF:
+        return None
+    ip_header_len = (version_ihl & 0x0F) * 4
+    ip_end = min(offset + total_len, length)
+    offset += ip_header_len
+
+    # 3. TCP
+    if ip_end < offset + 20:
+        return None
+    _, dst_port, data_offset, flags = _TCP_HEADER.unpack_from(frame, offset)
+    payload_offset = offset + (data_offset >> 4) * 4
+    return src_ip, dst_port, flags, payload_offset, max(ip_end, payload_offset)
+
+
+"""!
+@brief The IPv4/TCP checks of the capture filter for an IP header starting at `ip_offset`,
+ending in "accept". Failed tests jump to `drop` (filled in by build_bpf_program())
+"""
+def bpf_ipv4_tcp_checks(ip_offset, dest_ip, dest_port, syn_only, drop):
+    program = [
+        (BPF_LD_B_ABS, 0, 0, ip_offset + 9),                # IP protocol
+        (BPF_JEQ_K, 0, drop, IP_PROTO_TCP),
+    ]
+    if dest_ip:
+        program += [
+            (BPF_LD_W_ABS, 0, 0, ip_offset + 16),           # IP destination
+            (BPF_JEQ_K, 0, drop, int.from_bytes(socket.inet_aton(dest_ip), "big")),
+        ]
+    if dest_port is not None or syn_only:
+        program += [
+            (BPF_LD_H_ABS, 0, 0, ip_offset + 6),            # later fragments have no TCP header
+            (BPF_JSET_K, drop, 0, 0x1FFF),
+            (BPF_LDX_B_MSH, 0, 0, ip_offset),               # X = IP header length
+        ]
+    if dest_port is not None:
+        program += [
+            (BPF_LD_H_IND, 0, 0, ip_offset + 2),            # TCP destination port
+            (BPF_JEQ_K, 0, drop, int(dest_port)),
+        ]
+    if syn_only:
+        program += [
+            (BPF_LD_B_IND, 0, 0, ip_offset + 13),           # TCP flags
+            (BPF_JSET_K, 0, drop, TCP_FLAG_SYN),
+        ]
+    return program + [(BPF_RET_K, 0, 0, BPF_ACCEPT_LEN)]
+
+
+"""!
+@brief Build the kernel capture filter for "tcp [and dst host IP] [and dst port PORT] [and SYN set]"
+as classic BPF instructions, accepting the same IPv4 frames tcpdump would (802.1Q tagged frames
+included, like parse_frame), so the raw capture modes need neither scapy nor libpcap to drop
+unwanted frames in the kernel
+Returns: list of (code, jt, jf, k)
+"""
+def build_bpf_program(dest_ip=None, dest_port=None, syn_only=False):
+    # Every test jumps to "drop" when it fails, jump offsets are filled in at the end
+    DROP = "drop"
+    untagged = bpf_ipv4_tcp_checks(ETH_HEADER_LEN, dest_ip, dest_port, syn_only, DROP)
+    tagged = bpf_ipv4_tcp_checks(ETH_HEADER_LEN + VLAN_TAG_LEN, dest_ip, dest_port, syn_only, DROP)
+    program = [
+        (BPF_LD_H_ABS, 0, 0, 12),                           # Ethernet type
+        (BPF_JEQ_K, 0, len(untagged), ETH_TYPE_IPV4),       # not IPv4: skip to the VLAN test
+    ] + untagged + [
+        (BPF_JEQ_K, 0, DROP, ETH_TYPE_VLAN),
+        (BPF_LD_H_ABS, 0, 0, 12 + VLAN_TAG_LEN),            # Ethernet type inside the tag
+        (BPF_JEQ_K, 0, DROP, ETH_TYPE_IPV4),
+    ] + tagged + [(BPF_RET_K, 0, 0, 0)]
+
+    drop = len(program) - 1
+    return [
+        (code, drop - i - 1 if jt == DROP else jt, drop - i - 1 if jf == DROP else jf, k)
+        for i, (code, jt, jf, k) in enumerate(program)
+    ]
+
+
+class RawSocketCapture:
+    """An AF_PACKET socket that reads IPv4 frames into one reusable buffer."""
+
+    def __init__(self, iface=None, timeout=CAPTURE_POLL_TIMEOUT, capture_filter=None):
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_IP))
+        if iface:
+            self.sock.bind((iface, 0))
+        if capture_filter:
+            self.attach_filter(capture_filter, iface)
+        self.sock.settimeout(timeout)
+        self.buffer = bytearray(CAPTURE_BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+
+    """!
+    @brief Attach a classic BPF program (see build_bpf_program()) so unwanted frames are dropped in the kernel
+    """
+    def attach_filter(self, capture_filter, iface=None):
+        instructions = b"".join(struct.pack("HBBI", *instruction) for instruction in capture_filter)
+        # The kernel copies the program while attaching it, the buffer only has to outlive the call
+        program = ctypes.create_string_buffer(instructions)
+        fprog = struct.pack("HL", len(capture_filter), ctypes.addressof(program))
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+        except OSError as e:
+            print(
+                f"[Capture] WARNING: could not attach the kernel capture filter ({e}), "
+                f"every IPv4 TCP frame on {iface or 'every interface'} will be read and counted"
+            )
+
+    """!
+    @brief Read the next frame into the buffer
+    Returns: number of bytes read, 0 if the poll timeout passed without a frame
+    """
+    def recv(self):
+        try:
+            return self.sock.recv_into(self.buffer)
+        except socket.timeout:
+            return 0
+
+    """!
+    @brief Join a PACKET_FANOUT group, the kernel then spreads the groups frames
+    over every socket in it (by flow hash, round robin or receiving CPU)
+    """
+    def join_fanout(self, group_id, mode="hash"):
+        self.sock.setsockopt(SOL_PACKET, PACKET_FANOUT, (group_id & 0xFFFF) | (FANOUT_MODES[mode] << 16))
+
+    def close(self):
+        self.sock.close()
+
+
+# What count_frame() did with a frame
+FRAME_NOT_TCP = "not_tcp"
+FRAME_UNMATCHED = "unmatched"
+FRAME_MATCHED = "matched"
+
+
+"""!
+@brief Count one captured frame: parse it, look up its source address and count the
+packet for its country, recording the hot path metrics on the way. Every path that
+reads raw frames (the raw socket capture and the pcap replay) goes through here
+@param timed also record how long the lookup took (see LOOKUP_SAMPLE_EVERY)
+Returns: FRAME_NOT_TCP, FRAME_UNMATCHED or FRAME_MATCHED
+"""
+def count_frame(frame, length, lookup, increment_packet_freq, timed=False):
+    PACKETS_CAPTURED.inc()
+    parsed = parse_frame(frame, length)
+    if parsed is None:
+        return FRAME_NOT_TCP
+    PACKETS_PARSED.inc()
+    if not timed:
+        geoname_id = lookup(parsed[0])
+    else:
+        started = time.perf_counter()
+        geoname_id = lookup(parsed[0])
+        LOOKUP_SECONDS.observe(time.perf_counter() - started)
+    if geoname_id is None:
+        PACKETS_UNMATCHED.inc()
+        return FRAME_UNMATCHED
+    PACKETS_MATCHED.inc()
+    increment_packet_freq(geoname_id)
+    return FRAME_MATCHED
+
+
+"""!
+@brief Capture with a raw socket and count every TCP packet we can match to a country,
+until stop_event is set
+"""
+def raw_capture_loop(ip_lookup, increment_packet_freq, stop_event, iface=None, capture_filter=None):
+    capture = RawSocketCapture(iface, capture_filter=capture_filter)
+    try:
+        buffer = capture.buffer
+        lookup = ip_lookup.lookup
+        captured = 0
+        while not stop_event.is_set():
+            length = capture.recv()
+            if not length:
+                continue
+            captured += 1
+            count_frame(buffer, length, lookup, increment_packet_freq, not captured % LOOKUP_SAMPLE_EVERY)
+    finally:
+        capture.close()
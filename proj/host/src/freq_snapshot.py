@@ -0,0 +1,137 @@
+"""!
+@file freq_snapshot.py
+@brief Double buffered packet count snapshots. The flush thread keeps the running
+counts and, after every flush, publishes an immutable snapshot (dense counts plus
+a generation number) by swapping a single reference. Readers (the GUI, the stats
+endpoint) take whatever snapshot is current without a lock or a query and can skip
+their work entirely when the generation hasn't changed
+"""
+
+# Standard libraries we need
+import time
+from array import array
+
+
+class FrequencySnapshot:
+    """Every countries counts at one point in time, never changed once published."""
+
+    __slots__ = ("generation", "geoname_ids", "slots", "totals", "windows", "published")
+
+    def __init__(self, generation, geoname_ids, slots, totals, windows, published):
+        self.generation = generation
+        # slot -> geoname_id and geoname_id -> slot
+        self.geoname_ids = geoname_ids
+        self.slots = slots
+        # Packets per slot since the last reset, and per slot in the last `window` seconds
+        self.totals = totals
+        self.windows = windows
+        self.published = published
+
+    """!
+    @brief Dense per slot counts, the totals or the counts of one sliding window
+    """
+    def dense_counts(self, window=None):
+        return self.totals if not window else self.windows[window]
+
+    """!
+    @brief Count for one country (0 for countries without packets)
+    """
+    def count(self, geoname_id, window=None):
+        slot = self.slots.get(geoname_id)
+        if slot is None:
+            return 0
+        return self.dense_counts(window)[slot]
+
+    """!
+    @brief Returns: dictionary of geoname_id -> count, countries without packets are left out
+    """
+    def counts(self, window=None):
+        values = self.dense_counts(window)
+        return {geoname_id: values[slot] for slot, geoname_id in enumerate(self.geoname_ids) if values[slot]}
+
+
+class SnapshotPublisher:
+    """Running counts owned by the writer and the snapshot readers see."""
+
+    def __init__(self, windows=()):
+        self.windows = tuple(windows)
+        # Countries that always own the first slots, in this order (see reserve())
+        self.reserved = ()
+        self.clear()
+        self.current = FrequencySnapshot(
+            0, (), {}, array("Q"), {window: array("Q") for window in self.windows}, time.time()
+        )
+
+    def _slot(self, geoname_id):
+        slot = self.slots.get(geoname_id)
+        if slot is None:
+            slot = self.slots[geoname_id] = len(self.geoname_ids)
+            self.geoname_ids.append(geoname_id)
+            self.totals.append(0)
+        return slot
+
+    """!
+    @brief Add a batch of {geoname_id: count} to the running totals (writer only)
+    """
+    def add(self, counts):
+        for geoname_id, count in counts.items():
+            self.totals[self._slot(geoname_id)] += count
+
+    """!
+    @brief Forget every count (writer only), readers see it at the next publish
+    """
+    def clear(self):
+        self.geoname_ids = list(self.reserved)
+        self.slots = {geoname_id: slot for slot, geoname_id in enumerate(self.reserved)}
+        self.totals = array("Q", bytes(8 * len(self.reserved)))
+
+    """!
+    @brief Give `geoname_ids` the first slots in this order, so with a CountryRegistry's
+    geoname_ids snapshot slot i is registry index i. Counts already kept move with
+    their country (writer only)
+    """
+    def reserve(self, geoname_ids):
+        geoname_ids = tuple(geoname_ids)
+        if geoname_ids == self.reserved:
+            return
+        old_ids, old_totals = self.geoname_ids, self.totals
+        self.reserved = geoname_ids
+        self.clear()
+        for geoname_id, total in zip(old_ids, old_totals):
+            self.totals[self._slot(geoname_id)] += total
+
+    """!
+    @brief Swap in a new snapshot of the running totals and the given window counts
+    (writer only). The generation only moves when a count actually changed
+    @param window_counts dictionary of window -> {geoname_id: count}
+    Returns: the current snapshot
+    """
+    def publish(self, window_counts=None):
+        window_counts = window_counts or {}
+        # Countries only seen by a window still get a slot so every array shares one index
+        for counts in window_counts.values():
+            for geoname_id in counts:
+                self._slot(geoname_id)
+        geoname_ids = tuple(self.geoname_ids)
+        totals = array("Q", self.totals)
+        windows = {}
+        for window in self.windows:
+            counts = window_counts.get(window, {})
+            windows[window] = array("Q", (counts.get(geoname_id, 0) for geoname_id in geoname_ids))
+
+        current = self.current
+        same_slots = current.geoname_ids == geoname_ids
+        if same_slots and current.totals == totals and current.windows == windows:
+            return current
+        # The only thing readers ever see change: one reference assignment
+        self.current = FrequencySnapshot(
+            current.generation + 1, geoname_ids, current.slots if same_slots else dict(self.slots),
+            totals, windows, time.time()
+        )
+        return self.current
+
+    """!
+    @brief The latest published snapshot, safe from any thread without a lock
+    """
+    def latest(self):
+        return self.current
@@ -4,7 +4,6 @@ import dearpygui.dearpygui as dpg
 
 # Local libraries we need
 from thread_control import (
-    main,
     reset_config,
     start_sniffer_thread,
     stop_sniffer_thread,
@@ -12,6 +11,8 @@ from thread_control import (
     stop_reset_thread
 )
 from db import reset_packet_table
+from rolling_counter import DEFAULT_WINDOWS
+from color_scale import SCALES
 
 # shared globals for keeping like buttons the same size
 TOGGLE_WIDTH = 120
@@ -187,6 +188,50 @@ def create_timer_controls(parent, reset_config):
         callback=lambda s, a: reset_config.update({"enabled": a}),
         parent=parent
     )
+
+"""
+@brief drop down that picks if the map is colored by total packets or by a sliding window
+"""
+def create_window_controls(parent, display_config):
+    dpg.add_separator(parent=parent)
+    dpg.add_text("Color By", parent=parent)
+
+    # Label shown in the drop down -> window in seconds (0 is the total packet count)
+    window_labels = {"Total": 0}
+    for window in DEFAULT_WINDOWS:
+        window_labels[f"Last {window}s"] = window
+
+    def window_callback(sender, app_data):
+        display_config["window"] = window_labels.get(app_data, 0)
+
+    default_label = next(
+        (label for label, window in window_labels.items() if window == display_config["window"]),
+        "Total"
+    )
+    dpg.add_combo(
+        items=list(window_labels.keys()),
+        default_value=default_label,
+        width=120,
+        callback=window_callback,
+        parent=parent
+    )
+
+"""
+@brief drop down that picks how packet counts are spread over the color gradient
+"""
+def create_scale_controls(parent, display_config):
+    dpg.add_text("Color Scale", parent=parent)
+
+    def scale_callback(sender, app_data):
+        display_config["scale"] = app_data
+
+    dpg.add_combo(
+        items=list(SCALES),
+        default_value=display_config["scale"],
+        width=120,
+        callback=scale_callback,
+        parent=parent
+    )
 #--------------------------------------------------------
 #---------------- Vertical column 2 controls ------------
 #--------------------------------------------------------
\ No newline at end of file
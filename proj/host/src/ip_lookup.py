@@ -0,0 +1,324 @@
+"""!
+@file ip_lookup.py
+@brief In memory longest-prefix-match lookup of IPv4 addresses to geoname_ids.
+The blocks table is read once and flattened into sorted, non-overlapping
+integer intervals that are searched with bisect. A bounded LRU cache of
+recent source addresses sits in front of it, traffic keeps coming from the same sources.
+When the GeoIP data in the database is reloaded the tables are rebuilt and the caches dropped
+"""
+
+# Standard libraries we need
+import socket
+import ipaddress
+from array import array
+from bisect import bisect_right
+import threading
+from collections import OrderedDict
+from threading import Lock
+
+# Package libraries we need
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+# Local libraries we need
+import metrics
+
+
+# Common database statements (commands)
+# Every major IP block and the country it belongs to
+QUERY_ALL_BLOCKS_STMT = text(
+    "SELECT network, geoname_id FROM blocks"
+)
+# Same but with the integer ranges computed when the CSV was loaded (see csv_ingest.py)
+QUERY_ALL_BLOCK_RANGES_STMT = text(
+    "SELECT network_start, network_end, geoname_id FROM blocks "
+    "WHERE network_start IS NOT NULL AND geoname_id IS NOT NULL"
+)
+# Every country name and its geoname_id
+QUERY_ALL_COUNTRIES_STMT = text(
+    "SELECT geoname_id, country_name FROM countries"
+)
+# Checksums of the CSV files the lookup is built from
+QUERY_GEOIP_CHECKSUMS_STMT = text(
+    "SELECT table_name, checksum FROM ingest_meta "
+    "WHERE table_name IN ('blocks', 'countries') ORDER BY table_name"
+)
+
+# One global lookup table shared by every sniffer thread
+IP_LOOKUP = None
+IP_LOOKUP_LOCK = Lock()
+# geoip_checksum() of the data IP_LOOKUP was built from
+IP_LOOKUP_CHECKSUM = None
+# Marks an address that isn't in the cache (None is a cached "no country")
+CACHE_MISS = object()
+
+# size: how many source addresses each threads lookup cache remembers (0 turns the cache off)
+# reload_check_interval: seconds between checks for reloaded GeoIP data (0 never checks)
+lookup_cache_config = {"size": 65536, "reload_check_interval": 10.0}
+# Cache counters, hits / (hits + misses) over real traffic tells how big the cache should be
+LOOKUP_CACHE_HITS = metrics.counter("lookup_cache_hits", "Lookups answered by the address cache")
+LOOKUP_CACHE_MISSES = metrics.counter("lookup_cache_misses", "Lookups that had to search the blocks")
+LOOKUP_CACHE_EVICTIONS = metrics.counter("lookup_cache_evictions", "Addresses dropped from the full address cache")
+
+
+"""!
+@brief Convert a dotted quad IPv4 string to an integer
+"""
+def ip_to_int(ip_address):
+    return int.from_bytes(socket.inet_aton(ip_address), "big")
+
+
+"""!
+@brief Flatten (possibly nested) blocks into non-overlapping intervals
+where the most specific (longest prefix) block always wins
+Returns: list of (start, end, geoname_id) sorted by start
+"""
+def flatten_blocks(blocks):
+    # Parents sort before their children: same start, bigger block first
+    blocks = sorted(blocks, key=lambda block: (block[0], -block[1]))
+    segments = []
+    # Stack of the blocks that are still "open" at the cursor (end, geoname_id)
+    open_blocks = []
+    cursor = 0
+
+    def close_blocks_before(position):
+        nonlocal cursor
+        while open_blocks and open_blocks[-1][0] < position:
+            end, geoname_id = open_blocks.pop()
+            if cursor <= end:
+                segments.append((cursor, end, geoname_id))
+            cursor = max(cursor, end + 1)
+
+    for start, end, geoname_id in blocks:
+        # 1. Close every block that ends before this block starts
+        close_blocks_before(start)
+        # 2. The enclosing block owns the gap up to the start of this block
+        if open_blocks and cursor < start:
+            segments.append((cursor, start - 1, open_blocks[-1][1]))
+        open_blocks.append((end, geoname_id))
+        cursor = start
+    close_blocks_before(1 << 32)
+    return segments
+
+
+class IPLookup:
+    """Sorted interval arrays mapping an IPv4 address to a geoname_id."""
+
+    def __init__(self, blocks, country_names=None):
+        segments = flatten_blocks(blocks)
+        # Parallel arrays: interval i covers starts[i]..ends[i] inclusive
+        self.starts = array("L", (seg[0] for seg in segments))
+        self.ends = array("L", (seg[1] for seg in segments))
+        self.geoname_ids = array("q", (seg[2] for seg in segments))
+        self.country_names = country_names or {}
+
+    def __len__(self):
+        return len(self.starts)
+
+    """!
+    @brief Return the geoname_id of the most specific block containing the
+    passed address (integer or dotted quad string) or None
+    """
+    def lookup(self, address):
+        if isinstance(address, str):
+            try:
+                address = ip_to_int(address)
+            except OSError:
+                return None
+        idx = bisect_right(self.starts, address) - 1
+        if idx < 0 or address > self.ends[idx]:
+            return None
+        return self.geoname_ids[idx]
+
+    """!
+    @brief Return (geoname_id, country_name) for an address or None
+    """
+    def lookup_country(self, address):
+        geoname_id = self.lookup(address)
+        if geoname_id is None:
+            return None
+        return geoname_id, self.country_names.get(geoname_id)
+
+
+class CachedIPLookup:
+    """Bounded LRU caches of address -> geoname_id in front of an IPLookup, one per thread
+    so a lookup never takes a lock. Unmatched addresses are cached too (as None), they
+    repeat just as much."""
+
+    def __init__(self, backend, size=None):
+        self.backend = backend
+        self.size = lookup_cache_config["size"] if size is None else size
+        # Every thread keeps (the backend its cache was filled from, its OrderedDict) here
+        self.local = threading.local()
+
+    def __len__(self):
+        return len(self.backend)
+
+    @property
+    def country_names(self):
+        return self.backend.country_names
+
+    """!
+    @brief Same as IPLookup.lookup, answered from the calling threads cache when the
+    address was seen recently
+    """
+    def lookup(self, address):
+        backend = self.backend
+        if self.size <= 0:
+            return backend.lookup(address)
+        try:
+            cached_backend, entries = self.local.cache
+        except AttributeError:
+            cached_backend = None
+        if cached_backend is not backend:
+            # First lookup of this thread, or the data was reloaded: start a fresh cache
+            entries = OrderedDict()
+            self.local.cache = (backend, entries)
+        geoname_id = entries.get(address, CACHE_MISS)
+        if geoname_id is not CACHE_MISS:
+            entries.move_to_end(address)
+            LOOKUP_CACHE_HITS.inc()
+            return geoname_id
+        LOOKUP_CACHE_MISSES.inc()
+        geoname_id = backend.lookup(address)
+        entries[address] = geoname_id
+        if len(entries) > self.size:
+            entries.popitem(last=False)
+            LOOKUP_CACHE_EVICTIONS.inc()
+        return geoname_id
+
+    """!
+    @brief Return (geoname_id, country_name) for an address or None
+    """
+    def lookup_country(self, address):
+        geoname_id = self.lookup(address)
+        if geoname_id is None:
+            return None
+        return geoname_id, self.backend.country_names.get(geoname_id)
+
+    """!
+    @brief How many addresses the calling threads cache holds
+    """
+    def cached_addresses(self):
+        cache = getattr(self.local, "cache", None)
+        if cache is None or cache[0] is not self.backend:
+            return 0
+        return len(cache[1])
+
+    """!
+    @brief Switch to new lookup tables, every thread drops its cache at its next lookup
+    """
+    def reload(self, backend):
+        self.backend = backend
+
+    # Pickled for worker processes: only the lookup tables and the cache size travel,
+    # the worker starts with empty caches of its own
+    def __getstate__(self):
+        return {"backend": self.backend, "size": self.size}
+
+    def __setstate__(self, state):
+        self.__init__(state["backend"], state["size"])
+
+
+"""!
+@brief Convert a CIDR string from the blocks table to an inclusive integer range
+"""
+def network_to_range(network):
+    net = ipaddress.ip_network(network, strict=False)
+    if net.version != 4:
+        return None
+    start = int(net.network_address)
+    return start, start + net.num_addresses - 1
+
+
+"""!
+@brief Read every block and parse its CIDR string to an integer range
+Returns: list of (start, end, geoname_id)
+"""
+def read_block_ranges(geoip_session):
+    blocks = []
+    for network, geoname_id in geoip_session.execute(QUERY_ALL_BLOCKS_STMT):
+        # Blocks without a country (geoname_id is empty/NaN) can't be mapped
+        if network is None or geoname_id is None or geoname_id != geoname_id:
+            continue
+        try:
+            ip_range = network_to_range(network)
+        except ValueError:
+            continue
+        if ip_range is None:
+            continue
+        blocks.append((ip_range[0], ip_range[1], int(geoname_id)))
+    return blocks
+
+
+"""!
+@brief Build an IPLookup from the blocks and countries tables of a session
+"""
+def build_ip_lookup(geoip_session):
+    # 1. Read every block once as an integer range
+    try:
+        blocks = [
+            (int(start), int(end), int(geoname_id))
+            for start, end, geoname_id in geoip_session.execute(QUERY_ALL_BLOCK_RANGES_STMT)
+        ]
+    except OperationalError:
+        # Database loaded before the network_start/network_end columns existed, parse the CIDRs
+        geoip_session.rollback()
+        blocks = read_block_ranges(geoip_session)
+
+    # 2. Read every country name so a lookup can be printed without a query
+    country_names = {}
+    for geoname_id, country_name in geoip_session.execute(QUERY_ALL_COUNTRIES_STMT):
+        if geoname_id is None or geoname_id != geoname_id:
+            continue
+        country_names[int(geoname_id)] = country_name
+
+    lookup = IPLookup(blocks, country_names)
+    print(f"[Lookup] Built {len(lookup)} intervals from {len(blocks)} blocks")
+    return lookup
+
+
+"""!
+@brief Checksums of the CSV files the blocks and countries tables were loaded from
+(see csv_ingest.py), they change whenever `main.py init` reloads the GeoIP data
+Returns: tuple of (table_name, checksum) or None for a database without ingest_meta
+"""
+def geoip_checksum(geoip_session):
+    try:
+        return tuple(tuple(row) for row in geoip_session.execute(QUERY_GEOIP_CHECKSUMS_STMT))
+    except OperationalError:
+        return None
+
+
+"""!
+@brief Return the shared (cached) IPLookup, building it from the database the first time.
+A rebuild swaps the new tables in behind the same CachedIPLookup, so every capture loop
+holding it switches over at its next lookup
+"""
+def get_ip_lookup(geoip_session, rebuild=False):
+    global IP_LOOKUP, IP_LOOKUP_CHECKSUM
+    with IP_LOOKUP_LOCK:
+        if IP_LOOKUP is None or rebuild:
+            # Read the checksum first, data changing during the build is caught by the next check
+            IP_LOOKUP_CHECKSUM = geoip_checksum(geoip_session)
+            if IP_LOOKUP is None:
+                IP_LOOKUP = CachedIPLookup(build_ip_lookup(geoip_session))
+            else:
+                IP_LOOKUP.reload(build_ip_lookup(geoip_session))
+        return IP_LOOKUP
+
+
+"""!
+@brief Rebuild the shared lookup if the GeoIP data was reloaded since it was built.
+Use a new session, an open transaction keeps seeing the data it started with
+Returns: True if the lookup tables were rebuilt
+"""
+def reload_ip_lookup_if_changed(geoip_session):
+    if IP_LOOKUP is None:
+        return False
+    checksum = geoip_checksum(geoip_session)
+    if checksum is None or checksum == IP_LOOKUP_CHECKSUM:
+        return False
+    print("[Lookup] GeoIP data changed in the database, rebuilding the lookup tables")
+    get_ip_lookup(geoip_session, rebuild=True)
+    return True
@@ -0,0 +1,271 @@
+"""
+@file map_gui.py
+@brief the heat map GUI, only imported by main.py when the GUI is started
+"""
+# Standard libraries we need
+import threading
+import time
+
+# Package libraries we need
+import numpy as np
+import dearpygui.dearpygui as dpg
+
+# Local Libraries we need 
+from config import NATURALEARTH_LOWRES_PATH
+from projection import CanvasProjection
+from color_scale import PALETTE, palette_indices
+from polygon_cache import load_or_build_polygon_cache
+from db import get_geoip_session, get_frequency_snapshot, use_country_registry, seed_frequency_snapshot
+from country_registry import get_country_registry
+from gui_controls import (
+    create_sniffer_toggle,
+    create_reset_button,
+    create_timer_controls,
+    create_window_controls,
+    create_scale_controls
+)
+from startup_timer import stage, report
+import metrics
+from thread_control import (
+    reset_config,
+    stop_sniffer_thread,
+    stop_flush_thread
+)
+
+
+# What the map colors are based on: 0 is the total packet count,
+# anything else is the number of packets in the last `window` seconds.
+# `scale` is how counts map onto the gradient and `freq_max` is the count
+# that is fully red (None scales to the busiest country)
+display_config = {"window": 0, "scale": "linear", "freq_max": 10.0}
+
+# How long a map refresh tick takes and how many countries it repainted (see metrics.py)
+GUI_REFRESH_SECONDS = metrics.histogram("gui_refresh_seconds", "Time to read the counts and repaint the map")
+GUI_COUNTRIES_REPAINTED = metrics.counter("gui_countries_repainted", "Countries whose color changed")
+
+# =============================
+# ------ DearPyGui setup ------
+# =============================
+"""
+@brief Dynamically transform a geographic point to the drawlist coordinates and add it to our GUI window.
+Plus initalize all our interactable elements like buttons.
+"""
+def create_window_gui(map_polygons, projection, initial_viewport_width=1920, initial_viewport_height=1080, control_panel_height_ratio=0.25):
+    dpg.create_context()
+    # Create viewport
+    dpg.create_viewport(title="Packet Map", width=initial_viewport_width, height=initial_viewport_height)
+    # Use this to change the guis colors
+    dpg.set_viewport_clear_color((255, 255, 255, 255))  # White GUI
+    dpg.setup_dearpygui()
+
+    with dpg.window(label="Live Country Map", width=initial_viewport_width, height=initial_viewport_height):
+        # Vertical layout: map on top, controls below
+        with dpg.group(horizontal=False):
+            # Map drawlist (take most of the window height)
+            map_h = int(initial_viewport_height * (1 - control_panel_height_ratio))
+            map_w = initial_viewport_width
+            with dpg.drawlist(width=map_w, height=map_h) as map_drawlist:
+                # Draw a ocean rectangle backgroudn onto the GUI 
+                # --- Draw ocean background first ---
+                dpg.draw_rectangle(
+                    pmin=(0, 0),
+                    pmax=(map_w, map_h),
+                    color=(0, 0, 0, 0),             # no border
+                    fill=(173, 216, 230, 255)       # light blue fill for ocean
+                )
+                # Draw all the countries onto the GUI 
+                # Every polygon is projected in one pass, in the same order as map_polygons
+                projected_polys = iter(projection.project_polygons(map_w, map_h))
+                country_items = {}
+                for country_name, poly_count in zip(map_polygons.names, map_polygons.poly_counts):
+                    for _ in range(poly_count):
+                        transformed_points = next(projected_polys)
+                        # Use this to change the map polygons
+                        item = dpg.draw_polygon(
+                            points=transformed_points,
+                            color=(0, 0, 0, 255),              # black outlines
+                            fill=(200, 200, 200, 255),        # light gray fill
+                            thickness=1.5,                    # slightly thicker borders
+                            parent=map_drawlist
+                        )
+                        country_items.setdefault(country_name, []).append(item)
+
+            # Control panel in a tab bar below the map now
+            # Color theme for the control panel
+            with dpg.theme() as control_panel_theme:
+                with dpg.theme_component(dpg.mvAll):
+                    dpg.add_theme_color(dpg.mvThemeCol_WindowBg, (80, 80, 80, 255))     # matte grey background
+                    dpg.add_theme_color(dpg.mvThemeCol_ChildBg, (80, 80, 80, 255))      # child windows same grey
+                    dpg.add_theme_color(dpg.mvThemeCol_Text, (255, 255, 255, 255))      # white text
+                    dpg.add_theme_color(dpg.mvThemeCol_FrameBg, (100, 100, 100, 255))   # input/slider backgrounds
+                    dpg.add_theme_color(dpg.mvThemeCol_FrameBgHovered, (120, 120, 120, 255))
+                    dpg.add_theme_color(dpg.mvThemeCol_FrameBgActive, (140, 140, 140, 255))
+            
+            with dpg.tab_bar():
+                with dpg.tab(label="Control Panel"):
+                    with dpg.group(horizontal=False) as control_panel:
+                        # Bind the matte grey theme to the control panel
+                        dpg.bind_item_theme(control_panel, control_panel_theme)
+            
+                        # Title text will now follow the theme (white)
+                        dpg.add_text("Controls")  
+                        
+                        with dpg.table(header_row=False, borders_innerV=False, borders_innerH=False):
+                            dpg.add_table_column()  # single column for stacking
+
+                            with dpg.table_row():
+                                with dpg.group(horizontal=False):
+                                   sniffer_state, sniffer_drawlist, toggle_draw_fn = create_sniffer_toggle(dpg.last_item())
+
+                            with dpg.table_row():
+                                with dpg.group(horizontal=False):
+                                    create_reset_button(dpg.last_item(), sniffer_state, sniffer_drawlist, toggle_draw_fn)
+
+                            with dpg.table_row():
+                                with dpg.group(horizontal=False):
+                                    create_timer_controls(dpg.last_item(), reset_config)
+
+                            with dpg.table_row():
+                                with dpg.group(horizontal=False):
+                                    create_window_controls(dpg.last_item(), display_config)
+
+                            with dpg.table_row():
+                                with dpg.group(horizontal=False):
+                                    create_scale_controls(dpg.last_item(), display_config)
+
+            
+    return map_drawlist, control_panel, country_items
+
+
+"""
+@brief Function for reizing the geopanda map if we change the size of the DearPyGUI window
+"""
+def setup_resize_handler(map_drawlist, control_panel, country_items, projection, control_panel_width_ratio=0.25):
+    def resize_callback(sender, app_data):
+        viewport_w = dpg.get_viewport_width()
+        viewport_h = dpg.get_viewport_height()
+
+        map_w = int(viewport_w * (1 - control_panel_width_ratio))
+        map_h = viewport_h
+        control_w = viewport_w - map_w
+        control_h = viewport_h
+
+        dpg.configure_item(map_drawlist, width=map_w, height=map_h)
+        dpg.configure_item(control_panel, width=control_w, height=control_h)
+
+        # Update polygon points by rescaling the cached projection
+        projected_polys = iter(projection.project_polygons(map_w, map_h))
+        for country, items in country_items.items():
+            for item in items:
+                dpg.configure_item(item, points=next(projected_polys))
+
+    dpg.set_viewport_resize_callback(resize_callback)
+
+"""
+@brief start and destroy the guy after all the setup is done
+"""
+def run_gui():
+    dpg.show_viewport()
+    dpg.start_dearpygui()
+    dpg.destroy_context()
+
+# =============================
+# ------ Geopanda map updater--
+# =============================
+"""!
+@brief Parallel arrays for every drawn country that has a registry index:
+its index (to read its count straight out of the dense snapshot arrays) and its polygon handles
+Returns: (numpy array of registry indexes, list of polygon item lists)
+"""
+def index_map_countries(registry, map_polygons, country_items):
+    indexes = []
+    handles = []
+    for name, geoname_id in zip(map_polygons.names, map_polygons.geoname_ids):
+        index = registry.index(geoname_id)
+        # Countries missing from the countries table can't have packets, leave them grey
+        if index is None or name not in country_items:
+            continue
+        indexes.append(index)
+        handles.append(country_items[name])
+    return np.array(indexes, dtype=np.intp), handles
+
+def live_update_loop(registry, country_indexes, country_handles):
+    # Last palette index given to every country, so only changed polygons are reconfigured
+    last_indices = np.full(len(country_indexes), -1, dtype=np.int64)
+    # Snapshot generation and display settings the map was last painted with
+    last_painted = None
+    while dpg.is_dearpygui_running():
+        # 1) Take the latest published counts, no lock and no query
+        snapshot = get_frequency_snapshot()
+        window = display_config["window"]
+        painted = (snapshot.generation, window, display_config["scale"], display_config["freq_max"])
+        if painted == last_painted:
+            # Nothing was counted and nothing was changed in the controls since the last tick
+            time.sleep(1)
+            continue
+        started = time.perf_counter()
+        # Snapshot slot i is registry index i (see use_country_registry), one gather reads every count
+        values = np.frombuffer(snapshot.dense_counts(window), dtype=np.uint64)
+        if values.size < len(registry):
+            # Published before the counts were laid out by registry index, nothing counted yet
+            values = np.zeros(len(registry), dtype=np.uint64)
+        counts = values[country_indexes].astype(np.float64)
+
+        # 2) Map all counts to palette colors in one pass
+        indices = palette_indices(counts, display_config["scale"], display_config["freq_max"])
+
+        # 3) Update polygons only when their color changed
+        changed = np.flatnonzero(indices != last_indices)
+        for i in changed:
+            color = PALETTE[indices[i]]
+            for item in country_handles[i]:
+                dpg.configure_item(item, fill=color)
+        last_indices = indices
+        last_painted = painted
+        GUI_COUNTRIES_REPAINTED.add(len(changed))
+        GUI_REFRESH_SECONDS.observe(time.perf_counter() - started)
+
+        time.sleep(1)
+    
+
+
+def main(): 
+    # 1) Load the fixed up and simplified polygons from the cache (rebuilt if the .shp changed)
+    with stage("load polygon cache"):
+        map_polygons = load_or_build_polygon_cache(NATURALEARTH_LOWRES_PATH)
+    # Every polygon is in one flat array so projecting the map is a single array operation
+    with stage("project polygons"):
+        projection = CanvasProjection(map_polygons.vertices, map_polygons.offsets)
+    print("polygons done")
+    # 2) Create map window
+    with stage("create GUI window"):
+        map_drawlist, control_panel, country_items = create_window_gui(map_polygons, projection)
+    print("finished map windows")
+    # 3) Start all the callback (buttons and interactable elements) threads for the GUI
+    
+    # 3) Setup viewport resize handler, this one is ambitious and mostly doesnt work, 
+    # Easiest way to get the correct window size is set the dimension parameters in 
+    # create_window_gui
+    setup_resize_handler(map_drawlist, control_panel, country_items, projection)
+    print("resize setup")
+    # Give every country its dense index, counts and polygons are both looked up by it
+    with stage("index countries"):
+        geoip_session = get_geoip_session()
+        try:
+            registry = get_country_registry(geoip_session)
+        finally:
+            geoip_session.close()
+        use_country_registry(registry)
+        seed_frequency_snapshot()
+        country_indexes, country_handles = index_map_countries(registry, map_polygons, country_items)
+    # Setup the map updater
+    threading.Thread(
+        target=live_update_loop, args=(registry, country_indexes, country_handles), daemon=True
+    ).start()
+    print("threading started")
+    report("Startup")
+    # 4) Run the GUI
+    run_gui()
+    # 5) The window was closed, stop capturing and flush the last packet counts
+    stop_sniffer_thread()
+    stop_flush_thread()
@@ -0,0 +1,256 @@
+"""!
+@file pcap_replay.py
+@brief Replay a pcap or pcapng capture through the receivers classify and count path.
+The file is streamed record by record (never loaded whole) and needs neither
+scapy nor network privileges, so it can be used for reproducible benchmarks
+or to backfill counts from captures taken somewhere else
+    python main.py replay capture.pcap [--realtime] [--speed 2.0]
+"""
+
+# Standard libraries we need
+import sys
+import time
+import struct
+import argparse
+
+# Local libraries we need
+from fast_capture import count_frame, FRAME_NOT_TCP, LOOKUP_SAMPLE_EVERY
+
+# Link types we can parse (everything else is counted and skipped)
+LINKTYPE_ETHERNET = 1
+
+# Classic pcap magic numbers (microsecond and nanosecond timestamps)
+PCAP_MAGIC_US = 0xA1B2C3D4
+PCAP_MAGIC_NS = 0xA1B23C4D
+# pcapng block types we read
+PCAPNG_SECTION_HEADER = 0x0A0D0D0A
+PCAPNG_INTERFACE_DESCRIPTION = 0x00000001
+PCAPNG_SIMPLE_PACKET = 0x00000003
+PCAPNG_OBSOLETE_PACKET = 0x00000002
+PCAPNG_ENHANCED_PACKET = 0x00000006
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_OPTION_IF_TSRESOL = 9
+
+# How often the progress line is printed (packets)
+REPORT_EVERY = 100000
+
+
+class PcapFormatError(ValueError):
+    """The file is not a pcap/pcapng capture we can read."""
+
+
+"""!
+@brief Read exactly `size` bytes
+Returns: the bytes or None at a clean end of file
+"""
+def read_exact(file, size):
+    data = file.read(size)
+    if not data:
+        return None
+    if len(data) < size:
+        raise PcapFormatError("Capture file ends in the middle of a record")
+    return data
+
+
+"""!
+@brief Stream the records of a classic pcap file
+Yields: (timestamp in seconds, link type, frame bytes)
+"""
+def read_pcap(file, header):
+    magic = struct.unpack("<I", header[:4])[0]
+    if magic in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+        endian = "<"
+    else:
+        endian = ">"
+        magic = struct.unpack(">I", header[:4])[0]
+    ts_scale = 1e-9 if magic == PCAP_MAGIC_NS else 1e-6
+    # Rest of the 24 byte global header: thiszone, sigfigs, snaplen, network
+    rest = read_exact(file, 16)
+    if rest is None:
+        return
+    linktype = struct.unpack(endian + "HHiIII", header[4:] + rest)[5] & 0xFFFF
+    record = struct.Struct(endian + "IIII")
+    while True:
+        record_header = read_exact(file, record.size)
+        if record_header is None:
+            return
+        ts_sec, ts_frac, caplen, _ = record.unpack(record_header)
+        data = read_exact(file, caplen) if caplen else b""
+        if data is None:
+            raise PcapFormatError("Capture file ends in the middle of a record")
+        yield ts_sec + ts_frac * ts_scale, linktype, data
+
+
+"""!
+@brief Timestamp resolution (seconds per tick) from an if_tsresol option
+"""
+def tsresol_to_scale(value):
+    if value & 0x80:
+        return 2.0 ** -(value & 0x7F)
+    return 10.0 ** -value
+
+
+"""!
+@brief Stream the packets of a pcapng file (every section, every interface)
+Yields: (timestamp in seconds, link type, frame bytes)
+"""
+def read_pcapng(file, header):
+    endian = "<"
+    # Per section list of (link type, timestamp scale), indexed by interface id
+    interfaces = []
+    block_header = header
+    while True:
+        if block_header is None:
+            return
+        block_type = struct.unpack(endian + "I", block_header[:4])[0]
+        if block_type == PCAPNG_SECTION_HEADER:
+            # A new section can switch byte order, read it from the byte order magic
+            bom = read_exact(file, 4)
+            endian = "<" if struct.unpack("<I", bom)[0] == PCAPNG_BYTE_ORDER_MAGIC else ">"
+            block_len = struct.unpack(endian + "I", block_header[4:8])[0]
+            read_exact(file, block_len - 12)
+            interfaces = []
+        else:
+            block_len = struct.unpack(endian + "I", block_header[4:8])[0]
+            if block_len < 12:
+                raise PcapFormatError(f"Invalid pcapng block length {block_len}")
+            body = read_exact(file, block_len - 8)
+            if body is None:
+                raise PcapFormatError("Capture file ends in the middle of a block")
+            body = body[:-4]
+
+            if block_type == PCAPNG_INTERFACE_DESCRIPTION:
+                linktype = struct.unpack(endian + "H", body[:2])[0]
+                interfaces.append((linktype, read_tsresol(body[8:], endian)))
+            elif block_type == PCAPNG_ENHANCED_PACKET:
+                interface_id, ts_high, ts_low, caplen = struct.unpack(endian + "IIII", body[:16])
+                linktype, ts_scale = interfaces[interface_id]
+                yield ((ts_high << 32) | ts_low) * ts_scale, linktype, body[20:20 + caplen]
+            elif block_type == PCAPNG_OBSOLETE_PACKET:
+                interface_id, _, ts_high, ts_low, caplen = struct.unpack(endian + "HHIII", body[:16])
+                linktype, ts_scale = interfaces[interface_id]
+                yield ((ts_high << 32) | ts_low) * ts_scale, linktype, body[20:20 + caplen]
+            elif block_type == PCAPNG_SIMPLE_PACKET:
+                # No timestamp and always interface 0, replayed at the previous packets time
+                linktype, _ = interfaces[0]
+                yield None, linktype, body[4:]
+            # Name resolution, statistics and custom blocks are skipped
+        block_header = read_exact(file, 8)
+
+
+"""!
+@brief Find the if_tsresol option in an interface description blocks options
+"""
+def read_tsresol(options, endian):
+    offset = 0
+    while offset + 4 <= len(options):
+        code, length = struct.unpack_from(endian + "HH", options, offset)
+        if code == 0:
+            break
+        if code == PCAPNG_OPTION_IF_TSRESOL and length >= 1:
+            return tsresol_to_scale(options[offset + 4])
+        offset += 4 + ((length + 3) & ~3)
+    # Default resolution is microseconds
+    return 1e-6
+
+
+"""!
+@brief Stream the packets of a pcap or pcapng file, whichever it is
+Yields: (timestamp in seconds or None, link type, frame bytes)
+"""
+def read_capture(file):
+    header = read_exact(file, 8)
+    if header is None:
+        return
+    magic_le = struct.unpack("<I", header[:4])[0]
+    magic_be = struct.unpack(">I", header[:4])[0]
+    if magic_le == PCAPNG_SECTION_HEADER:
+        yield from read_pcapng(file, header)
+    elif PCAP_MAGIC_US in (magic_le, magic_be) or PCAP_MAGIC_NS in (magic_le, magic_be):
+        yield from read_pcap(file, header)
+    else:
+        raise PcapFormatError(f"Not a pcap or pcapng file (magic {magic_le:#010x})")
+
+
+"""!
+@brief Push every packet of a capture through the live capture's count_frame, so the
+packet counts and the capture metrics move exactly as if the packets were captured
+@param realtime sleep so packets are counted at their original (speed scaled) times
+Returns: dictionary of replay counters
+"""
+def replay_capture(path, ip_lookup, increment_packet_freq, realtime=False, speed=1.0):
+    stats = {"packets": 0, "bytes": 0, "parsed": 0, "matched": 0, "unmatched": 0, "unsupported_link": 0}
+    lookup = ip_lookup.lookup
+    first_ts = last_ts = None
+    started = time.monotonic()
+    with open(path, "rb") as file:
+        for ts, linktype, frame in read_capture(file):
+            stats["packets"] += 1
+            stats["bytes"] += len(frame)
+            if stats["packets"] % REPORT_EVERY == 0:
+                print(f"[Replay] {stats['packets']} packets...")
+            if ts is None:
+                ts = last_ts
+            if realtime and ts is not None:
+                if first_ts is None:
+                    first_ts = ts
+                delay = (ts - first_ts) / speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            last_ts = ts
+
+            if linktype != LINKTYPE_ETHERNET:
+                stats["unsupported_link"] += 1
+                continue
+            result = count_frame(
+                frame, None, lookup, increment_packet_freq, not stats["packets"] % LOOKUP_SAMPLE_EVERY
+            )
+            if result is FRAME_NOT_TCP:
+                continue
+            stats["parsed"] += 1
+            stats[result] += 1
+    stats["seconds"] = time.monotonic() - started
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a pcap/pcapng file into the packet counts")
+    parser.add_argument("capture", help="pcap or pcapng file to replay")
+    parser.add_argument("--realtime", action="store_true", help="keep the original gaps between packets")
+    parser.add_argument("--speed", type=float, default=1.0, help="speed up (or slow down) --realtime replays")
+    args = parser.parse_args(argv)
+
+    # The database modules are only needed once we know the arguments are good
+    from db import get_geoip_session, increment_packet_freq
+    from ip_lookup import get_ip_lookup
+    from thread_control import start_flush_thread, stop_flush_thread
+
+    geoip_session = get_geoip_session()
+    try:
+        ip_lookup = get_ip_lookup(geoip_session)
+    finally:
+        geoip_session.close()
+
+    start_flush_thread()
+    try:
+        stats = replay_capture(args.capture, ip_lookup, increment_packet_freq, args.realtime, args.speed)
+    except (OSError, PcapFormatError) as e:
+        print(f"[Replay] Could not replay {args.capture}: {e}")
+        sys.exit(1)
+    finally:
+        # Drains every pending count into the packet table
+        stop_flush_thread()
+
+    seconds = stats["seconds"]
+    pps = stats["packets"] / seconds if seconds > 0 else 0.0
+    mbps = stats["bytes"] * 8 / seconds / 1e6 if seconds > 0 else 0.0
+    print(
+        f"[Replay] {stats['packets']} packets in {seconds:.2f}s ({pps:.0f} pps, {mbps:.1f} Mbit/s) | "
+        f"matched {stats['matched']} unmatched {stats['unmatched']} | "
+        f"not TCP {stats['packets'] - stats['parsed'] - stats['unsupported_link']} "
+        f"unsupported link type {stats['unsupported_link']}"
+    )
+
+
+if __name__ == "__main__":
+    main()
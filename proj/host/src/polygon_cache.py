@@ -0,0 +1,234 @@
+"""!
+@file polygon_cache.py
+@brief Build step that turns the Natural Earth `.shp` file into a compact,
+mmap-able polygon cache (flat float32 vertices + offsets + a small JSON index)
+so the GUI can start without importing geopandas or shapely.
+Run `python polygon_cache.py` to (re)build it by hand
+"""
+
+# Standard libraries we need
+import os
+import json
+import hashlib
+
+# Package libraries we need
+import numpy as np
+
+# Local Libraries we need
+from config import NATURALEARTH_LOWRES_PATH, COUNTRY_FIX_LIST, QUERY_COUNTRIES_RECORD_STMT
+
+# Where the cache lives and what it is made of
+POLYGON_CACHE_DIR = "polygon_cache"
+CACHE_INDEX_FILE = "polygons.json"
+CACHE_VERTICES_FILE = "vertices.npy"
+CACHE_OFFSETS_FILE = "offsets.npy"
+# Bump when the cache layout or the polygon preprocessing changes
+CACHE_VERSION = 1
+# Simplification tolerance (controls smoothness vs vertex count)
+SIMPLIFY_TOLERANCE = 0.05
+# geoname_id stored for map countries that have no record in the countries table
+UNKNOWN_GEONAME_ID = -1
+
+
+class MapPolygons:
+    """Every country polygon as one flat vertex array, ordered by country."""
+
+    def __init__(self, names, geoname_ids, poly_counts, vertices, offsets):
+        # Parallel lists: country i owns poly_counts[i] polygons
+        self.names = names
+        self.geoname_ids = geoname_ids
+        self.poly_counts = poly_counts
+        # Polygon j is vertices[offsets[j]:offsets[j + 1]]
+        self.vertices = vertices
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.names)
+
+
+"""!
+@brief Checksum of the CSV the countries table was loaded from (see csv_ingest.py),
+the cache stores geoname_ids from that table. Empty if the table was never loaded
+"""
+def countries_checksum():
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+    from db import get_geoip_session
+
+    geoip_session = get_geoip_session()
+    try:
+        row = geoip_session.execute(
+            text("SELECT checksum FROM ingest_meta WHERE table_name = 'countries'")
+        ).fetchone()
+    except OperationalError:
+        row = None
+    finally:
+        geoip_session.close()
+    return row[0] if row and row[0] else ""
+
+
+"""!
+@brief Hash everything the cache is built from: the shapefile (and its
+sidecar files), the country name fixes, the preprocessing settings and the
+countries table the geoname_ids come from
+"""
+def source_hash(shp_path=NATURALEARTH_LOWRES_PATH):
+    digest = hashlib.sha256()
+    digest.update(f"v{CACHE_VERSION}:{SIMPLIFY_TOLERANCE}:{COUNTRY_FIX_LIST!r}".encode())
+    digest.update(f"countries:{countries_checksum()}".encode())
+    stem, _ = os.path.splitext(shp_path)
+    for extension in (".shp", ".shx", ".dbf"):
+        path = stem + extension
+        if not os.path.exists(path):
+            continue
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+"""!
+@brief Go through the list of countries we can render from the `.shp`
+file and fix them from names that we have major IP block record for
+"""
+def fix_shp_file_country_names(world):
+    # Convert to fix list to a dictonary to make lookup faster
+    country_fix_dict = dict(COUNTRY_FIX_LIST)
+    world["ADMIN"] = world["ADMIN"].map(lambda name: country_fix_dict.get(name, name))
+
+
+"""!
+@brief Map every country name in the countries table (lower case) to its geoname_id
+"""
+def get_country_ids_by_name():
+    from db import get_geoip_session
+
+    geoip_session = get_geoip_session()
+    try:
+        country_records = geoip_session.execute(QUERY_COUNTRIES_RECORD_STMT).fetchall()
+    finally:
+        geoip_session.close()
+    return {
+        row[0].lower(): int(row[1])
+        for row in country_records
+        if row[0] is not None and row[1] is not None
+    }
+
+
+"""!
+@brief Read, fix and simplify the `.shp` file and write the polygon cache
+@param cache_hash source_hash() of the inputs if the caller already has it
+Returns: MapPolygons
+"""
+def build_polygon_cache(shp_path=NATURALEARTH_LOWRES_PATH, cache_dir=POLYGON_CACHE_DIR, cache_hash=None):
+    # Only the build step pays for geopandas and shapely
+    import geopandas as gpd
+    from shapely.geometry import Polygon, MultiPolygon
+
+    # 1. Load the country shapes and fix their names
+    print("Loading world polygons...")
+    world = gpd.read_file(shp_path)
+    fix_shp_file_country_names(world)
+    country_ids = get_country_ids_by_name()
+
+    # 2. Simplify polygons to reduce vertex count (important for performance!)
+    world["geometry"] = world["geometry"].simplify(SIMPLIFY_TOLERANCE, preserve_topology=True)
+
+    # 3. Collect every exterior ring per country
+    country_rings = {}
+    for name, geom in zip(world["ADMIN"], world["geometry"]):
+        if name is None:
+            print("ERROR: None value in world map")
+            continue
+        if isinstance(geom, Polygon):
+            polygons = [geom]
+        elif isinstance(geom, MultiPolygon):
+            polygons = list(geom.geoms)
+        else:
+            continue  # skip weird geometry types
+        rings = country_rings.setdefault(name, [])
+        for poly in polygons:
+            if poly.is_empty:
+                continue  # skip invalid polygons
+            rings.append(np.asarray(poly.exterior.coords, dtype=np.float32)[:, :2])
+
+    # 4. Flatten into one vertex array + offsets
+    names = list(country_rings.keys())
+    geoname_ids = [country_ids.get(name.lower(), UNKNOWN_GEONAME_ID) for name in names]
+    poly_counts = [len(country_rings[name]) for name in names]
+    rings = [ring for name in names for ring in country_rings[name]]
+    offsets = np.zeros(len(rings) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(ring) for ring in rings])
+    if rings:
+        vertices = np.ascontiguousarray(np.concatenate(rings), dtype=np.float32)
+    else:
+        vertices = np.zeros((0, 2), dtype=np.float32)
+
+    unmatched = [name for name, geoname_id in zip(names, geoname_ids) if geoname_id == UNKNOWN_GEONAME_ID]
+    if unmatched:
+        print(f"[PolygonCache] {len(unmatched)} map countries have no countries table record: {unmatched}")
+
+    # 5. Write the arrays first and the index last, the index is what makes the cache valid
+    os.makedirs(cache_dir, exist_ok=True)
+    np.save(os.path.join(cache_dir, CACHE_VERTICES_FILE), vertices)
+    np.save(os.path.join(cache_dir, CACHE_OFFSETS_FILE), offsets)
+    index = {
+        "version": CACHE_VERSION,
+        "source_hash": cache_hash or source_hash(shp_path),
+        "countries": [
+            {"name": name, "geoname_id": geoname_id, "polygons": count}
+            for name, geoname_id, count in zip(names, geoname_ids, poly_counts)
+        ],
+    }
+    index_path = os.path.join(cache_dir, CACHE_INDEX_FILE)
+    with open(index_path + ".tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(index_path + ".tmp", index_path)
+    print(f"[PolygonCache] Wrote {len(names)} countries, {len(rings)} polygons, {len(vertices)} vertices")
+    return MapPolygons(names, geoname_ids, poly_counts, vertices, offsets)
+
+
+"""!
+@brief Load the polygon cache if it exists and was built from `expected_hash`
+Returns: MapPolygons or None if the cache is missing or stale
+"""
+def load_polygon_cache(cache_dir=POLYGON_CACHE_DIR, expected_hash=None):
+    index_path = os.path.join(cache_dir, CACHE_INDEX_FILE)
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+        if index.get("version") != CACHE_VERSION:
+            return None
+        if expected_hash is not None and index.get("source_hash") != expected_hash:
+            return None
+        # Memory map the vertices, the OS only pages in what we touch
+        vertices = np.load(os.path.join(cache_dir, CACHE_VERTICES_FILE), mmap_mode="r")
+        offsets = np.load(os.path.join(cache_dir, CACHE_OFFSETS_FILE), mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    countries = index["countries"]
+    return MapPolygons(
+        [country["name"] for country in countries],
+        [country["geoname_id"] for country in countries],
+        [country["polygons"] for country in countries],
+        vertices,
+        offsets,
+    )
+
+
+"""!
+@brief Load the polygon cache, rebuilding it if the shapefile changed
+"""
+def load_or_build_polygon_cache(shp_path=NATURALEARTH_LOWRES_PATH, cache_dir=POLYGON_CACHE_DIR):
+    expected_hash = source_hash(shp_path)
+    map_polygons = load_polygon_cache(cache_dir, expected_hash)
+    if map_polygons is None:
+        print("[PolygonCache] Cache missing or out of date (shapefile or countries table changed), rebuilding...")
+        map_polygons = build_polygon_cache(shp_path, cache_dir, expected_hash)
+    else:
+        print(f"[PolygonCache] Loaded {len(map_polygons)} countries from {cache_dir}")
+    return map_polygons
+
+
+if __name__ == "__main__":
+    build_polygon_cache()
@@ -0,0 +1,69 @@
+"""!
+@file projection.py
+@brief Project every country polygon onto the DearPyGui drawlist in one pass.
+All vertices live in one contiguous array, the bounding box is computed once
+and a resize is a single scale + offset over the cached array
+"""
+
+# Package libraries we need
+import numpy as np
+
+
+class CanvasProjection:
+    """Contiguous polygon vertices normalized to the map bounding box."""
+
+    def __init__(self, vertices, offsets):
+        # vertices: (N, 2) geographic points, offsets: polygon i is vertices[offsets[i]:offsets[i + 1]]
+        vertices = np.ascontiguousarray(vertices, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+        # 1. Global bounding box, computed once
+        x_min, y_min = vertices.min(axis=0)
+        x_max, y_max = vertices.max(axis=0)
+        self.bbox_width = float(x_max - x_min)
+        self.bbox_height = float(y_max - y_min)
+
+        # 2. Move the origin to the top left of the map and flip Y to match the canvas
+        self.normalized = np.empty_like(vertices)
+        self.normalized[:, 0] = vertices[:, 0] - x_min
+        self.normalized[:, 1] = y_max - vertices[:, 1]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    """!
+    @brief Scale the cached vertices to fill (and center in) a drawlist
+    Returns: (N, 2) array of canvas points
+    """
+    def project(self, drawlist_w, drawlist_h):
+        # Scale to fill entire drawlist
+        scale = min(drawlist_w / self.bbox_width, drawlist_h / self.bbox_height)
+        # Center map in the drawlist
+        offset = np.array([
+            (drawlist_w - self.bbox_width * scale) / 2,
+            (drawlist_h - self.bbox_height * scale) / 2,
+        ])
+        return self.normalized * scale + offset
+
+    """!
+    @brief Project and split the vertices back into one point list per polygon
+    """
+    def project_polygons(self, drawlist_w, drawlist_h):
+        projected = self.project(drawlist_w, drawlist_h)
+        return [
+            projected[start:end].tolist()
+            for start, end in zip(self.offsets[:-1], self.offsets[1:])
+        ]
+
+
+"""!
+@brief Flatten a dictionary of country_name -> list of polygons (lists of (x, y))
+into one contiguous vertex array, ordered like the dictionary
+Returns: CanvasProjection
+"""
+def build_projection(country_polygons):
+    polys = [poly for poly_set in country_polygons.values() for poly in poly_set]
+    offsets = np.zeros(len(polys) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(poly) for poly in polys])
+    vertices = np.concatenate([np.asarray(poly, dtype=np.float64).reshape(-1, 2) for poly in polys])
+    return CanvasProjection(vertices, offsets)
@@ -0,0 +1,110 @@
+"""!
+@file rolling_counter.py
+@brief Sliding window packet counters per country. Every country gets a ring
+buffer of per-second buckets and a running total per window so
+"packets in the last N seconds" is answered without a sweep or a query
+"""
+
+# Standard libraries we need
+import time
+from array import array
+from threading import Lock
+
+# Windows (seconds) the GUI can color the map by
+DEFAULT_WINDOWS = (10, 60, 300)
+
+
+class RollingWindowCounter:
+    """Per-second ring buffers with running totals for a fixed set of windows."""
+
+    def __init__(self, windows=DEFAULT_WINDOWS, clock=time.monotonic):
+        self.windows = tuple(sorted(windows))
+        # The ring only has to remember as far back as the largest window
+        self.size = self.windows[-1]
+        self.clock = clock
+        # geoname_id -> slot, every slot owns one ring buffer and one total per window
+        self.slots = {}
+        self.buckets = []
+        self.totals = {window: array("Q") for window in self.windows}
+        self.current_second = int(clock())
+        self.lock = Lock()
+
+    """!
+    @brief Move the ring forward to `now_second`, expiring buckets that fell out of each window
+    """
+    def _advance(self, now_second):
+        elapsed = now_second - self.current_second
+        if elapsed <= 0:
+            return
+        if elapsed >= self.size:
+            # Everything we remember is too old, start over
+            for slot in range(len(self.buckets)):
+                self.buckets[slot] = array("Q", bytes(8 * self.size))
+                for window in self.windows:
+                    self.totals[window][slot] = 0
+            self.current_second = now_second
+            return
+        for second in range(self.current_second + 1, now_second + 1):
+            # 1. The bucket that is now `window` seconds old leaves that window
+            for window in self.windows:
+                expired = (second - window) % self.size
+                totals = self.totals[window]
+                for slot, ring in enumerate(self.buckets):
+                    totals[slot] -= ring[expired]
+            # 2. Reuse the oldest bucket for the new second
+            current = second % self.size
+            for ring in self.buckets:
+                ring[current] = 0
+        self.current_second = now_second
+
+    def _slot(self, geoname_id):
+        slot = self.slots.get(geoname_id)
+        if slot is None:
+            slot = len(self.buckets)
+            self.slots[geoname_id] = slot
+            self.buckets.append(array("Q", bytes(8 * self.size)))
+            for window in self.windows:
+                self.totals[window].append(0)
+        return slot
+
+    """!
+    @brief Count `count` packets for a country in the current second
+    """
+    def add(self, geoname_id, count=1):
+        with self.lock:
+            self._advance(int(self.clock()))
+            slot = self._slot(geoname_id)
+            self.buckets[slot][self.current_second % self.size] += count
+            for window in self.windows:
+                self.totals[window][slot] += count
+
+    """!
+    @brief Packets counted for a country in the last `window` seconds
+    """
+    def count(self, geoname_id, window):
+        with self.lock:
+            self._advance(int(self.clock()))
+            slot = self.slots.get(geoname_id)
+            if slot is None:
+                return 0
+            return self.totals[window][slot]
+
+    """!
+    @brief Packets counted for every country in the last `window` seconds
+    Returns: dictionary of geoname_id -> count
+    """
+    def counts(self, window):
+        with self.lock:
+            self._advance(int(self.clock()))
+            totals = self.totals[window]
+            return {geoname_id: totals[slot] for geoname_id, slot in self.slots.items()}
+
+    """!
+    @brief Forget every count
+    """
+    def clear(self):
+        with self.lock:
+            self.slots.clear()
+            self.buckets.clear()
+            self.totals = {window: array("Q") for window in self.windows}
+            self.current_second = int(self.clock())
@@ -1,68 +1,163 @@
 """!
-@file main.py
+@file scapy_receiver.py
 @brief Listen for packets and print them to the console
 """
 
+# Standard libraries we need
+import time
+
+# Local libraries we need
+import config
+import metrics
+
+# How packets are captured
+# mode "scapy": AsyncSniffer and full Scapy dissection
+# mode "raw": AF_PACKET socket + struct parsing in fast_capture.py, no per-packet objects or prints
+# mode "pipeline": same socket, but capture, lookup and counting run as separate stages (capture_pipeline.py)
+# mode "fanout": one raw socket per CPU in a PACKET_FANOUT group, each in its own process (fanout_capture.py)
+# iface: interface to capture on (None captures on every interface)
+# dest_ip/dest_port: only capture TCP sent to this address/port (None accepts any)
+# syn_only: only capture connection attempts (the sender only sends SYNs)
+# poll_timeout: how often the capture wakes up to check if it was asked to stop
+# print_packets: print every matched packet (debugging only, printing caps the packet rate)
+capture_config = {
+    "mode": "scapy",
+    "iface": None,
+    "dest_ip": getattr(config, "RECEIVER_IP", None),
+    "dest_port": getattr(config, "DEST_PORT", None),
+    "syn_only": True,
+    "poll_timeout": 0.5,
+    "print_packets": False,
+}
+
+# Hot path metrics (see metrics.py), shared with the other capture modes
+PACKETS_CAPTURED = metrics.counter("packets_captured", "Frames read from the capture")
+PACKETS_PARSED = metrics.counter("packets_parsed", "Frames that were IPv4/TCP")
+PACKETS_MATCHED = metrics.counter("packets_matched", "Packets matched to a country")
+PACKETS_UNMATCHED = metrics.counter("packets_unmatched", "Packets without a matching block")
+LOOKUP_SECONDS = metrics.histogram("lookup_seconds", "Source address to country lookup time")
+
 # Package libraries we need
-from scapy.all import sniff, IP, TCP
- 
-from sqlalchemy import text
+# scapy.all is slow to import, it is only loaded once the sniffer starts (see load_scapy())
+AsyncSniffer = IP = TCP = None
 
 
+"""
+@brief import scapy the first time it is needed
+"""
+def load_scapy():
+    global AsyncSniffer, IP, TCP
+    if AsyncSniffer is None:
+        from scapy.all import AsyncSniffer, IP, TCP
 
 
-def match_country_to_address(payload, geoip_session, increment_packet_freq):
-    if payload == None:
-            print("Packet did not have a recognized payload")
-            return 
+"""!
+@brief Build the BPF (tcpdump syntax) capture filter from the capture config,
+so packets we would ignore anyway are dropped in the kernel
+"""
+def build_capture_filter(config=capture_config):
+    parts = ["tcp"]
+    if config.get("dest_ip"):
+        parts.append(f"dst host {config['dest_ip']}")
+    if config.get("dest_port") is not None:
+        parts.append(f"dst port {int(config['dest_port'])}")
+    if config.get("syn_only"):
+        parts.append("tcp[tcpflags] & tcp-syn != 0")
+    return " and ".join(parts)
 
-    # 2. Use the payload (src ip + CIDR) to find a matching geoname_id
-    block_stmt = text("SELECT network, geoname_id FROM blocks WHERE network = :net")
-    result = geoip_session.execute(block_stmt, {"net": payload}).fetchone()
-    if not result:
-        raise ValueError(f"No matching block found for payload {payload}")
-        return
-    network, geoname_id = result
-    # 3. Use the matched geoname_id to find the country name
-    # Query the countries table for country_name
-    country_stmt = text("SELECT country_name FROM countries WHERE geoname_id = :gid")
-    country_result = geoip_session.execute(country_stmt, {"gid": geoname_id}).fetchone()
-    if not country_result:
-        raise ValueError(f"No country found for geoname_id {geoname_id}")
+
+
+
+def match_country_to_address(src_ip, payload, ip_lookup, increment_packet_freq):
+    # 1. Make sure the packet had a source address to match
+    if src_ip is None:
+        PACKETS_UNMATCHED.inc()
+        return 
+
+    # 2. Use the source address to find the most specific matching block
+    # and the country it belongs to (no database round-trip per packet)
+    started = time.perf_counter()
+    result = ip_lookup.lookup_country(src_ip)
+    LOOKUP_SECONDS.observe(time.perf_counter() - started)
+    if result is None:
+        # Real traffic can come from anywhere (private ranges, unlisted blocks)
+        PACKETS_UNMATCHED.inc()
         return
-    country_name = country_result[0]
-    # Add the countries packet to our packet table
+    geoname_id, country_name = result
+    # 3. Add the countries packet to our packet table
+    PACKETS_MATCHED.inc()
     increment_packet_freq(geoname_id)
-    print(f"Received packet from ({country_name}) and `{payload}` ")
+    if capture_config["print_packets"]:
+        print(f"Received packet from ({country_name}) and `{src_ip}` payload `{payload}` ")
     
 
 
-def handle_pkt(pkt, geoip_session, increment_packet_freq):
+def handle_pkt(pkt, ip_lookup, increment_packet_freq):
+    PACKETS_CAPTURED.inc()
     # Check if the sent packet has a IP and TCP layer
     if IP in pkt and TCP in pkt:
-        # If it does then make sure there is a payload attached
-        if pkt.haslayer(TCP) and hasattr(pkt[TCP], "payload"):
-            # extract the payload and print the sender IP address and payload
+        PACKETS_PARSED.inc()
+        # Our sender attaches the CIDR block as a payload, real traffic might not
+        payload = None
+        if hasattr(pkt[TCP], "payload"):
             try: 
                 payload = bytes(pkt[TCP].payload).decode(errors="ignore")
             except UnicodeDecodeError:
-                # Skip packets that don't decode
-                return  
-            # debug print
-            #print(f"Received packet from SRC IP {pkt[IP].src} | payload {payload}")
-            match_country_to_address(payload, geoip_session, increment_packet_freq)
+                payload = None
+        # debug print
+        #print(f"Received packet from SRC IP {pkt[IP].src} | payload {payload}")
+        match_country_to_address(pkt[IP].src, payload, ip_lookup, increment_packet_freq)
 
 """
 @brief sniff for packets until told to stop by the sniffer thread
 """
-def start_sniffer(geoip_session, increment_packet_freq, SNIFFER_STOP_EVENT):
-    from scapy.all import sniff
+def start_sniffer(ip_lookup, increment_packet_freq, SNIFFER_STOP_EVENT):
+    capture_filter = build_capture_filter()
+    if capture_config["mode"] in ("raw", "fanout", "pipeline"):
+        # The raw socket modes attach the same filter as BPF bytecode we build ourselves (no libpcap)
+        from fast_capture import build_bpf_program
+        print(f"[Sniffer] Capturing `{capture_filter}` ({capture_config['mode']} mode)")
+        capture_filter = build_bpf_program(
+            capture_config["dest_ip"], capture_config["dest_port"], capture_config["syn_only"]
+        )
+    if capture_config["mode"] == "raw":
+        # Scapy-free fast path, returns once SNIFFER_STOP_EVENT is set
+        from fast_capture import raw_capture_loop
+        raw_capture_loop(ip_lookup, increment_packet_freq, SNIFFER_STOP_EVENT, capture_config["iface"], capture_filter)
+        return
+    if capture_config["mode"] == "fanout":
+        from fanout_capture import fanout_capture_loop
+        fanout_capture_loop(ip_lookup, increment_packet_freq, SNIFFER_STOP_EVENT, capture_config["iface"], capture_filter)
+        return
+    if capture_config["mode"] == "pipeline":
+        from capture_pipeline import pipeline_capture_loop
+        pipeline_capture_loop(ip_lookup, increment_packet_freq, SNIFFER_STOP_EVENT, capture_config["iface"], capture_filter)
+        return
+
+    load_scapy()
 
-    sniff(
-        filter="tcp",
-        prn=lambda pkt: handle_pkt(pkt, geoip_session, increment_packet_freq),
-        stop_filter=lambda pkt: SNIFFER_STOP_EVENT.is_set()
+    # Capture in scapy's own thread so we never wait on the next packet to notice a stop,
+    # stop() wakes the capture up straight away even if the link is quiet
+    sniffer = AsyncSniffer(
+        iface=capture_config["iface"],
+        filter=capture_filter,
+        prn=lambda pkt: handle_pkt(pkt, ip_lookup, increment_packet_freq),
+        store=False
     )
+    sniffer.start()
+    print(f"[Sniffer] Capturing `{capture_filter}`")
+    try:
+        # Also wake up now and then in case the capture died on its own (interface went down...)
+        while not SNIFFER_STOP_EVENT.wait(capture_config["poll_timeout"]):
+            if not sniffer.running:
+                print("[Sniffer] Capture stopped unexpectedly, restarting")
+                SNIFFER_STOP_EVENT.wait(capture_config["poll_timeout"])
+                break
+    finally:
+        if sniffer.running:
+            sniffer.stop()
+        else:
+            sniffer.join()
 
 
     
\ No newline at end of file
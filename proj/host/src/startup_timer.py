@@ -0,0 +1,40 @@
+"""!
+@file startup_timer.py
+@brief Time the stages of starting up (imports, database, polygons, GUI...)
+and print a report of where the startup time went.
+For a per-module breakdown of imports run python with `-X importtime`
+"""
+
+# Standard libraries we need
+import time
+from contextlib import contextmanager
+
+# Time this module was first imported, the entry points import it first
+PROCESS_START = time.perf_counter()
+# (stage name, seconds) in the order the stages finished
+STARTUP_STAGES = []
+
+
+"""!
+@brief Time a block of startup code as one named stage
+"""
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP_STAGES.append((name, time.perf_counter() - start))
+
+
+"""!
+@brief Print every stage, its time and its share of the total startup time
+"""
+def report(title="Startup"):
+    total = time.perf_counter() - PROCESS_START
+    print(f"[{title}] {total * 1000:.1f} ms total")
+    for name, seconds in STARTUP_STAGES:
+        share = seconds / total * 100 if total > 0 else 0.0
+        print(f"[{title}]   {name:<32} {seconds * 1000:9.1f} ms {share:5.1f}%")
+    accounted = sum(seconds for _, seconds in STARTUP_STAGES)
+    print(f"[{title}]   {'(other)':<32} {(total - accounted) * 1000:9.1f} ms")
@@ -0,0 +1,169 @@
+"""!
+@file stats_server.py
+@brief Small local HTTP endpoint for headless receivers. Serves the per country
+packet counts, the sliding window counts, the capture pipeline stats and every
+hot path metric, so collection can run on a capture box while the map runs elsewhere
+    GET /metrics        Prometheus text format
+    GET /stats.json     the same numbers as JSON
+"""
+
+# Standard libraries we need
+import sys
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Local libraries we need
+import metrics
+import ip_lookup
+from db import get_frequency_snapshot
+
+# Where the endpoint listens, keep it on localhost unless a scraper needs to reach it
+stats_server_config = {"host": "127.0.0.1", "port": 9108}
+# Every metric name starts with this
+METRIC_PREFIX = "geoip_"
+
+STATS_SERVER = None
+STATS_THREAD = None
+
+
+"""!
+@brief Stats of whichever multi-stage capture mode is running (if any)
+Returns: dictionary of source -> {stage or counter: ...}
+"""
+def capture_stats():
+    stats = {}
+    # Only look at modules that were imported, a stats request should never start anything
+    pipeline_module = sys.modules.get("capture_pipeline")
+    if pipeline_module is not None and pipeline_module.CURRENT_PIPELINE is not None:
+        stats["pipeline"] = pipeline_module.CURRENT_PIPELINE.stats()
+    fanout_module = sys.modules.get("fanout_capture")
+    if fanout_module is not None and fanout_module.CURRENT_FANOUT is not None:
+        stats["fanout"] = fanout_module.CURRENT_FANOUT.stats()
+    return stats
+
+
+"""!
+@brief Counts of a snapshot keyed by country name
+Returns: dictionary of country_name -> count (countries without packets are left out)
+"""
+def named_counts(snapshot, window=None):
+    lookup = ip_lookup.IP_LOOKUP
+    names = lookup.country_names if lookup is not None else {}
+    return {names.get(geoname_id, str(geoname_id)): count for geoname_id, count in snapshot.counts(window).items()}
+
+
+"""!
+@brief Every countries count in every window
+Returns: dictionary of window (seconds) -> {country_name: count}
+"""
+def window_counts(snapshot):
+    return {window: named_counts(snapshot, window) for window in snapshot.windows}
+
+
+"""!
+@brief Everything we serve as one dictionary
+"""
+def collect_stats():
+    # One snapshot so the totals and the windows agree with each other
+    snapshot = get_frequency_snapshot()
+    return {
+        "generation": snapshot.generation,
+        "countries": named_counts(snapshot),
+        "windows": window_counts(snapshot),
+        "capture": capture_stats(),
+        "metrics": metrics.snapshot(),
+    }
+
+
+"""!
+@brief The stats in the Prometheus text exposition format
+"""
+def render_prometheus():
+    snapshot = get_frequency_snapshot()
+    lines = []
+    name = f"{METRIC_PREFIX}country_packets_total"
+    lines.append(f"# HELP {name} Packets counted per country since the last reset")
+    lines.append(f"# TYPE {name} counter")
+    for country, count in sorted(named_counts(snapshot).items()):
+        lines.append(f"{name}{metrics.format_labels({'country': country})} {count}")
+
+    name = f"{METRIC_PREFIX}country_packets_window"
+    lines.append(f"# HELP {name} Packets counted per country in the last `window` seconds")
+    lines.append(f"# TYPE {name} gauge")
+    for window, counts in window_counts(snapshot).items():
+        for country, count in sorted(counts.items()):
+            lines.append(f"{name}{metrics.format_labels({'window': window, 'country': country})} {count}")
+
+    # Every sample of a metric has to be in one group, collect them per name first
+    samples = {}
+    for source, stats in capture_stats().items():
+        for stage, values in stats.items():
+            # Pipeline stats are per stage, fanout stats are flat
+            if isinstance(values, dict):
+                for key, value in values.items():
+                    samples.setdefault(f"{METRIC_PREFIX}{source}_{key}", []).append(
+                        f"{metrics.format_labels({'stage': stage})} {value}"
+                    )
+            else:
+                samples.setdefault(f"{METRIC_PREFIX}{source}_{stage}", []).append(f" {values}")
+    for name, values in samples.items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(name + value for value in values)
+
+    return "\n".join(lines) + "\n" + metrics.render_prometheus(METRIC_PREFIX)
+
+
+class StatsRequestHandler(BaseHTTPRequestHandler):
+    """Serves /metrics and /stats.json."""
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        try:
+            if path == "/metrics":
+                self.send_body(render_prometheus().encode(), "text/plain; version=0.0.4; charset=utf-8")
+            elif path in ("/stats.json", "/stats"):
+                self.send_body(json.dumps(collect_stats()).encode(), "application/json")
+            else:
+                self.send_error(404, "Try /metrics or /stats.json")
+        except Exception as e:
+            self.send_error(500, f"Failed to collect stats: {e}")
+
+    def send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Scrapes every few seconds would flood the console
+    def log_message(self, format, *args):
+        pass
+
+
+"""!
+@brief Serve the stats from a background thread
+"""
+def start_stats_server(host=None, port=None):
+    global STATS_SERVER, STATS_THREAD
+    if STATS_SERVER is not None:
+        return STATS_SERVER
+    host = host or stats_server_config["host"]
+    port = port if port is not None else stats_server_config["port"]
+    STATS_SERVER = ThreadingHTTPServer((host, port), StatsRequestHandler)
+    STATS_SERVER.daemon_threads = True
+    STATS_THREAD = threading.Thread(target=STATS_SERVER.serve_forever, daemon=True)
+    STATS_THREAD.start()
+    print(f"[Stats] Serving http://{host}:{STATS_SERVER.server_address[1]}/metrics and /stats.json")
+    return STATS_SERVER
+
+
+def stop_stats_server():
+    global STATS_SERVER, STATS_THREAD
+    if STATS_SERVER is None:
+        return
+    STATS_SERVER.shutdown()
+    STATS_SERVER.server_close()
+    STATS_THREAD.join(timeout=2)
+    STATS_SERVER = STATS_THREAD = None
+    print("[Stats] Stopped")
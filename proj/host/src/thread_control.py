@@ -1,15 +1,30 @@
 import threading
 import time
-from db import get_geoip_session, increment_packet_freq, reset_packet_table, PACKET_DELETE_ALL_STMT
+from db import (
+    get_geoip_session,
+    increment_packet_freq,
+    flush_packet_freq,
+    reset_packet_table,
+    use_country_registry,
+    seed_frequency_snapshot,
+    flush_config,
+    FLUSH_EVENT,
+)
 from scapy_receiver import start_sniffer
-from config import DECREMENT_INTERVAL
+from ip_lookup import get_ip_lookup, reload_ip_lookup_if_changed, lookup_cache_config
+from country_registry import get_country_registry
+import metrics
 
 SNIFFER_THREAD = None
 SNIFFER_STOP_EVENT = threading.Event()
 RESET_THREAD = None
 RESET_STOP_EVENT = threading.Event()
+FLUSH_THREAD = None
+FLUSH_STOP_EVENT = threading.Event()
 
 reset_config = {"timer": 30, "enabled": False}  # Default: 30s, disabled
+# Seconds between the metrics summaries printed by main() (0 turns them off)
+stats_config = {"interval": 10.0}
 
 def reset_packet_table_thread():
     print(f"[AutoReset] Thread started (interval = {reset_config['timer']}s)")
@@ -36,14 +51,63 @@ def stop_reset_thread():
     if RESET_THREAD:
         RESET_THREAD.join(timeout=2)
 
+"""!
+@brief Rebuild the IP lookup if `main.py init` reloaded the GeoIP data meanwhile.
+A new session every time, an open one keeps reading the data it started with
+"""
+def check_geoip_reload():
+    geoip_session = get_geoip_session()
+    try:
+        reload_ip_lookup_if_changed(geoip_session)
+    except Exception as e:
+        print(f"[Lookup] Could not check the GeoIP data for changes: {e}")
+    finally:
+        geoip_session.close()
+
+def flush_packet_freq_thread():
+    print(f"[Flush] Thread started (interval = {flush_config['interval']}s, batch = {flush_config['batch_size']})")
+    next_reload_check = time.monotonic() + lookup_cache_config["reload_check_interval"]
+    while not FLUSH_STOP_EVENT.is_set():
+        # Wake up every interval, or early when a full batch is pending
+        FLUSH_EVENT.wait(timeout=flush_config["interval"])
+        FLUSH_EVENT.clear()
+        flush_packet_freq()
+        # Counts keep piling up in memory while a reload rebuilds the lookup, the next flush writes them
+        if lookup_cache_config["reload_check_interval"] and time.monotonic() >= next_reload_check:
+            check_geoip_reload()
+            next_reload_check = time.monotonic() + lookup_cache_config["reload_check_interval"]
+    # Drain whatever was counted before we were told to stop
+    flush_packet_freq()
+    print("[Flush] Thread exiting")
+
+def start_flush_thread():
+    global FLUSH_THREAD
+    if FLUSH_THREAD and FLUSH_THREAD.is_alive():
+        return
+    FLUSH_STOP_EVENT.clear()
+    FLUSH_THREAD = threading.Thread(target=flush_packet_freq_thread, daemon=True)
+    FLUSH_THREAD.start()
+
+def stop_flush_thread():
+    FLUSH_STOP_EVENT.set()
+    FLUSH_EVENT.set()
+    if FLUSH_THREAD:
+        FLUSH_THREAD.join(timeout=2)
+
 
 def sniffer_loop():
     geoip_session = get_geoip_session()
     print("[Sniffer] Session created")
     try:
+        # Build the in memory block lookup once, every packet after this is matched without SQL
+        ip_lookup = get_ip_lookup(geoip_session)
+        # Published counts are laid out by country index for the readers
+        use_country_registry(get_country_registry(geoip_session))
+        # Counts kept in the packet table from the last run are part of the totals
+        seed_frequency_snapshot()
         while not SNIFFER_STOP_EVENT.is_set():
             # Use a timeout or non-blocking packet sniff call
-            start_sniffer(geoip_session, increment_packet_freq, SNIFFER_STOP_EVENT)
+            start_sniffer(ip_lookup, increment_packet_freq, SNIFFER_STOP_EVENT)
     finally:
         geoip_session.close()
         print("[Sniffer] Session closed")
@@ -56,6 +120,8 @@ def start_sniffer_thread():
         print("[Sniffer] Already running")
         return
     SNIFFER_STOP_EVENT.clear()
+    # Packets are counted in memory, make sure something is flushing them
+    start_flush_thread()
     SNIFFER_THREAD = threading.Thread(target=sniffer_loop, daemon=True)
     SNIFFER_THREAD.start()
     print("[Sniffer] Started background thread")
@@ -71,27 +137,29 @@ def stop_sniffer_thread():
             print("[Sniffer] Thread did not exit! It is likely blocked in start_sniffer()")
         else:
             print("[Sniffer] Stopped")
+        # Push the packets counted so far so the table is up to date while we are idle
+        flush_packet_freq()
 
 def main(): 
-        # 2. Create sessions to access the geoIP database database
-    geoip_session = get_geoip_session()
-    print("Sessions created")
-
-
-    # 5. Start the loop and wait for packets
+    # 1. Start the loop and wait for packets
     print("Starting packet sniffer thread")
-        # Start sniffer by default (can be toggled off in GUI)
+    # Start sniffer by default (can be toggled off in GUI)
     start_sniffer_thread()
 
     start_reset_thread() 
 
+    # 2. Run until ctrl + c, printing what the hot path recorded now and then
+    next_stats = time.monotonic() + stats_config["interval"]
     try:
-        while not INTERRUPTED:
+        while True:
             time.sleep(0.2)
+            if stats_config["interval"] and time.monotonic() >= next_stats:
+                print(f"[Stats] {metrics.summary()}")
+                next_stats = time.monotonic() + stats_config["interval"]
+    except KeyboardInterrupt:
+        print("\nSIGINT received. Shutting down...")
     finally:
         stop_sniffer_thread()
         stop_reset_thread()
-        decrement_thread.join()
-        geoip_session.close()
+        stop_flush_thread()
         print("Clean exit")
-    print("session closed, exiting")
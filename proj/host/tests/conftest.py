@@ -0,0 +1,13 @@
+"""!
+@file conftest.py
+@brief The receivers modules are imported by name from src/, like main.py does
+    python -m pytest proj/host/tests
+"""
+
+# Standard libraries we need
+import os
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
@@ -0,0 +1,178 @@
+"""!
+@file test_capture_pipeline.py
+@brief StageQueue backpressure policies: what a full queue keeps, drops and counts
+"""
+
+# Standard libraries we need
+import time
+import socket
+import threading
+
+# Package libraries we need
+import pytest
+import scapy.all as scapy
+
+# Local libraries we need
+from capture_pipeline import StageQueue, CapturePipeline, pipeline_config
+from fast_capture import build_bpf_program
+
+
+"""!
+@brief Queue `batches` (name, size) pairs and return what put() answered for each
+"""
+def fill(queue, batches):
+    return [queue.put(name, size) for name, size in batches]
+
+
+"""!
+@brief Take every queued batch, oldest first
+"""
+def drain(queue):
+    batches = []
+    while len(queue):
+        batches.append(queue.get(timeout=0))
+    return batches
+
+
+def test_unknown_policy_raises():
+    with pytest.raises(ValueError):
+        StageQueue("classify", 4, "drop_random")
+
+
+def test_get_from_empty_queue_times_out():
+    assert StageQueue("classify", 4).get(timeout=0.01) is None
+
+
+def test_drop_newest_keeps_the_queued_batches():
+    queue = StageQueue("classify", 2, "drop_newest")
+    accepted = fill(queue, [("a", 10), ("b", 20), ("c", 30), ("d", 40)])
+    assert accepted == [True, True, False, False]
+    assert drain(queue) == ["a", "b"]
+    stats = queue.stats()
+    assert stats["enqueued"] == 30
+    assert stats["dropped"] == 70
+    assert stats["max_depth"] == 2
+
+
+def test_drop_oldest_keeps_the_newest_batches():
+    queue = StageQueue("classify", 2, "drop_oldest")
+    accepted = fill(queue, [("a", 10), ("b", 20), ("c", 30), ("d", 40)])
+    # The new batch is queued but put() reports that an older one was lost
+    assert accepted == [True, True, False, False]
+    assert drain(queue) == ["c", "d"]
+    stats = queue.stats()
+    assert stats["enqueued"] == 100
+    assert stats["dropped"] == 30
+    assert stats["max_depth"] == 2
+
+
+def test_block_waits_for_room_and_drops_nothing():
+    queue = StageQueue("classify", 2, "block")
+    fill(queue, [("a", 1), ("b", 1)])
+    producer_done = threading.Event()
+
+    def producer():
+        queue.put("c", 1)
+        producer_done.set()
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    # Full queue: the producer has to wait for the consumer
+    assert not producer_done.wait(0.1)
+    assert queue.get(timeout=1) == "a"
+    assert producer_done.wait(1)
+    thread.join(1)
+    assert drain(queue) == ["b", "c"]
+    stats = queue.stats()
+    assert stats["dropped"] == 0
+    assert stats["enqueued"] == 3
+    assert stats["max_depth"] == 2
+
+
+def test_policies_agree_below_capacity():
+    for policy in ("block", "drop_newest", "drop_oldest"):
+        queue = StageQueue("aggregate", 8, policy)
+        assert all(fill(queue, [(i, 1) for i in range(8)]))
+        assert drain(queue) == list(range(8))
+        assert queue.stats()["dropped"] == 0
+
+
+def test_block_gives_up_once_asked_to_stop():
+    queue = StageQueue("classify", 1, "block")
+    fill(queue, [("a", 5)])
+    stop_event = threading.Event()
+    result = []
+    thread = threading.Thread(target=lambda: result.append(queue.put("b", 7, stop_event)), daemon=True)
+    thread.start()
+    time.sleep(0.1)
+    assert thread.is_alive()
+    stop_event.set()
+    thread.join(2)
+    # The stuck batch is dropped instead of blocking the stop
+    assert result == [False]
+    assert drain(queue) == ["a"]
+    assert queue.stats()["dropped"] == 7
+
+
+def test_partial_batch_is_queued_after_max_batch_age():
+    config = dict(pipeline_config, batch_size=64, max_batch_age=0.05)
+    pipeline = CapturePipeline(None, None, config)
+    stop_event = threading.Event()
+    try:
+        sender = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
+        sender.bind(("lo", 0))
+    except PermissionError:
+        pytest.skip("raw sockets need CAP_NET_RAW")
+    capture = threading.Thread(
+        target=pipeline.capture_loop, args=(stop_event, "lo", build_bpf_program(dest_port=9)), daemon=True
+    )
+    try:
+        capture.start()
+        time.sleep(0.2)
+        frame = bytes(scapy.Ether() / scapy.IP(src="127.0.0.1", dst="127.0.0.1") / scapy.TCP(dport=9, flags="S"))
+        # A steady trickle: a frame every 20 ms never fills a batch of 64
+        sent = time.monotonic()
+        first_batch = None
+        while first_batch is None and time.monotonic() - sent < 1.0:
+            sender.send(frame)
+            first_batch = pipeline.frames.get(timeout=0.02)
+        assert first_batch is not None
+        assert time.monotonic() - sent < 0.3
+        assert 0 < len(first_batch) < 64
+    finally:
+        stop_event.set()
+        capture.join(2)
+        sender.close()
+
+
+class OneCountryLookup:
+    """Every address belongs to country 1."""
+
+    def lookup(self, address):
+        return 1
+
+
+def test_drain_gives_up_on_a_stalled_aggregator():
+    config = dict(pipeline_config, workers=1, queue_size=1, drain_timeout=0.3)
+    release = threading.Event()
+    pipeline = CapturePipeline(OneCountryLookup(), lambda geoname_id, count: release.wait(), config)
+    pipeline.start()
+    frame = bytes(scapy.Ether() / scapy.IP(src="1.2.3.4") / scapy.TCP(flags="S"))
+    stop_event = threading.Event()
+    # More batches than the aggregator (stuck on its first) and both queues can hold
+    submitter = threading.Thread(
+        target=lambda: [pipeline.submit([frame], stop_event) for _ in range(10)], daemon=True
+    )
+    submitter.start()
+    time.sleep(0.3)
+    stop_event.set()
+    submitter.join(2)
+    assert not submitter.is_alive()
+    started = time.monotonic()
+    try:
+        pipeline.drain()
+        assert time.monotonic() - started < 2.0
+        stats = pipeline.stats()
+        assert stats["classify"]["dropped"] + stats["aggregate"]["dropped"] > 0
+    finally:
+        release.set()
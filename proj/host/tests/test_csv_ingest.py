@@ -0,0 +1,92 @@
+"""!
+@file test_csv_ingest.py
+@brief Streaming CSV ingest into an in-memory SQLite database
+"""
+
+# Standard libraries we need
+import random
+
+# Package libraries we need
+from sqlalchemy import create_engine
+
+# Local libraries we need
+import csv_ingest
+from csv_ingest import load_csv_to_sqlite, network_range, slow_network_range, column_types, NETWORK_RANGE_COLUMNS
+
+BLOCKS_CSV = (
+    "network,geoname_id,registered_country_geoname_id,is_anonymous_proxy\n"
+    "1.0.0.0/24,100,100,0\n"
+    "1.0.2.0/23,200,,0\n"
+    "2001:db8::/32,300,300,0\n"
+)
+
+
+def write_csv(tmp_path, text, name="blocks.csv"):
+    path = tmp_path / name
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_load_counts_rows_and_skips_unchanged_file(tmp_path):
+    csv_path = write_csv(tmp_path, BLOCKS_CSV)
+    engine = create_engine("sqlite://")
+    assert load_csv_to_sqlite(
+        csv_path, "blocks", engine, computed_columns=NETWORK_RANGE_COLUMNS, indexes=("network",)
+    ) == 3
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM blocks").scalar() == 3
+        rows = conn.exec_driver_sql(
+            "SELECT network, geoname_id, registered_country_geoname_id, network_start, network_end "
+            "FROM blocks ORDER BY geoname_id"
+        ).fetchall()
+    # Empty fields are NULL, numbers are numbers, IPv6 networks get no integer range
+    assert rows[0] == ("1.0.0.0/24", 100, 100, 0x01000000, 0x010000FF)
+    assert rows[1] == ("1.0.2.0/23", 200, None, 0x01000200, 0x010003FF)
+    assert rows[2][3:] == (None, None)
+
+    # Same file again: the checksum matches and the load is skipped
+    assert load_csv_to_sqlite(csv_path, "blocks", engine, computed_columns=NETWORK_RANGE_COLUMNS) == 0
+    # Unless it is forced
+    assert load_csv_to_sqlite(csv_path, "blocks", engine, computed_columns=NETWORK_RANGE_COLUMNS, force=True) == 3
+
+
+def test_changed_file_is_reloaded(tmp_path):
+    csv_path = write_csv(tmp_path, BLOCKS_CSV)
+    engine = create_engine("sqlite://")
+    load_csv_to_sqlite(csv_path, "blocks", engine)
+    write_csv(tmp_path, BLOCKS_CSV + "3.0.0.0/8,400,400,0\n")
+    assert load_csv_to_sqlite(csv_path, "blocks", engine) == 4
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM blocks").scalar() == 4
+        assert conn.exec_driver_sql(
+            "SELECT row_count FROM ingest_meta WHERE table_name = 'blocks'"
+        ).scalar() == 4
+
+
+def test_network_range_matches_ipaddress():
+    rng = random.Random(5)
+    networks = ["0.0.0.0/0", "255.255.255.255/32", "10.1.2.3", "10.1.2.3/16", "2001:db8::/32",
+                "10.1/16", "10.1.2.3/33", "10.1.2.3/x", "300.1.2.3/8", "", "not a network"]
+    for _ in range(2000):
+        address = ".".join(str(rng.randrange(256)) for _ in range(4))
+        networks.append(f"{address}/{rng.randrange(33)}")
+    for network in networks:
+        assert network_range(network) == slow_network_range(network), network
+
+
+def test_columns_are_typed_from_the_sample():
+    columns = ["network", "geoname_id", "score", "flag"]
+    sample = [["1.0.0.0/24", "100", "1.5", ""], ["1.0.1.0/24", "", "2", ""]]
+    assert column_types(columns, sample) == ["TEXT", "INTEGER", "REAL", "INTEGER"]
+
+
+def test_cells_are_stored_as_their_column_type(tmp_path, monkeypatch):
+    # Only the first two rows decide the types
+    monkeypatch.setattr(csv_ingest, "TYPE_SAMPLE_ROWS", 2)
+    csv_path = write_csv(tmp_path, "name,count,score\na,1,1.5\nb,,2\nc,n/a,3\n", "mixed.csv")
+    engine = create_engine("sqlite://")
+    assert load_csv_to_sqlite(csv_path, "mixed", engine) == 3
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql("SELECT name, count, score FROM mixed ORDER BY name").fetchall()
+    # "n/a" came after the sample and isnt an integer, it is kept as text
+    assert rows == [("a", 1, 1.5), ("b", None, 2.0), ("c", "n/a", 3.0)]
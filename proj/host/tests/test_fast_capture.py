@@ -0,0 +1,178 @@
+"""!
+@file test_fast_capture.py
+@brief parse_frame against the frames (and fields) Scapy builds and dissects,
+and the kernel capture filter against what the tcpdump filter would accept
+"""
+
+# Standard libraries we need
+import random
+import socket
+
+# Package libraries we need
+import pytest
+
+# Local libraries we need
+from fast_capture import (
+    parse_frame, build_bpf_program, RawSocketCapture, TCP_FLAG_SYN, BPF_RET_K,
+    BPF_LD_H_ABS, BPF_LD_B_ABS, BPF_LD_W_ABS, BPF_LD_H_IND, BPF_LD_B_IND, BPF_LDX_B_MSH, BPF_JEQ_K, BPF_JSET_K,
+)
+
+scapy = pytest.importorskip("scapy.all")
+
+
+def to_int(ip_address):
+    return int.from_bytes(socket.inet_aton(ip_address), "big")
+
+
+"""!
+@brief What parse_frame should return, read from Scapy's dissection
+"""
+def expected_fields(frame):
+    packet = scapy.Ether(frame)
+    ip, tcp = packet[scapy.IP], packet[scapy.TCP]
+    # Ethernet (and VLAN) header length, then the IP and TCP header lengths
+    payload_offset = len(frame) - len(bytes(ip)) + ip.ihl * 4 + tcp.dataofs * 4
+    return to_int(ip.src), tcp.dport, int(tcp.flags), payload_offset, len(frame)
+
+
+def test_tcp_frames_match_scapy():
+    rng = random.Random(6)
+    for i in range(300):
+        src = socket.inet_ntoa(rng.getrandbits(32).to_bytes(4, "big"))
+        ip_options = [scapy.IPOption_NOP()] * (4 * rng.randint(0, 2)) if i % 3 == 0 else []
+        tcp_options = [("MSS", 1460), ("NOP", None), ("NOP", None)] if i % 4 == 0 else []
+        layers = scapy.Ether(dst="02:00:00:00:00:02")
+        if i % 5 == 0:
+            layers = layers / scapy.Dot1Q(vlan=rng.randint(1, 4094))
+        frame = bytes(
+            layers
+            / scapy.IP(src=src, dst="10.0.0.2", options=ip_options)
+            / scapy.TCP(sport=rng.randint(1, 65535), dport=rng.randint(1, 65535),
+                        flags=rng.choice(["S", "SA", "A", "PA", "F"]), options=tcp_options)
+            / bytes(rng.getrandbits(8) for _ in range(rng.randint(0, 40)))
+        )
+        assert parse_frame(frame) == expected_fields(frame)
+        # Same answer out of a bigger reused buffer with an explicit length
+        buffer = bytearray(2048)
+        buffer[:len(frame)] = frame
+        assert parse_frame(memoryview(buffer), len(frame)) == expected_fields(frame)
+
+
+def test_payload_is_where_scapy_puts_it():
+    frame = bytes(scapy.Ether() / scapy.IP(src="1.2.3.4") / scapy.TCP(dport=8080, flags="S") / b"1.2.3.0/24")
+    src_ip, dst_port, flags, start, end = parse_frame(frame)
+    assert (src_ip, dst_port, flags) == (to_int("1.2.3.4"), 8080, 0x02)
+    assert frame[start:end] == b"1.2.3.0/24"
+
+
+def test_ethernet_padding_is_not_payload():
+    # A short frame padded to the 60 byte Ethernet minimum, the IP total length says where it ends
+    frame = bytes(scapy.Ether() / scapy.IP(src="1.2.3.4") / scapy.TCP(flags="S")) + b"\0" * 6
+    _, _, _, start, end = parse_frame(frame)
+    assert start == end == 54
+
+
+@pytest.mark.parametrize("packet", [
+    scapy.Ether() / scapy.IP() / scapy.UDP() / (b"x" * 30),
+    scapy.Ether() / scapy.IPv6() / scapy.TCP(),
+    scapy.Ether() / scapy.ARP(),
+    scapy.Ether() / scapy.IP(frag=10) / scapy.TCP(),
+])
+def test_non_tcp_ipv4_frames_are_skipped(packet):
+    assert parse_frame(bytes(packet)) is None
+
+
+def test_truncated_frames_are_skipped():
+    frame = bytes(scapy.Ether() / scapy.IP() / scapy.TCP())
+    for length in (0, 13, 33, len(frame) - 1):
+        assert parse_frame(frame, length) is None
+
+
+"""!
+@brief Run a classic BPF program (only the instructions build_bpf_program() emits) over a frame
+Returns: the number of bytes the program accepts (0 drops the frame)
+"""
+def run_bpf(program, frame):
+    a = x = 0
+    pc = 0
+    while True:
+        code, jt, jf, k = program[pc]
+        pc += 1
+        if code == BPF_RET_K:
+            return k
+        if code in (BPF_LD_H_ABS, BPF_LD_B_ABS, BPF_LD_W_ABS, BPF_LD_H_IND, BPF_LD_B_IND):
+            offset = k + (x if code in (BPF_LD_H_IND, BPF_LD_B_IND) else 0)
+            size = {BPF_LD_W_ABS: 4, BPF_LD_H_ABS: 2, BPF_LD_H_IND: 2}.get(code, 1)
+            if offset + size > len(frame):
+                return 0
+            a = int.from_bytes(frame[offset:offset + size], "big")
+        elif code == BPF_LDX_B_MSH:
+            x = (frame[k] & 0x0F) * 4
+        elif code == BPF_JEQ_K:
+            pc += jt if a == k else jf
+        elif code == BPF_JSET_K:
+            pc += jt if a & k else jf
+        else:
+            raise AssertionError(f"unexpected BPF instruction {code:#x}")
+
+
+def test_bpf_program_matches_the_tcpdump_filter():
+    rng = random.Random(7)
+    for dest_ip, dest_port, syn_only in [("10.0.0.2", 8080, True), (None, 8080, False), ("10.0.0.2", None, False),
+                                         (None, None, True), (None, None, False)]:
+        program = build_bpf_program(dest_ip, dest_port, syn_only)
+        for _ in range(200):
+            ip = scapy.IP(dst=rng.choice(["10.0.0.2", "10.0.0.3"]), frag=rng.choice([0, 0, 0, 5]),
+                          options=[scapy.IPOption_NOP()] * rng.choice([0, 4]))
+            # Tagged frames (802.1Q) go through the same checks 4 bytes further in
+            link = scapy.Ether() / scapy.Dot1Q(vlan=rng.randrange(1, 4095)) if rng.random() < 0.3 else scapy.Ether()
+            if rng.random() < 0.2:
+                packet = link / ip / scapy.UDP(dport=8080)
+            else:
+                packet = link / ip / scapy.TCP(dport=rng.choice([8080, 80]), flags=rng.choice(["S", "SA", "A"]))
+            frame = bytes(packet)
+            expected = (
+                scapy.TCP in packet
+                and (dest_ip is None or ip.dst == dest_ip)
+                and (ip.frag == 0 or (dest_port is None and not syn_only))
+                and (dest_port is None or packet[scapy.TCP].dport == dest_port)
+                and (not syn_only or bool(packet[scapy.TCP].flags & TCP_FLAG_SYN))
+            )
+            assert bool(run_bpf(program, frame)) == expected
+
+
+def test_bpf_program_accepts_tagged_frames_like_parse_frame():
+    program = build_bpf_program("10.0.0.2", 8080, True)
+    tcp = scapy.IP(src="1.2.3.4", dst="10.0.0.2") / scapy.TCP(dport=8080, flags="S")
+    tagged = bytes(scapy.Ether() / scapy.Dot1Q(vlan=7) / tcp)
+    assert run_bpf(program, tagged)
+    assert parse_frame(tagged)[:2] == (to_int("1.2.3.4"), 8080)
+    # A tag around something else, or two tags, is still dropped
+    assert not run_bpf(program, bytes(scapy.Ether() / scapy.Dot1Q(vlan=7) / scapy.ARP()))
+    assert not run_bpf(program, bytes(scapy.Ether() / scapy.Dot1Q(vlan=7) / scapy.Dot1Q(vlan=8) / tcp))
+    assert not run_bpf(program, bytes(scapy.Ether() / scapy.Dot1Q(vlan=7) / tcp)[:30])
+
+
+def test_bpf_program_filters_a_raw_socket(capsys):
+    try:
+        capture = RawSocketCapture("lo", timeout=0.2, capture_filter=build_bpf_program("127.0.0.1", 9, True))
+        sender = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
+    except PermissionError:
+        pytest.skip("raw sockets need CAP_NET_RAW")
+    try:
+        # The kernel accepted the program (a rejected one is reported as a warning)
+        assert "WARNING" not in capsys.readouterr().out
+        sender.bind(("lo", 0))
+        for dport, flags in ((10, "S"), (9, "A"), (9, "S")):
+            sender.send(bytes(scapy.Ether() / scapy.IP(src="127.0.0.1", dst="127.0.0.1")
+                              / scapy.TCP(sport=4242, dport=dport, flags=flags)))
+        received = []
+        while True:
+            length = capture.recv()
+            if not length:
+                break
+            received.append(parse_frame(capture.buffer, length))
+        assert received and all(fields[1:3] == (9, TCP_FLAG_SYN) for fields in received)
+    finally:
+        sender.close()
+        capture.close()
@@ -0,0 +1,140 @@
+"""!
+@file test_ip_lookup.py
+@brief The flattened interval lookup against a brute force longest prefix match,
+its per-thread caches and the rebuild when the GeoIP data is reloaded
+"""
+
+# Standard libraries we need
+import random
+import threading
+import ipaddress
+
+# Package libraries we need
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+# Local libraries we need
+import ip_lookup
+from ip_lookup import IPLookup, CachedIPLookup, flatten_blocks, ip_to_int, network_to_range
+from csv_ingest import load_csv_to_sqlite, NETWORK_RANGE_COLUMNS
+
+
+"""!
+@brief Most specific block containing the address, by checking every block
+"""
+def brute_force_lookup(blocks, address):
+    best = None
+    for start, end, geoname_id in blocks:
+        if start <= address <= end and (best is None or end - start < best[1] - best[0]):
+            best = (start, end, geoname_id)
+    return best[2] if best else None
+
+
+"""!
+@brief Random nested CIDR blocks inside 10.0.0.0/16 (some parents, some children, some gaps)
+"""
+def random_blocks(rng, count):
+    blocks = {}
+    for geoname_id in range(count):
+        prefix = rng.randint(18, 30)
+        start = ip_to_int("10.0.0.0") + (rng.randrange(1 << 16) & ~((1 << (32 - prefix)) - 1))
+        blocks[(start, prefix)] = (start, start + (1 << (32 - prefix)) - 1, geoname_id)
+    return list(blocks.values())
+
+
+def test_lookup_matches_brute_force():
+    rng = random.Random(1)
+    for _ in range(20):
+        blocks = random_blocks(rng, 40)
+        lookup = IPLookup(blocks)
+        for _ in range(500):
+            address = ip_to_int("10.0.0.0") + rng.randrange(1 << 16)
+            assert lookup.lookup(address) == brute_force_lookup(blocks, address)
+
+
+def test_flattened_segments_are_sorted_and_disjoint():
+    blocks = random_blocks(random.Random(2), 60)
+    segments = flatten_blocks(blocks)
+    for (_, end, _), (next_start, _, _) in zip(segments, segments[1:]):
+        assert end < next_start
+
+
+def test_child_block_wins_and_parent_covers_both_sides():
+    parent = network_to_range("1.2.0.0/16") + (1,)
+    child = network_to_range("1.2.3.0/24") + (2,)
+    lookup = IPLookup([parent, child], {1: "Parent", 2: "Child"})
+    assert lookup.lookup("1.2.3.4") == 2
+    assert lookup.lookup("1.2.2.255") == 1
+    assert lookup.lookup("1.2.4.0") == 1
+    assert lookup.lookup_country("1.2.3.4") == (2, "Child")
+    assert lookup.lookup("1.3.0.0") is None
+    assert lookup.lookup("not an address") is None
+
+
+def test_network_to_range_skips_ipv6():
+    assert network_to_range("2001:db8::/32") is None
+    net = ipaddress.ip_network("8.8.8.0/24")
+    assert network_to_range("8.8.8.0/24") == (int(net.network_address), int(net.broadcast_address))
+
+
+def test_every_thread_fills_its_own_cache():
+    cached = CachedIPLookup(IPLookup([network_to_range("1.2.0.0/16") + (1,)]), size=2)
+    results = []
+
+    def look_up():
+        results.append([cached.lookup(address) for address in ("1.2.3.4", "1.2.3.4", "9.9.9.9")])
+        results.append(cached.cached_addresses())
+
+    workers = [threading.Thread(target=look_up) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert results == [[1, 1, None], 2] * 2
+    # Nothing was looked up from this thread
+    assert cached.cached_addresses() == 0
+    # Oldest address goes first once the cache is full
+    cached.lookup("1.2.0.1"), cached.lookup("1.2.0.2"), cached.lookup("1.2.0.3")
+    assert cached.cached_addresses() == 2
+
+
+"""!
+@brief Load a countries CSV and a one block CSV mapping 1.2.0.0/16 to geoname_id
+"""
+def load_geoip(tmp_path, engine, geoname_id):
+    countries = tmp_path / "countries.csv"
+    countries.write_text("geoname_id,country_name\n100,First\n200,Second\n", encoding="utf-8")
+    blocks = tmp_path / "blocks.csv"
+    blocks.write_text(f"network,geoname_id\n1.2.0.0/16,{geoname_id}\n", encoding="utf-8")
+    load_csv_to_sqlite(str(countries), "countries", engine)
+    load_csv_to_sqlite(str(blocks), "blocks", engine, computed_columns=NETWORK_RANGE_COLUMNS)
+
+
+def test_lookup_is_rebuilt_when_the_geoip_checksum_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(ip_lookup, "IP_LOOKUP", None)
+    monkeypatch.setattr(ip_lookup, "IP_LOOKUP_CHECKSUM", None)
+    engine = create_engine(f"sqlite:///{tmp_path / 'geoip.db'}")
+    load_geoip(tmp_path, engine, 100)
+    with Session(engine) as session:
+        shared = ip_lookup.get_ip_lookup(session)
+    assert shared.lookup_country("1.2.3.4") == (100, "First")
+    with Session(engine) as session:
+        assert not ip_lookup.reload_ip_lookup_if_changed(session)
+
+    load_geoip(tmp_path, engine, 200)
+    with Session(engine) as session:
+        assert ip_lookup.reload_ip_lookup_if_changed(session)
+        assert not ip_lookup.reload_ip_lookup_if_changed(session)
+    # Same object the capture loops hold, the cached answer for 1.2.3.4 is gone
+    assert ip_lookup.get_ip_lookup(None) is shared
+    assert shared.lookup_country("1.2.3.4") == (200, "Second")
+    engine.dispose()
+
+
+def test_database_without_ingest_meta_is_never_reloaded(monkeypatch):
+    monkeypatch.setattr(ip_lookup, "IP_LOOKUP", CachedIPLookup(IPLookup([])))
+    engine = create_engine("sqlite://")
+    with Session(engine) as session:
+        assert ip_lookup.geoip_checksum(session) is None
+        assert not ip_lookup.reload_ip_lookup_if_changed(session)
+    engine.dispose()
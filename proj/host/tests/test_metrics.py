@@ -0,0 +1,64 @@
+"""!
+@file test_metrics.py
+@brief Per-thread counter and histogram cells add up to exactly what every thread recorded
+"""
+
+# Standard libraries we need
+import threading
+
+# Local libraries we need
+from metrics import Counter, Histogram, LATENCY_BUCKETS
+
+
+"""!
+@brief Run fn in `threads` threads at once and wait for all of them
+"""
+def run_threads(fn, threads=4):
+    workers = [threading.Thread(target=fn) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def test_counter_adds_every_threads_cell():
+    counter = Counter("test_counter")
+
+    def record():
+        for _ in range(20000):
+            counter.inc()
+            counter.add(3)
+        counter.add(0)
+
+    run_threads(record)
+    # The threads are gone, their cells still count
+    assert counter.value == 4 * 20000 * 4
+    counter.inc()
+    assert counter.value == 4 * 20000 * 4 + 1
+
+
+def test_histogram_adds_every_threads_buckets_and_sum():
+    histogram = Histogram("test_histogram")
+    values = (5e-7, 3e-6, 2e-3, 10.0)
+
+    def record():
+        for _ in range(1000):
+            for value in values:
+                histogram.observe(value)
+
+    run_threads(record)
+    counts = histogram.bucket_counts()
+    assert len(counts) == len(LATENCY_BUCKETS) + 1
+    assert histogram.count == 4 * 1000 * len(values)
+    # 5e-7 -> first bucket, 3e-6 -> <= 5e-6, 2e-3 -> <= 2.5e-3, 10 s -> +Inf
+    assert counts[0] == counts[LATENCY_BUCKETS.index(5e-6)] == 4000
+    assert counts[LATENCY_BUCKETS.index(2.5e-3)] == counts[-1] == 4000
+    assert abs(histogram.sum - 4000 * sum(values)) < 1e-6
+    assert histogram.quantile(0.5) == 5e-6
+
+
+def test_empty_metrics_read_as_zero():
+    assert Counter("test_empty").value == 0
+    histogram = Histogram("test_empty_histogram")
+    assert histogram.count == 0 and histogram.sum == 0
+    assert histogram.quantile(0.5) is None
@@ -0,0 +1,124 @@
+"""!
+@file test_pcap_replay.py
+@brief pcap/pcapng reading against files Scapy writes, and replaying them through
+the live capture counters
+"""
+
+# Standard libraries we need
+import struct
+
+# Package libraries we need
+import pytest
+from scapy.all import Ether, IP, TCP, UDP
+from scapy.utils import wrpcap, wrpcapng
+
+# Local libraries we need
+from ip_lookup import IPLookup, ip_to_int
+from fast_capture import PACKETS_CAPTURED, PACKETS_PARSED, PACKETS_MATCHED, PACKETS_UNMATCHED
+from pcap_replay import read_capture, replay_capture, PcapFormatError, LINKTYPE_ETHERNET
+
+MATCHED_ID = 42
+
+
+"""!
+@brief A few frames with known timestamps: 3 matched TCP, 1 unmatched TCP and 1 UDP
+"""
+def sample_packets():
+    frames = [
+        Ether() / IP(src="10.1.0.1", dst="10.0.0.1") / TCP(dport=9, flags="S"),
+        Ether() / IP(src="10.1.0.2", dst="10.0.0.1") / TCP(dport=9, flags="S") / b"1.0.0.0/24",
+        Ether() / IP(src="10.1.200.3", dst="10.0.0.1") / TCP(dport=9, flags="S"),
+        Ether() / IP(src="192.0.2.7", dst="10.0.0.1") / TCP(dport=9, flags="S"),
+        Ether() / IP(src="10.1.0.4", dst="10.0.0.1") / UDP(dport=9),
+    ]
+    for i, frame in enumerate(frames):
+        frame.time = 1700000000 + i * 0.25
+    return frames
+
+
+def sample_lookup():
+    return IPLookup([(ip_to_int("10.1.0.0"), ip_to_int("10.1.255.255"), MATCHED_ID)])
+
+
+def read_file(path):
+    with open(path, "rb") as file:
+        return list(read_capture(file))
+
+
+@pytest.mark.parametrize("writer", ["pcap", "pcap_ns", "pcapng"])
+def test_read_capture_matches_what_scapy_wrote(tmp_path, writer):
+    packets = sample_packets()
+    path = tmp_path / f"sample.{writer}"
+    if writer == "pcapng":
+        wrpcapng(str(path), packets)
+    else:
+        wrpcap(str(path), packets, nano=writer == "pcap_ns")
+    records = read_file(path)
+    assert [frame for _, _, frame in records] == [bytes(packet) for packet in packets]
+    assert {linktype for _, linktype, _ in records} == {LINKTYPE_ETHERNET}
+    for (ts, _, _), packet in zip(records, packets):
+        assert ts == pytest.approx(float(packet.time), abs=1e-6)
+
+
+def test_read_big_endian_pcap(tmp_path):
+    frames = [bytes(packet) for packet in sample_packets()]
+    data = struct.pack(">IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, LINKTYPE_ETHERNET)
+    for i, frame in enumerate(frames):
+        data += struct.pack(">IIII", 100 + i, 500000, len(frame), len(frame)) + frame
+    path = tmp_path / "big_endian.pcap"
+    path.write_bytes(data)
+    records = read_file(path)
+    assert [frame for _, _, frame in records] == frames
+    assert [ts for ts, _, _ in records] == [100 + i + 0.5 for i in range(len(frames))]
+
+
+def test_empty_file_has_no_records(tmp_path):
+    path = tmp_path / "empty.pcap"
+    path.write_bytes(b"")
+    assert read_file(path) == []
+
+
+def test_not_a_capture_raises(tmp_path):
+    path = tmp_path / "text.pcap"
+    path.write_bytes(b"this is not a capture file")
+    with pytest.raises(PcapFormatError):
+        read_file(path)
+
+
+def test_truncated_record_raises(tmp_path):
+    path = tmp_path / "sample.pcap"
+    wrpcap(str(path), sample_packets())
+    path.write_bytes(path.read_bytes()[:-10])
+    with pytest.raises(PcapFormatError):
+        read_file(path)
+
+
+def test_replay_counts_packets_and_metrics(tmp_path):
+    path = tmp_path / "sample.pcapng"
+    wrpcapng(str(path), sample_packets())
+    counted = {}
+
+    def increment_packet_freq(geoname_id, count=1):
+        counted[geoname_id] = counted.get(geoname_id, 0) + count
+
+    metrics = (PACKETS_CAPTURED, PACKETS_PARSED, PACKETS_MATCHED, PACKETS_UNMATCHED)
+    before = [metric.value for metric in metrics]
+    stats = replay_capture(str(path), sample_lookup(), increment_packet_freq)
+    after = [metric.value for metric in metrics]
+
+    assert counted == {MATCHED_ID: 3}
+    assert (stats["packets"], stats["parsed"], stats["matched"], stats["unmatched"]) == (5, 4, 3, 1)
+    assert stats["unsupported_link"] == 0
+    # Same counters the live capture moves
+    assert [b - a for a, b in zip(before, after)] == [5, 4, 3, 1]
+
+
+def test_replay_skips_unsupported_link_types(tmp_path):
+    frame = bytes(sample_packets()[0])
+    # Link type 101 is raw IP, we only parse Ethernet
+    data = struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, 101)
+    data += struct.pack("<IIII", 1, 0, len(frame), len(frame)) + frame
+    path = tmp_path / "raw_ip.pcap"
+    path.write_bytes(data)
+    stats = replay_capture(str(path), sample_lookup(), lambda geoname_id: None)
+    assert (stats["packets"], stats["parsed"], stats["unsupported_link"]) == (1, 0, 1)
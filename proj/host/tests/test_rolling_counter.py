@@ -0,0 +1,72 @@
+"""!
+@file test_rolling_counter.py
+@brief Sliding window counts against the raw list of counted packets
+"""
+
+# Standard libraries we need
+import random
+
+# Local libraries we need
+from rolling_counter import RollingWindowCounter
+
+
+class FakeClock:
+    """A clock the test moves by hand."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+"""!
+@brief Packets counted in the last `window` seconds, from every (second, geoname_id, count) event
+"""
+def brute_force_count(events, now_second, geoname_id, window):
+    return sum(
+        count for second, event_id, count in events
+        if event_id == geoname_id and now_second - window < second <= now_second
+    )
+
+
+def test_windows_match_brute_force():
+    rng = random.Random(3)
+    clock = FakeClock()
+    counter = RollingWindowCounter(windows=(3, 10, 30), clock=clock)
+    events = []
+    for _ in range(2000):
+        # Mostly small steps, sometimes a long pause that expires everything
+        clock.now += rng.choice((0.0, 0.3, 1.0, 2.0, 7.0, 45.0))
+        geoname_id = rng.randrange(5)
+        count = rng.randint(1, 3)
+        counter.add(geoname_id, count)
+        events.append((int(clock.now), geoname_id, count))
+        if rng.random() < 0.2:
+            now_second = int(clock.now)
+            for window in counter.windows:
+                expected = {
+                    gid: brute_force_count(events, now_second, gid, window) for gid in range(5)
+                }
+                counts = counter.counts(window)
+                assert {gid: counts.get(gid, 0) for gid in range(5)} == expected
+                assert counter.count(geoname_id, window) == expected[geoname_id]
+
+
+def test_counts_expire_without_new_packets():
+    clock = FakeClock()
+    counter = RollingWindowCounter(windows=(10, 60), clock=clock)
+    counter.add(7, 5)
+    clock.now += 30
+    assert counter.count(7, 10) == 0
+    assert counter.count(7, 60) == 5
+    clock.now += 31
+    assert counter.counts(60) == {7: 0}
+
+
+def test_clear_forgets_everything():
+    counter = RollingWindowCounter(windows=(10,), clock=FakeClock())
+    counter.add(1)
+    counter.clear()
+    assert counter.counts(10) == {}
+    assert counter.count(1, 10) == 0
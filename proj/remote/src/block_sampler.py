@@ -0,0 +1,172 @@
+"""!
+@file block_sampler.py
+@brief Pick the next (country, major IP block) to send without touching the database.
+Every selected countries blocks are loaded once into compact arrays and
+countries are drawn with Vose's alias method in O(1) using configurable weights
+"""
+
+# Standard libraries we need
+import random
+import socket
+import ipaddress
+from array import array
+
+# Package libraries we need
+from sqlalchemy import text
+
+# Common database statements (commands)
+QUERY_BLOCKS_RECORD_STMT = text(
+    "SELECT network FROM blocks WHERE geoname_id = :gid"
+)
+
+# How countries are weighted when picking the next packet
+# "uniform": every country is as likely as the others (the original behavior)
+# "address_space": proportional to the number of addresses in the countries blocks
+# "profile": taken from `profile`, a dictionary of country_name or geoname_id -> weight
+sampler_config = {"weights": "uniform", "profile": {}}
+
+
+class CountryBlocks:
+    """Every major IP block of one country as parallel integer arrays."""
+
+    def __init__(self, country_name, geoname_id):
+        self.country_name = country_name
+        self.geoname_id = geoname_id
+        # Block i is network_starts[i] / prefix_lens[i]
+        self.network_starts = array("L")
+        self.prefix_lens = array("B")
+
+    def __len__(self):
+        return len(self.network_starts)
+
+    """!
+    @brief Number of addresses covered by all of the countries blocks
+    """
+    def address_space(self):
+        return sum(1 << (32 - prefix) for prefix in self.prefix_lens)
+
+    """!
+    @brief Pick a random block
+    Returns: (network start as an integer, prefix length)
+    """
+    def random_block(self):
+        i = random.randrange(len(self.network_starts))
+        return self.network_starts[i], self.prefix_lens[i]
+
+    """!
+    @brief Pick a random block as an "a.b.c.d/nn" string
+    """
+    def random_network(self):
+        start, prefix = self.random_block()
+        return f"{socket.inet_ntoa(start.to_bytes(4, 'big'))}/{prefix}"
+
+
+class AliasSampler:
+    """Vose's alias method: O(n) setup, O(1) weighted draws."""
+
+    def __init__(self, weights):
+        n = len(weights)
+        if n == 0:
+            raise ValueError("AliasSampler needs at least one weight")
+        total = float(sum(weights))
+        if total <= 0:
+            # Nothing to go on, fall back to uniform
+            weights = [1.0] * n
+            total = float(n)
+        scaled = [w * n / total for w in weights]
+        self.prob = [0.0] * n
+        self.alias = [0] * n
+        small = [i for i, w in enumerate(scaled) if w < 1.0]
+        large = [i for i, w in enumerate(scaled) if w >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+        # Whatever is left is (up to rounding) exactly 1
+        for i in large + small:
+            self.prob[i] = 1.0
+            self.alias[i] = i
+
+    """!
+    @brief Draw one index
+    """
+    def sample(self):
+        i = random.randrange(len(self.prob))
+        return i if random.random() < self.prob[i] else self.alias[i]
+
+
+"""!
+@brief Load the blocks of every passed (country_name, geoname_id) once
+Returns: list of CountryBlocks (countries without any IPv4 block are left out)
+"""
+def load_country_blocks(geoip_session, countries):
+    country_blocks = []
+    for country_name, geoname_id in countries:
+        blocks = CountryBlocks(country_name, geoname_id)
+        for (network,) in geoip_session.execute(QUERY_BLOCKS_RECORD_STMT, {"gid": geoname_id}):
+            # Parse every block once here instead of on every send
+            try:
+                net = ipaddress.ip_network(network, strict=False)
+            except (TypeError, ValueError):
+                continue
+            if net.version != 4:
+                continue
+            blocks.network_starts.append(int(net.network_address))
+            blocks.prefix_lens.append(net.prefixlen)
+        if len(blocks) == 0:
+            print(f"No matching block entries found for {country_name}.")
+            continue
+        country_blocks.append(blocks)
+    return country_blocks
+
+
+"""!
+@brief Weight of every country for the configured weighting mode
+"""
+def country_weights(country_blocks, config=sampler_config):
+    mode = config["weights"]
+    if mode == "address_space":
+        return [blocks.address_space() for blocks in country_blocks]
+    if mode == "profile":
+        profile = config["profile"]
+        return [
+            profile.get(blocks.country_name, profile.get(blocks.geoname_id, 0.0))
+            for blocks in country_blocks
+        ]
+    return [1.0] * len(country_blocks)
+
+
+class CountrySampler:
+    """Picks the next (country_name, geoname_id, network) to send."""
+
+    def __init__(self, country_blocks, config=sampler_config):
+        self.country_blocks = country_blocks
+        self.alias = AliasSampler(country_weights(country_blocks, config))
+
+    def sample(self):
+        blocks = self.country_blocks[self.alias.sample()]
+        return blocks.country_name, blocks.geoname_id, blocks.random_network()
+
+    """!
+    @brief Same as sample() but returns the block as integers
+    Returns: (country_name, geoname_id, network_start, prefix_len)
+    """
+    def sample_block(self):
+        blocks = self.country_blocks[self.alias.sample()]
+        network_start, prefix_len = blocks.random_block()
+        return blocks.country_name, blocks.geoname_id, network_start, prefix_len
+
+
+"""!
+@brief Load the blocks for the passed countries and build a sampler over them
+"""
+def build_country_sampler(geoip_session, countries, config=sampler_config):
+    country_blocks = load_country_blocks(geoip_session, countries)
+    if not country_blocks:
+        raise ValueError("None of the selected countries have a major IP block")
+    total = sum(len(blocks) for blocks in country_blocks)
+    print(f"[Sampler] Loaded {total} blocks for {len(country_blocks)} countries ({config['weights']} weights)")
+    return CountrySampler(country_blocks, config)
@@ -0,0 +1,228 @@
+"""!
+@file csv_ingest.py
+@brief Stream the GeoIP CSV files into SQLite. Rows are read in chunks and
+inserted with executemany inside one transaction using bulk load PRAGMAs.
+Column types are decided once from the first rows and SQLite converts the
+cells, the blocks table gets integer network_start/network_end columns and indexes,
+and a CSV whose checksum hasn't changed since the last load is skipped
+"""
+
+# Standard libraries we need
+import csv
+import time
+import socket
+import itertools
+import hashlib
+import ipaddress
+
+# Rows handed to one executemany call
+CSV_CHUNK_SIZE = 50000
+# Rows read before the load to decide each columns type (see column_type())
+TYPE_SAMPLE_ROWS = 1000
+# PRAGMAs used while bulk loading, the previous values are restored afterwards
+BULK_LOAD_PRAGMAS = {
+    "synchronous": "OFF",
+    "temp_store": "MEMORY",
+    "cache_size": "-65536",   # 64 MB
+}
+
+# Checksums of the CSV files each table was loaded from
+INGEST_META_CREATE_SQL = (
+    "CREATE TABLE IF NOT EXISTS ingest_meta "
+    "(table_name TEXT PRIMARY KEY, checksum TEXT, row_count INTEGER, loaded_time REAL)"
+)
+INGEST_META_SEARCH_SQL = "SELECT checksum FROM ingest_meta WHERE table_name = ?"
+INGEST_META_UPSERT_SQL = (
+    "INSERT INTO ingest_meta (table_name, checksum, row_count, loaded_time) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(table_name) DO UPDATE SET checksum = excluded.checksum, "
+    "row_count = excluded.row_count, loaded_time = excluded.loaded_time"
+)
+TABLE_EXISTS_SQL = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?"
+# Insert placeholder storing an empty CSV field as NULL
+NULL_IF_EMPTY = "NULLIF(?, '')"
+
+
+"""!
+@brief sha256 of a file, read in 1 MB chunks
+"""
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+"""!
+@brief SQLite type of a column from a sample of its values: INTEGER if every non empty
+value is an integer, else REAL if every one is a number, else TEXT. The column affinity
+converts every cell in C while inserting, a cell that doesnt fit stays text
+"""
+def column_type(values):
+    column = "INTEGER"
+    for value in values:
+        if value == "":
+            continue
+        if column == "INTEGER":
+            try:
+                int(value)
+                continue
+            except ValueError:
+                column = "REAL"
+        try:
+            float(value)
+        except ValueError:
+            return "TEXT"
+    return column
+
+
+"""!
+@brief Column types of a CSV, decided once from its first rows
+"""
+def column_types(columns, sample_rows):
+    return [
+        column_type(row[i] for row in sample_rows if i < len(row))
+        for i in range(len(columns))
+    ]
+
+
+"""!
+@brief First and last address of an IPv4 CIDR as integers (host bits are ignored)
+Returns: (start, end) or (None, None) for IPv6 and malformed networks
+"""
+def network_range(network):
+    address, _, prefix = network.partition("/")
+    try:
+        if address.count(".") != 3:
+            raise ValueError(address)
+        start = int.from_bytes(socket.inet_aton(address), "big")
+        prefix = int(prefix) if prefix else 32
+    except (OSError, ValueError):
+        return slow_network_range(network)
+    if not 0 <= prefix <= 32:
+        return (None, None)
+    size = 1 << (32 - prefix)
+    start &= ~(size - 1) & 0xFFFFFFFF
+    return (start, start + size - 1)
+
+
+"""!
+@brief network_range() through the ipaddress module, for anything inet_aton can't parse
+"""
+def slow_network_range(network):
+    try:
+        net = ipaddress.ip_network(network, strict=False)
+    except (TypeError, ValueError):
+        return (None, None)
+    if net.version != 4:
+        return (None, None)
+    start = int(net.network_address)
+    return (start, start + net.num_addresses - 1)
+
+
+"""!
+@brief Computed columns for the blocks table: the first and last address of the network as integers
+Returns: fn(raw_row) -> (network_start, network_end) for a CSV with these columns
+"""
+def network_range_columns(columns):
+    network_index = columns.index("network")
+
+    def network_range_of_row(row):
+        return network_range(row[network_index])
+    return network_range_of_row
+
+NETWORK_RANGE_COLUMNS = (("network_start", "network_end"), network_range_columns)
+
+
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+"""!
+@brief Load a passed csv_file into a table of an engine
+@param computed_columns (names, fn(csv_columns) -> fn(raw_row) -> values) extra columns built per row
+@param indexes columns to index once the rows are loaded
+@param force reload even if the CSV file hasn't changed
+Returns: number of rows loaded (0 if the load was skipped)
+"""
+def load_csv_to_sqlite(csv_file, table_name, engine, computed_columns=None, indexes=(), force=False):
+    checksum = file_checksum(csv_file)
+    table = quote_identifier(table_name)
+
+    with engine.connect() as conn:
+        # 1. Skip the load if this exact file is already in the table
+        conn.exec_driver_sql(INGEST_META_CREATE_SQL)
+        conn.commit()
+        table_exists = conn.exec_driver_sql(TABLE_EXISTS_SQL, (table_name,)).fetchone()
+        stored = conn.exec_driver_sql(INGEST_META_SEARCH_SQL, (table_name,)).fetchone()
+        if not force and table_exists and stored and stored[0] == checksum:
+            print(f"Table '{table_name}' is up to date with {csv_file}, skipping")
+            return 0
+
+        # 2. Bulk load PRAGMAs, remember what they were so we can put them back
+        previous_pragmas = {}
+        for pragma, value in BULK_LOAD_PRAGMAS.items():
+            previous_pragmas[pragma] = conn.exec_driver_sql(f"PRAGMA {pragma}").scalar()
+            conn.exec_driver_sql(f"PRAGMA {pragma} = {value}")
+
+        row_count = 0
+        try:
+            with open(csv_file, newline="", encoding="utf-8") as f:
+                reader = csv.reader(f)
+                columns = next(reader)
+                extra_names, make_extra_fn = computed_columns or ((), None)
+                extra_fn = make_extra_fn(columns) if make_extra_fn is not None else None
+                all_columns = list(columns) + list(extra_names)
+                # The first rows decide every columns type, they are loaded like the rest
+                sample_rows = list(itertools.islice(reader, TYPE_SAMPLE_ROWS))
+                # Computed columns are already integers (or NULL)
+                types = column_types(columns, sample_rows) + ["INTEGER"] * len(extra_names)
+
+                # 3. Recreate the table (the whole load is one transaction,
+                # forgetting the old checksum first so a failed load is never skipped)
+                conn.exec_driver_sql("DELETE FROM ingest_meta WHERE table_name = ?", (table_name,))
+                conn.exec_driver_sql(f"DROP TABLE IF EXISTS {table}")
+                conn.exec_driver_sql(
+                    f"CREATE TABLE {table} "
+                    f"({', '.join(f'{quote_identifier(col)} {kind}' for col, kind in zip(all_columns, types))})"
+                )
+                # Empty fields are NULL, SQLite converts the rest to the column type
+                insert_sql = (
+                    f"INSERT INTO {table} VALUES ({', '.join(NULL_IF_EMPTY for _ in all_columns)})"
+                )
+
+                # 4. Stream the rows in chunks
+                chunk = []
+                for raw_row in itertools.chain(sample_rows, reader):
+                    row = tuple(raw_row)
+                    if extra_fn is not None:
+                        row += tuple(extra_fn(raw_row))
+                    # executemany parameters have to be tuples, SQLAlchemy rejects lists
+                    chunk.append(row)
+                    if len(chunk) >= CSV_CHUNK_SIZE:
+                        conn.exec_driver_sql(insert_sql, chunk)
+                        row_count += len(chunk)
+                        chunk = []
+                if chunk:
+                    conn.exec_driver_sql(insert_sql, chunk)
+                    row_count += len(chunk)
+
+            # 5. Index after the rows are in, it is much faster than indexing while inserting
+            for column in indexes:
+                conn.exec_driver_sql(
+                    f"CREATE INDEX IF NOT EXISTS {quote_identifier(f'idx_{table_name}_{column}')} "
+                    f"ON {table} ({quote_identifier(column)})"
+                )
+
+            # 6. Remember which file this table came from
+            conn.exec_driver_sql(INGEST_META_UPSERT_SQL, (table_name, checksum, row_count, time.time()))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            for pragma, value in previous_pragmas.items():
+                conn.exec_driver_sql(f"PRAGMA {pragma} = {value}")
+
+    print(f"Loaded {row_count} rows into table '{table_name}'")
+    return row_count
@@ -9,11 +9,12 @@ import time
 from threading import Lock
 
 # Package libraries needed
-import pandas as pd
-from sqlalchemy import create_engine, Column, Integer, Float, String, Boolean, MetaData, Table, text 
+from sqlalchemy import create_engine, Column, Integer, Float, MetaData, Table, text 
 from sqlalchemy.orm import sessionmaker
 
 # Local libraries we need
+from csv_ingest import load_csv_to_sqlite, NETWORK_RANGE_COLUMNS
+import metrics
 # Per the user agreement I signed I cannot upload the databases I used to the internet
 from config import COUNTRY_CVS, BLOCKS_CVS, GEO_IP_DB_PATH, FREQ_MIN
 # -----------------------
@@ -31,6 +32,16 @@ SESS_GEOIP_FACTORY = sessionmaker(bind=GEOIP_ENGINE)
 PACKET_SESSION_FACTORY = sessionmaker(bind=GEOIP_ENGINE)
 # Lock to be extra careful with threading for the packet table
 PACKET_LOCK = Lock()
+# Hot path metrics (see metrics.py)
+PACKETS_RECORDED = metrics.counter("packets_recorded", "Sent packets counted in the packet table")
+RECORD_SECONDS = metrics.histogram("db_record_seconds", "Time to count a packet or batch in the packet table")
+
+# How packet frequencies decay over time
+# "linear": a background thread subtracts 1 from every record every DECREMENT_INTERVAL seconds
+# "exponential": no sweep, a frequency halves every `half_life` seconds since its request_time
+# and is applied lazily whenever a record is incremented (frequencies are then fractional,
+# the frequency column is REAL for that reason)
+decay_config = {"mode": "linear", "half_life": 30.0}
 
 # Common database statements (commands)
 #-- Used by decrement_packet_frequencies()--#
@@ -42,6 +53,10 @@ PACKET_SUB_SEARCH_FREQ_STMT = text(
 PACKET_SUB_FREQU_STMT = text(
      "UPDATE packet SET frequency = :frequency WHERE geoname_id = :gid"
 )
+# Subtract 1 from every packet table record in one statement, never going below FREQ_MIN
+PACKET_DECAY_ALL_STMT = text(
+    "UPDATE packet SET frequency = MAX(frequency - 1, :freq_min) WHERE frequency > :freq_min"
+)
 #-- Used by increment_packet_freq()--#
 PACKET_ADD_SEARCH_FREQ_STMT = text(
     "SELECT frequency, request_time FROM packet WHERE geoname_id = :gid"
@@ -61,15 +76,6 @@ PACKET_SEARCH_ID_STMT = text(
 
 
 
-"""!
-@brief Load a passed csv_file into a engine
-"""
-def load_csv_to_sqlite(csv_file, table_name, engine):
-    """Load CSV into SQLite using pandas"""
-    df = pd.read_csv(csv_file)
-    df.to_sql(table_name, engine, if_exists="replace", index=False)
-    print(f"Loaded {len(df)} rows into table '{table_name}'")
-    
 """!
 @brief Load packet table to the database
 """
@@ -82,7 +88,8 @@ def load_packet_table_sqlite():
     packet_table = Table(
         table_name, metadata,
         Column("geoname_id", Integer, primary_key=True),
-        Column("frequency", Integer, default=0),
+        # REAL: exponential decay stores fractional frequencies (linear decay keeps whole numbers)
+        Column("frequency", Float, default=0),
         Column("request_time", Float)
     )
     # Clear the table if it already exists: 
@@ -95,11 +102,18 @@ def load_packet_table_sqlite():
 """!
 @brief Initialize our two databases with our two csv files
 """
-def initalize_engines(): 
-    # 2. Load CSVs into DBs
+def initalize_engines(force=False): 
+    # 2. Load CSVs into DBs (skipped for a CSV that hasn't changed since the last load)
     print("Loading GEOIP_ENGINE with CSV data")
-    load_csv_to_sqlite(COUNTRY_CVS, "countries", GEOIP_ENGINE)
-    load_csv_to_sqlite(BLOCKS_CVS, "blocks", GEOIP_ENGINE)
+    load_csv_to_sqlite(
+        COUNTRY_CVS, "countries", GEOIP_ENGINE,
+        indexes=("geoname_id", "country_name"), force=force
+    )
+    load_csv_to_sqlite(
+        BLOCKS_CVS, "blocks", GEOIP_ENGINE,
+        computed_columns=NETWORK_RANGE_COLUMNS,
+        indexes=("network", "geoname_id", "network_start"), force=force
+    )
     load_packet_table_sqlite()
     print("Initialization complete.")
 
@@ -115,55 +129,50 @@ def get_geoip_session():
 @brief Decrement all packet table record's frequency
 """
 def decrement_packet_frequencies():
+    # Exponential decay is computed when a record is read, there is nothing to sweep
+    if decay_config["mode"] != "linear":
+        return 0
     # 1. Lock the packet table lock for thread safety
     with PACKET_LOCK:
         # 2. Start a session for the packet table
         session = PACKET_SESSION_FACTORY()
-        # 3. Get a list all packet records in packet table
-        packet_records = session.execute(PACKET_SUB_SEARCH_FREQ_STMT).fetchall()
-        # 4. Go through the list of packet records and decrement by 1
-        for geoname_id, freq in packet_records:
-            try:
-                # If the frequency isnt already FREQ_MIN (typically 1) 
-                # decrement the frequency by 1
-                # Why do I do this? I want to know if a country has at least 
-                # sent one packet over the network
-                new_freq = max(freq - 1, FREQ_MIN)
-                # Stage the change
-                session.execute(
-                    PACKET_SUB_FREQU_STMT,
-                    {"frequency": new_freq, "gid": geoname_id},
-                )
-                # Push the changes to the table
-                session.commit()
-
-                #---DEBUG---#
-                # Fetch and print the updated record 
-                updated_row = session.execute(PACKET_SEARCH_ID_STMT, {"gid": geoname_id}).fetchone()
-                if updated_row:
-                    gid, freq_after, req_time_after = updated_row
-                    if freq_after != freq:
-                        print(f"[Decremented] record: geoname_id={gid}, freq: new:{freq_after} old:{freq}")
-                    #else: 
-                        #--DEBUG--# 
-                        # This is used to keep track of countries with only 1 hit
-                        #print(f"Frequency wasnt updated when incrementing a packet for geoname_id={gid}")
-                else: 
-                    print("Cant find a packet record after incrementing?")
-
-            except Exception as e:
-                # If the changes werent accepted roll back what might have happened
-                session.rollback()
-                print("failed decrement a packet record frequency")
-            finally:
-                # Close the session
-                session.close()
+        try:
+            # 3. Decrement every record by 1 in a single statement
+            # If the frequency isnt already FREQ_MIN (typically 1) 
+            # decrement the frequency by 1
+            # Why do I do this? I want to know if a country has at least 
+            # sent one packet over the network
+            result = session.execute(PACKET_DECAY_ALL_STMT, {"freq_min": FREQ_MIN})
+            # 4. Push the changes to the table
+            session.commit()
+            #---DEBUG---#
+            #print(f"[Decremented] {result.rowcount} records")
+            return result.rowcount
+        except Exception as e:
+            # If the changes werent accepted roll back what might have happened
+            session.rollback()
+            print(f"failed decrement packet record frequencies: {e}")
+            return 0
+        finally:
+            # Close the session
+            session.close()
+
+"""!
+@brief Exponentially decay a frequency by the time passed since its request_time
+"""
+def decayed_frequency(frequency, request_time, now, half_life=None):
+    if half_life is None:
+        half_life = decay_config["half_life"]
+    if request_time is None or half_life <= 0:
+        return frequency
+    elapsed = max(now - request_time, 0.0)
+    return max(frequency * 0.5 ** (elapsed / half_life), FREQ_MIN)
 
 """!
 @brief Increment or create a record for a geonome_id  
 """
 def increment_packet_freq(geoname_id):
-    print("incrementing packet frequency")
+    started = time.perf_counter()
     with PACKET_LOCK:
         session = PACKET_SESSION_FACTORY()
         try:
@@ -173,48 +182,72 @@ def increment_packet_freq(geoname_id):
 
             if result is None:
                 # 2. If a record wasnt found, create one, stage the change
-                old_freq = 0
-                new_freq = 1
                 session.execute(
                     PACKET_ADD_STMT,
-                    {"geoname_id": geoname_id, "frequency": new_freq, "request_time": curr_time},
+                    {"geoname_id": geoname_id, "frequency": 1, "request_time": curr_time},
                 )
-                action = "Inserted"
-                print(f"---added new for gid{geoname_id}")
             else:
                 # 2. if a record was found, update it, stage the change 
-                old_freq, _ = result
-                new_freq = old_freq + 1
+                old_freq, old_time = result
+                if decay_config["mode"] == "exponential":
+                    # Apply the decay since the last request before counting this one
+                    old_freq = decayed_frequency(old_freq, old_time, curr_time)
                 session.execute(
                     PACKET_UPDATE_STMT,
-                    {"frequency": new_freq, "request_time": curr_time, "gid": geoname_id},
+                    {"frequency": old_freq + 1, "request_time": curr_time, "gid": geoname_id},
                 )
-                action = "Updated"
-                print(f"---updated for gid: {geoname_id}")
 
             # Push the changes
             session.commit()
-            print("commited incrementing packet frequency")
+            PACKETS_RECORDED.inc()
             #---DEBUG---#
             # Fetch and print the updated record 
-            # Fetch updated record for debug
-            updated_row = session.execute(PACKET_SEARCH_ID_STMT, {"gid": geoname_id}).fetchone()
-            if updated_row:
-                updated_gid, freq_after, req_time_after = updated_row
-                print(
-                    f"[{action}] row: geoname_id={updated_gid} | old_freq={old_freq} → new_freq={freq_after} | request_time={req_time_after}"
-                )
-            else:
-                print(f"[{action}] ERROR: Cannot find packet record after operation for geoname_id={geoname_id}")
-
-
+            #print(session.execute(PACKET_SEARCH_ID_STMT, {"gid": geoname_id}).fetchone())
 
         except Exception as e:
             # If the changes werent accepted roll back what might have happened
-            #---DEBUG---#
             print(f"failed update or add a packet record for geoname_id={geoname_id}: {e}")
             session.rollback()
         finally:
             # Close the session
-            print("finished incrementing packet frequency")
-            session.close()
\ No newline at end of file
+            session.close()
+    RECORD_SECONDS.observe(time.perf_counter() - started)
+"""!
+@brief Increment or create the records for a batch of packets in one transaction
+@param counts dictionary of geoname_id -> number of packets sent
+"""
+def increment_packet_freqs(counts):
+    started = time.perf_counter()
+    with PACKET_LOCK:
+        session = PACKET_SESSION_FACTORY()
+        try:
+            curr_time = time.time()
+            for geoname_id, count in counts.items():
+                # 1. See if a record for the country already exists
+                result = session.execute(PACKET_ADD_SEARCH_FREQ_STMT, {"gid": geoname_id}).fetchone()
+                if result is None:
+                    # 2. If a record wasnt found, create one, stage the change
+                    session.execute(
+                        PACKET_ADD_STMT,
+                        {"geoname_id": geoname_id, "frequency": count, "request_time": curr_time},
+                    )
+                    continue
+                # 2. if a record was found, update it, stage the change
+                old_freq, old_time = result
+                if decay_config["mode"] == "exponential":
+                    # Apply the decay since the last request before counting this batch
+                    old_freq = decayed_frequency(old_freq, old_time, curr_time)
+                session.execute(
+                    PACKET_UPDATE_STMT,
+                    {"frequency": old_freq + count, "request_time": curr_time, "gid": geoname_id},
+                )
+            # Push every change at once
+            session.commit()
+            PACKETS_RECORDED.add(sum(counts.values()))
+        except Exception as e:
+            # If the changes werent accepted roll back what might have happened
+            print(f"failed to update or add packet records for a batch: {e}")
+            session.rollback()
+        finally:
+            session.close()
+    RECORD_SECONDS.observe(time.perf_counter() - started)
@@ -0,0 +1,154 @@
+"""!
+@file frame_builder.py
+@brief Build the sender's Ether/IPv4/TCP SYN frames without Scapy layer objects.
+A template frame is serialized once per destination into a preallocated
+bytearray, and every send only patches the source IP, source port, payload,
+lengths and checksums. Checksums are updated from precomputed partial sums, and
+every blocks source address and payload are prepared once when the blocks are loaded
+"""
+
+# Standard libraries we need
+import socket
+import struct
+
+# Header sizes (no IP or TCP options)
+ETH_HEADER_LEN = 14
+IP_HEADER_LEN = 20
+TCP_HEADER_LEN = 20
+HEADERS_LEN = ETH_HEADER_LEN + IP_HEADER_LEN + TCP_HEADER_LEN
+# Offsets of the fields we patch
+IP_TOTAL_LEN_OFFSET = ETH_HEADER_LEN + 2
+IP_CHECKSUM_OFFSET = ETH_HEADER_LEN + 10
+IP_SRC_OFFSET = ETH_HEADER_LEN + 12
+TCP_OFFSET = ETH_HEADER_LEN + IP_HEADER_LEN
+TCP_SRC_PORT_OFFSET = TCP_OFFSET
+TCP_CHECKSUM_OFFSET = TCP_OFFSET + 16
+PAYLOAD_OFFSET = HEADERS_LEN
+# Same defaults Scapy uses for IP()/TCP(flags="S")
+IP_ID = 1
+IP_TTL = 64
+IP_PROTO_TCP = 6
+TCP_FLAGS_SYN = 0x02
+TCP_WINDOW = 8192
+ETH_TYPE_IPV4 = 0x0800
+# "255.255.255.255/32" is the longest payload we ever send
+MAX_PAYLOAD_LEN = 18
+
+
+"""!
+@brief Fold a ones-complement sum down to 16 bits
+"""
+def fold_checksum(total):
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return total
+
+
+"""!
+@brief Sum a byte string as big endian 16 bit words (padded with a zero byte if odd)
+"""
+def sum_words(data):
+    if len(data) % 2:
+        data = data + b"\0"
+    return sum(struct.unpack(f"!{len(data) // 2}H", data))
+
+
+"""!
+@brief Convert "aa:bb:cc:dd:ee:ff" to 6 bytes
+"""
+def mac_to_bytes(mac):
+    return bytes.fromhex(mac.replace(":", "").replace("-", ""))
+
+
+class PreparedBlock:
+    """A major IP block ready to be patched into a frame."""
+
+    __slots__ = ("src_ip", "src_bytes", "src_sum", "payload", "payload_sum")
+
+    def __init__(self, network_start, prefix_len):
+        self.src_ip = network_start
+        self.src_bytes = network_start.to_bytes(4, "big")
+        self.src_sum = (network_start >> 16) + (network_start & 0xFFFF)
+        # The payload is the CIDR block, the receiver matches on it
+        self.payload = f"{socket.inet_ntoa(self.src_bytes)}/{prefix_len}".encode()
+        self.payload_sum = sum_words(self.payload)
+
+
+class FrameTemplate:
+    """One serialized Ether/IPv4/TCP SYN frame for a destination, patched in place per send."""
+
+    def __init__(self, src_mac, dst_mac, dst_ip, dst_port, max_payload_len=MAX_PAYLOAD_LEN):
+        self.buffer = bytearray(HEADERS_LEN + max_payload_len)
+        self.view = memoryview(self.buffer)
+        self.max_payload_len = max_payload_len
+        # Blocks prepared so far, (network_start, prefix_len) -> PreparedBlock
+        self.blocks = {}
+
+        dst_ip_bytes = socket.inet_aton(dst_ip)
+        dst_ip_int = int.from_bytes(dst_ip_bytes, "big")
+        dst_ip_sum = (dst_ip_int >> 16) + (dst_ip_int & 0xFFFF)
+
+        # 1. Serialize the constant parts once
+        struct.pack_into("!6s6sH", self.buffer, 0, mac_to_bytes(dst_mac), mac_to_bytes(src_mac), ETH_TYPE_IPV4)
+        struct.pack_into(
+            "!BBHHHBBH4s4s", self.buffer, ETH_HEADER_LEN,
+            0x45, 0, 0, IP_ID, 0, IP_TTL, IP_PROTO_TCP, 0, b"\0\0\0\0", dst_ip_bytes
+        )
+        struct.pack_into(
+            "!HHIIBBHHH", self.buffer, TCP_OFFSET,
+            0, dst_port, 0, 0, (TCP_HEADER_LEN // 4) << 4, TCP_FLAGS_SYN, TCP_WINDOW, 0, 0
+        )
+
+        # 2. Checksum sums of every field that never changes
+        # IP header: version/ihl/tos, id, flags/fragment, ttl/protocol and the destination
+        self.ip_const_sum = 0x4500 + IP_ID + (IP_TTL << 8 | IP_PROTO_TCP) + dst_ip_sum
+        # TCP: pseudo header destination + protocol, then destination port, data offset/flags and window
+        self.tcp_const_sum = (
+            dst_ip_sum + IP_PROTO_TCP
+            + dst_port + (((TCP_HEADER_LEN // 4) << 12) | TCP_FLAGS_SYN) + TCP_WINDOW
+        )
+
+    """!
+    @brief Prepare (once) the source address and payload of a block
+    """
+    def prepare_block(self, network_start, prefix_len):
+        key = (network_start, prefix_len)
+        block = self.blocks.get(key)
+        if block is None:
+            block = PreparedBlock(network_start, prefix_len)
+            if len(block.payload) > self.max_payload_len:
+                raise ValueError(f"Payload {block.payload!r} does not fit the frame template")
+            self.blocks[key] = block
+        return block
+
+    """!
+    @brief Patch a block and source port into the template
+    Returns: the finished frame as bytes
+    """
+    def build(self, block, src_port):
+        buf = self.buffer
+        payload_len = len(block.payload)
+        tcp_len = TCP_HEADER_LEN + payload_len
+        total_len = IP_HEADER_LEN + tcp_len
+
+        # 1. IP: total length, source address and header checksum
+        struct.pack_into("!H", buf, IP_TOTAL_LEN_OFFSET, total_len)
+        buf[IP_SRC_OFFSET:IP_SRC_OFFSET + 4] = block.src_bytes
+        ip_sum = fold_checksum(self.ip_const_sum + total_len + block.src_sum)
+        struct.pack_into("!H", buf, IP_CHECKSUM_OFFSET, ~ip_sum & 0xFFFF)
+
+        # 2. TCP: source port, payload and checksum (pseudo header + header + payload)
+        struct.pack_into("!H", buf, TCP_SRC_PORT_OFFSET, src_port)
+        buf[PAYLOAD_OFFSET:PAYLOAD_OFFSET + payload_len] = block.payload
+        tcp_sum = fold_checksum(self.tcp_const_sum + block.src_sum + tcp_len + src_port + block.payload_sum)
+        struct.pack_into("!H", buf, TCP_CHECKSUM_OFFSET, ~tcp_sum & 0xFFFF)
+
+        return bytes(self.view[:ETH_HEADER_LEN + total_len])
+
+
+"""!
+@brief Build the template for our receiver, reading the source MAC from the interface
+"""
+def build_frame_template(iface, dst_mac, dst_ip, dst_port):
+    from scapy.all import get_if_hwaddr, conf
+    return FrameTemplate(get_if_hwaddr(iface or conf.iface), dst_mac, dst_ip, dst_port)
@@ -11,22 +11,22 @@ import signal # for stop signal
 import time # for sleep
 import threading
 
-# Package libraries we need 
-from sqlalchemy import text
-
 # Local libraries we need
-from db import initalize_engines, get_geoip_session, increment_packet_freq, decrement_packet_frequencies
-from config import countries_list_selected, DECREMENT_INTERVAL
-from scapy_send import send_packet
+from startup_timer import stage, report
+with stage("import database + sender modules"):
+    from sqlalchemy import text
+    from db import initalize_engines, get_geoip_session, increment_packet_freqs, decrement_packet_frequencies, decay_config
+    from config import countries_list_selected, DECREMENT_INTERVAL
+    from scapy_send import load_scapy, sender_config, batch_size_for, TokenBucket, PacketSender
+    from frame_builder import build_frame_template
+    from config import RECEIVER_IP, RECEIVER_MAC, DEST_PORT
+    from block_sampler import build_country_sampler
 
 
 # Common database statements (commands)
 QUERY_COUNTRIES_RECORD_STMT = text(
     "SELECT country_name, geoname_id FROM countries"
 )
-QUERY_BLOCKS_RECORD_STMT = text(
-    "SELECT network FROM blocks WHERE geoname_id = :gid"
-)
 
 
 # Function that ctrl + c will make the program enter 
@@ -40,7 +40,7 @@ def signal_handler(sig, frame):
 signal.signal(signal.SIGINT, signal_handler)
 
 # Function to decrement all packets sent frequency by 1 every interval_sec
-def periodic_decrement(interval_sec=5):
+def periodic_decrement(interval_sec=DECREMENT_INTERVAL):
     while not INTERRUPTED:
         decrement_packet_frequencies()
         time.sleep(interval_sec)
@@ -52,12 +52,13 @@ def periodic_decrement(interval_sec=5):
 def main():
     # 1. Wait on the user to start the event loop and let them choose  
     # to load the load and cvs files into it if we havent already 
-    print("Initialized. Hit enter to start... \n Type `yes` to initalize databases")
+    print("Initialized. Hit enter to start... \n Type `yes` to initalize databases (`force` to reload unchanged CSV files)")
     user_ready = False
     user_input = input().strip().lower()
-    if user_input == "yes":
+    if user_input in ("yes", "force"):
         user_ready = True
-        initalize_engines()
+        with stage("load CSV files"):
+            initalize_engines(force=(user_input == "force"))
     
 
     # 2. Create sessions to access the geoIP database database
@@ -65,44 +66,75 @@ def main():
     print("Sessions created")
 
     # 3. Make a list of all possible countries from countries table    
-    country_records = geoip_session.execute(QUERY_COUNTRIES_RECORD_STMT).fetchall()
-    country_list = [(row[0], row[1]) for row in country_records]
+    with stage("load country list"):
+        country_records = geoip_session.execute(QUERY_COUNTRIES_RECORD_STMT).fetchall()
+        country_list = [(row[0], row[1]) for row in country_records]
     print(f"country list: {country_list}")
+
+    # OPTION 1: totally random country + IP address
+    #countries = country_list
+    # OPTION 2: Random ish country from pre-defined list in config.py
+    countries = countries_list_selected
+    # Load every major IP block for those countries once, so picking a packet needs no query
+    with stage("load country blocks"):
+        sampler = build_country_sampler(geoip_session, countries)
+    # scapy is only needed from here on, load it now so the first packet isnt delayed
+    with stage("import scapy"):
+        load_scapy()
         
     # 4. start the background thread to update the packet table
-    decrement_thread = threading.Thread(target=periodic_decrement, daemon=True)
-    decrement_thread.start()
-    print(f"Started background decrement thread (every {DECREMENT_INTERVAL}s)")
+    # (exponential decay is computed lazily from request_time and needs no thread)
+    if decay_config["mode"] == "linear":
+        decrement_thread = threading.Thread(target=periodic_decrement, daemon=True)
+        decrement_thread.start()
+        print(f"Started background decrement thread (every {DECREMENT_INTERVAL}s)")
+    else:
+        print(f"Using exponential decay (half life {decay_config['half_life']}s)")
 
 
     # 5. Start the loop and print countries and their major IP block address 
     # pulled from the database
+    # One socket for the whole run, paced by a token bucket at sender_config["pps"]
+    pps = sender_config["pps"]
+    batch_size = batch_size_for(sender_config)
+    sender = PacketSender(sender_config["iface"])
+    sender.open()
+    # Serialize the frame once for our receiver and prepare every block up front,
+    # each send then only patches the source address, port, payload and checksums
+    with stage("prepare frame templates"):
+        template = build_frame_template(sender_config["iface"], RECEIVER_MAC, RECEIVER_IP, DEST_PORT)
+        for blocks in sampler.country_blocks:
+            for network_start, prefix_len in zip(blocks.network_starts, blocks.prefix_lens):
+                template.prepare_block(network_start, prefix_len)
+    bucket = TokenBucket(pps, burst=max(batch_size, pps / 10.0))
+    report("Startup")
+    next_report = time.monotonic() + sender_config["report_interval"]
+    print(f"Sending at {pps} pps in batches of {batch_size}")
     while not INTERRUPTED:
-        # OPTION 1: totally random country + IP address
-        # Get country_name : geoname_id pairs
-        #country_name, geoname_id = random.choice(country_list)
-        #-------------------------------------------------------
-        # OPTION 2: Random ish country from pre-defined list in config.py
-        country_name, geoname_id = random.choice(countries_list_selected)
-        #--------------------------------------------------------
-        # geoname_id print for debugging
-        #print(f"Random country: {country_name} (geoname_id={geoname_id})")
-
-        # Query blocks table for all Major IP blocks for a country
-        block_records = geoip_session.execute(QUERY_BLOCKS_RECORD_STMT, {"gid": geoname_id}).fetchall()
-
-        if not block_records:
-            print("No matching block entries found.")
-        else:
-            # Pick a random Major IP Block for a country
-            random_network = random.choice(block_records)[0]
-            #print(f"Sending network for {country_name} : {random_network}")
-            # Add the packet to packet table records 
-            increment_packet_freq(geoname_id)
-            #Send the packet over the network
-            send_packet(random_network, country_name)
-        # Sleep for one second before querying another countries ip block
-        time.sleep(0.1)
+        # Wait until we are allowed to send another batch
+        bucket.take(batch_size)
+        frames = []
+        batch_counts = {}
+        for _ in range(batch_size):
+            # Pick a (weighted) random country and one of its Major IP Blocks from memory
+            country_name, geoname_id, network_start, prefix_len = sampler.sample_block()
+            # geoname_id print for debugging
+            #print(f"Sending network for {country_name} (geoname_id={geoname_id}) : {network_start}/{prefix_len}")
+            block = template.prepare_block(network_start, prefix_len)
+            frames.append(template.build(block, random.randint(1024, 65535)))
+            batch_counts[geoname_id] = batch_counts.get(geoname_id, 0) + 1
+        #Send the packets over the network
+        sender.send_batch(frames)
+        # Add the packets to packet table records, one transaction per batch
+        increment_packet_freqs(batch_counts)
+
+        # Every so often report the achieved rate against the requested rate
+        if time.monotonic() >= next_report:
+            sender.report(pps)
+            next_report = time.monotonic() + sender_config["report_interval"]
+
+    sender.report(pps)
+    sender.close()
 
     # FINAL STEP: close the session
     geoip_session.close()
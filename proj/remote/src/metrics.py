@@ -0,0 +1,275 @@
+"""!
+@file metrics.py
+@brief Low overhead hot path metrics: counters, gauges and fixed bucket latency
+histograms kept in one process wide registry. Every recording thread keeps its own
+cells (threading.local) so the hot path never takes a shared lock, readers add the
+cells of every thread up and never stop the threads that record
+"""
+
+# Standard libraries we need
+import time
+import threading
+from bisect import bisect_left
+from threading import Lock
+
+# Latency bucket upper bounds in seconds, 1 us to 5 s (anything slower lands in +Inf)
+LATENCY_BUCKETS = (
+    1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+    1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 5.0,
+)
+
+# name -> metric, every metric registers itself here
+METRICS = {}
+METRICS_LOCK = Lock()
+
+
+class Counter:
+    """A monotonically increasing count, kept as one cell per recording thread."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text=""):
+        self.name = name
+        self.help = help_text
+        # Every thread adds to its own [count] cell, only that thread ever writes it,
+        # so recording needs no lock. Readers add every cell up
+        self._local = threading.local()
+        self._cells = []
+        self._cells_lock = Lock()
+
+    """!
+    @brief Create and register the calling threads cell (its first update only)
+    """
+    def _new_cell(self):
+        cell = [0]
+        with self._cells_lock:
+            self._cells.append(cell)
+        self._local.cell = cell
+        return cell
+
+    def inc(self):
+        try:
+            self._local.cell[0] += 1
+        except AttributeError:
+            self._new_cell()[0] += 1
+
+    def add(self, amount):
+        if amount:
+            try:
+                self._local.cell[0] += amount
+            except AttributeError:
+                self._new_cell()[0] += amount
+
+    @property
+    def value(self):
+        # Cells of threads that exited stay registered, their counts still count
+        with self._cells_lock:
+            cells = list(self._cells)
+        return sum(cell[0] for cell in cells)
+
+
+class Gauge:
+    """A value that is set (a rate, a queue depth...)."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text=""):
+        self.name = name
+        self.help = help_text
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    """Fixed bucket histogram, kept as one cell of bucket counts and sum per recording thread."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text="", buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.bounds = tuple(buckets)
+        # A cell is the bucket counts (one more for everything above the last bound)
+        # followed by the sum, written only by the thread that owns it (see Counter)
+        self._local = threading.local()
+        self._cells = []
+        self._cells_lock = Lock()
+
+    def _new_cell(self):
+        cell = [0] * (len(self.bounds) + 1) + [0.0]
+        with self._cells_lock:
+            self._cells.append(cell)
+        self._local.cell = cell
+        return cell
+
+    def observe(self, value):
+        try:
+            cell = self._local.cell
+        except AttributeError:
+            cell = self._new_cell()
+        cell[bisect_left(self.bounds, value)] += 1
+        cell[-1] += value
+
+    """!
+    @brief Time a block of code: `with histogram.time(): ...`
+    """
+    def time(self):
+        return HistogramTimer(self)
+
+    """!
+    @brief Per bucket (not cumulative) counts, the last one is +Inf
+    """
+    def bucket_counts(self):
+        with self._cells_lock:
+            cells = list(self._cells)
+        counts = [0] * (len(self.bounds) + 1)
+        for cell in cells:
+            for bucket, count in enumerate(cell[:-1]):
+                counts[bucket] += count
+        return counts
+
+    @property
+    def count(self):
+        return sum(self.bucket_counts())
+
+    @property
+    def sum(self):
+        with self._cells_lock:
+            cells = list(self._cells)
+        return sum(cell[-1] for cell in cells)
+
+    """!
+    @brief Estimate a quantile (0-1) from the buckets, returns the upper bound of its bucket
+    """
+    def quantile(self, q):
+        counts = self.bucket_counts()
+        total = sum(counts)
+        if total == 0:
+            return None
+        rank = q * total
+        seen = 0
+        for bound, count in zip(self.bounds + (float("inf"),), counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class HistogramTimer:
+    """Context manager observing the time spent inside it."""
+
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+
+"""!
+@brief Return the registered metric called name, creating it the first time
+"""
+def register(cls, name, help_text="", **kwargs):
+    with METRICS_LOCK:
+        metric = METRICS.get(name)
+        if metric is None:
+            metric = METRICS[name] = cls(name, help_text, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+        return metric
+
+def counter(name, help_text=""):
+    return register(Counter, name, help_text)
+
+def gauge(name, help_text=""):
+    return register(Gauge, name, help_text)
+
+def histogram(name, help_text="", buckets=LATENCY_BUCKETS):
+    return register(Histogram, name, help_text, buckets=buckets)
+
+
+"""!
+@brief Plain dictionary of every metric, safe to call while the hot path keeps recording
+"""
+def snapshot():
+    with METRICS_LOCK:
+        metrics = list(METRICS.values())
+    result = {}
+    for metric in metrics:
+        if metric.kind == "histogram":
+            counts = metric.bucket_counts()
+            result[metric.name] = {
+                "count": sum(counts),
+                "sum": metric.sum,
+                "buckets": dict(zip([str(bound) for bound in metric.bounds] + ["+Inf"], counts)),
+                "p50": metric.quantile(0.5),
+                "p99": metric.quantile(0.99),
+            }
+        else:
+            result[metric.name] = metric.value
+    return result
+
+
+"""!
+@brief One line summary of the non zero counters and the histogram medians
+"""
+def summary():
+    parts = []
+    for name, value in snapshot().items():
+        if isinstance(value, dict):
+            if value["count"]:
+                parts.append(f"{name} p50<={value['p50'] * 1e6:.0f}us n={value['count']}")
+        elif value:
+            parts.append(f"{name}={value:.0f}" if isinstance(value, float) else f"{name}={value}")
+    return " | ".join(parts)
+
+
+"""!
+@brief Escape a Prometheus label value
+"""
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+"""!
+@brief Format a {name: value} label dictionary as {name="value",...}
+"""
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels.items()) + "}"
+
+
+"""!
+@brief Every registered metric in the Prometheus text exposition format
+"""
+def render_prometheus(prefix=""):
+    with METRICS_LOCK:
+        metrics = list(METRICS.values())
+    lines = []
+    for metric in metrics:
+        name = prefix + metric.name
+        if metric.kind == "counter":
+            name += "_total"
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        if metric.kind == "histogram":
+            cumulative = 0
+            counts = metric.bucket_counts()
+            for bound, count in zip(metric.bounds + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{name}_bucket{{le="{le}"}} {cumulative}')
+            lines.append(f"{name}_sum {metric.sum!r}")
+            lines.append(f"{name}_count {cumulative}")
+        else:
+            lines.append(f"{name} {metric.value}")
+    return "\n".join(lines) + "\n"
@@ -1,41 +1,182 @@
-# Standard libraries we need 
+# Standard libraries we need
 import re
+import time
 import random
 
-# Package libraries we need 
-from scapy.all import Ether, IP, TCP, sendp
+# Package libraries we need
+# scapy.all is slow to import, it is only loaded with the first packet (see load_scapy())
+Ether = IP = TCP = sendp = conf = None
 
 
 # Local libraries we need
 from config import RECEIVER_IP, SUBNET, DEST_PORT, SCAPY_DELAY, RECEIVER_MAC
+import metrics
 
-# use ctrl + z to kill this 
-# Add a SIGINT here later 
-def send_packet(src_ip_with_cidr, country):
+# How fast the main loop sends
+# pps: packets per second to aim for, batch_size: packets handed to the socket (and recorded
+# in one transaction) at once, None sends about 10 batches a second (pps / 10, at least 1),
+# iface: interface to send on (None uses scapy's default), report_interval: seconds between rate reports
+sender_config = {"pps": 10, "batch_size": None, "iface": None, "report_interval": 5.0}
+# Batches per second when batch_size is None
+BATCHES_PER_SECOND = 10
+
+# Hot path metrics (see metrics.py)
+PACKETS_SENT = metrics.counter("packets_sent", "Frames handed to the socket")
+PACKETS_SEND_FAILED = metrics.counter("packets_send_failed", "Frames the socket refused")
+SEND_SECONDS = metrics.histogram("send_seconds", "Time to hand one frame to the socket")
+SENT_PPS = metrics.gauge("sent_pps", "Packets per second achieved since the last rate report")
+
+"""
+@brief Packets per batch: the configured batch_size or pps / BATCHES_PER_SECOND
+"""
+def batch_size_for(config=sender_config):
+    if config["batch_size"]:
+        return int(config["batch_size"])
+    return max(1, round(config["pps"] / BATCHES_PER_SECOND))
+
+"""
+@brief import scapy the first time it is needed
+"""
+def load_scapy():
+    global Ether, IP, TCP, sendp, conf
+    if sendp is None:
+        from scapy.all import Ether, IP, TCP, sendp, conf
+
+"""
+@brief Build the packet for a "a.b.c.d/nn" source block with the block as its payload
+Returns: the scapy packet or None if the block isnt valid
+"""
+def build_packet(src_ip_with_cidr):
     # 1. Extract IP and CIDR using regex
     match = re.match(r"(\d{1,3}(?:\.\d{1,3}){3})/(\d{1,2})", src_ip_with_cidr)
     if not match:
         print(f"Invalid IP/CIDR address: {src_ip_with_cidr}, not sending")
-        return 
+        return None
 
     # 2. Seperate the IP and CIDR to their own strings
     src_ip, cidr_mask = match.groups()
-    # 3. Add the CIDR mask as the payload 
-    payload = f"{src_ip}/{cidr_mask}".encode() 
+    # 3. Add the CIDR mask as the payload
+    payload = f"{src_ip}/{cidr_mask}".encode()
     # 4. Build packet with CIDR mask payload
-    pkt = Ether(dst=RECEIVER_MAC) / IP(src=src_ip, dst=RECEIVER_IP) / TCP(
+    load_scapy()
+    return Ether(dst=RECEIVER_MAC) / IP(src=src_ip, dst=RECEIVER_IP) / TCP(
         sport=random.randint(1024, 65535),
         dport=DEST_PORT,
         flags="S"
     ) / payload
+
+# use ctrl + z to kill this
+# Add a SIGINT here later
+def send_packet(src_ip_with_cidr, country):
+    pkt = build_packet(src_ip_with_cidr)
+    if pkt is None:
+        return
     # Send the packet to the host
     try:
-        sendp(pkt, verbose=0) 
+        with SEND_SECONDS.time():
+            sendp(pkt, verbose=0)
+        PACKETS_SENT.inc()
         # debug print
-        #print(f"Sent packet from {src_ip_with_cidr} ({country}) with payload: {payload}")
-        # normal print
-        print(f"Sent packet from country ({country}) and `{src_ip}/{cidr_mask}`")
-        
+        #print(f"Sent packet from country ({country}) and `{src_ip_with_cidr}`")
+
     except Exception as e:
+        PACKETS_SEND_FAILED.inc()
         print(f"Failed to send packet: {e}")
-    
\ No newline at end of file
+
+
+class TokenBucket:
+    """Hands out `rate` tokens per second, saving up at most `burst` of them."""
+
+    def __init__(self, rate, burst=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate / 10.0, 1.0))
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.burst
+        self.last = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    """!
+    @brief Block until `n` tokens are available and take them
+    """
+    def take(self, n=1):
+        # A batch bigger than the bucket could never be sent
+        if n > self.burst:
+            self.burst = float(n)
+        self._refill()
+        # (the small slack stops float rounding from sleeping forever on a 1e-15 deficit)
+        while self.tokens + 1e-9 < n:
+            self.sleep((n - self.tokens) / self.rate)
+            self._refill()
+        self.tokens -= n
+
+
+class PacketSender:
+    """One persistent layer 2 socket that sends batches and tracks the achieved rate."""
+
+    def __init__(self, iface=None):
+        self.iface = iface
+        self.socket = None
+        self.sent = 0
+        self.failed = 0
+        self.started = None
+        # Counters at the last rate report
+        self.last_report_time = None
+        self.last_report_sent = 0
+
+    def open(self):
+        load_scapy()
+        self.socket = conf.L2socket(iface=self.iface or conf.iface)
+        self.started = self.last_report_time = time.monotonic()
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    """!
+    @brief Send every frame (scapy packet or raw bytes) in a batch on the open socket
+    Returns: number of frames sent
+    """
+    def send_batch(self, frames):
+        sent = 0
+        send = self.socket.send
+        for frame in frames:
+            started = time.perf_counter()
+            try:
+                send(frame)
+                sent += 1
+            except Exception as e:
+                self.failed += 1
+                PACKETS_SEND_FAILED.inc()
+                print(f"Failed to send packet: {e}")
+            SEND_SECONDS.observe(time.perf_counter() - started)
+        self.sent += sent
+        PACKETS_SENT.add(sent)
+        return sent
+
+    """!
+    @brief Achieved packets per second overall and since the last call
+    Returns: (overall pps, recent pps)
+    """
+    def rates(self):
+        now = time.monotonic()
+        overall = self.sent / (now - self.started) if now > self.started else 0.0
+        recent_elapsed = now - self.last_report_time
+        recent = (self.sent - self.last_report_sent) / recent_elapsed if recent_elapsed > 0 else 0.0
+        self.last_report_time = now
+        self.last_report_sent = self.sent
+        SENT_PPS.set(recent)
+        return overall, recent
+
+    def report(self, requested_pps):
+        overall, recent = self.rates()
+        print(
+            f"[Sender] requested {requested_pps:.0f} pps | achieved {recent:.0f} pps "
+            f"(overall {overall:.0f} pps) | sent {self.sent} failed {self.failed} | "
+            f"send p50<={SEND_SECONDS.quantile(0.5) or 0.0:.6f}s p99<={SEND_SECONDS.quantile(0.99) or 0.0:.6f}s"
+        )
@@ -0,0 +1,83 @@
+"""!
+@file test_block_sampler.py
+@brief The alias tables give every country exactly its share of the weight
+"""
+
+# Standard libraries we need
+import random
+
+# Package libraries we need
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+# Local libraries we need
+from block_sampler import AliasSampler, CountryBlocks, CountrySampler, load_country_blocks
+
+
+"""!
+@brief Probability of every index the alias tables encode: the column itself plus
+whatever other columns hand over to it
+"""
+def alias_distribution(sampler):
+    n = len(sampler.prob)
+    shares = [prob / n for prob in sampler.prob]
+    for i, (prob, alias) in enumerate(zip(sampler.prob, sampler.alias)):
+        shares[alias] += (1.0 - prob) / n
+    return shares
+
+
+@pytest.mark.parametrize("weights", [
+    [1.0],
+    [1.0, 1.0, 1.0],
+    [5.0, 1.0, 0.0, 2.5],
+    [random.Random(4).random() for _ in range(50)],
+    [1e-9, 1e9, 3.0],
+])
+def test_alias_tables_match_weights(weights):
+    sampler = AliasSampler(weights)
+    total = sum(weights)
+    for share, weight in zip(alias_distribution(sampler), weights):
+        assert share == pytest.approx(weight / total, abs=1e-9)
+
+
+def test_zero_weights_fall_back_to_uniform():
+    assert alias_distribution(AliasSampler([0.0, 0.0])) == pytest.approx([0.5, 0.5])
+
+
+def test_no_weights_is_an_error():
+    with pytest.raises(ValueError):
+        AliasSampler([])
+
+
+def test_load_country_blocks_parses_ipv4_blocks_once():
+    engine = create_engine("sqlite://")
+    with engine.connect() as conn:
+        conn.exec_driver_sql("CREATE TABLE blocks (network TEXT, geoname_id INTEGER)")
+        conn.exec_driver_sql(
+            "INSERT INTO blocks VALUES (?, ?)",
+            [("1.0.0.0/24", 1), ("1.0.8.0/21", 1), ("2001:db8::/32", 1), ("9.9.9.0/24", 2)],
+        )
+        conn.commit()
+    session = sessionmaker(bind=engine)()
+    try:
+        country_blocks = load_country_blocks(session, [("One", 1), ("Two", 2), ("None", 3)])
+    finally:
+        session.close()
+    assert [blocks.country_name for blocks in country_blocks] == ["One", "Two"]
+    one = country_blocks[0]
+    assert list(one.network_starts) == [0x01000000, 0x01000800]
+    assert list(one.prefix_lens) == [24, 21]
+    assert one.address_space() == 256 + 2048
+
+
+def test_country_sampler_only_draws_weighted_countries():
+    blocks = []
+    for name, geoname_id in (("A", 1), ("B", 2)):
+        country = CountryBlocks(name, geoname_id)
+        country.network_starts.append(0x0A000000 + geoname_id)
+        country.prefix_lens.append(32)
+        blocks.append(country)
+    sampler = CountrySampler(blocks, {"weights": "profile", "profile": {"B": 1.0}})
+    assert {sampler.sample()[0] for _ in range(200)} == {"B"}
+    assert sampler.sample_block() == ("B", 2, 0x0A000002, 32)
@@ -0,0 +1,62 @@
+"""!
+@file test_frame_builder.py
+@brief Template frames byte for byte against the frames Scapy builds
+"""
+
+# Standard libraries we need
+import random
+import socket
+
+# Package libraries we need
+import pytest
+
+# Local libraries we need
+from frame_builder import FrameTemplate
+
+scapy = pytest.importorskip("scapy.all")
+
+SRC_MAC = "02:00:00:00:00:01"
+DST_MAC = "02:00:00:00:00:02"
+DST_IP = "10.0.0.2"
+DST_PORT = 8080
+
+
+def scapy_frame(network_start, prefix_len, src_port):
+    src_ip = socket.inet_ntoa(network_start.to_bytes(4, "big"))
+    return bytes(
+        scapy.Ether(src=SRC_MAC, dst=DST_MAC)
+        / scapy.IP(src=src_ip, dst=DST_IP)
+        / scapy.TCP(sport=src_port, dport=DST_PORT, flags="S")
+        / f"{src_ip}/{prefix_len}".encode()
+    )
+
+
+def test_frames_match_scapy():
+    rng = random.Random(5)
+    template = FrameTemplate(SRC_MAC, DST_MAC, DST_IP, DST_PORT)
+    # Edge addresses and ports make the checksum fold carry, then random ones
+    cases = [(0xFFFFFFFF, 32, 65535), (0x01000000, 8, 1), (0xFFFF0000, 16, 0xFFFF)]
+    cases += [(rng.getrandbits(32), rng.randint(1, 32), rng.randint(1024, 65535)) for _ in range(300)]
+    for network_start, prefix_len, src_port in cases:
+        block = template.prepare_block(network_start, prefix_len)
+        assert template.build(block, src_port) == scapy_frame(network_start, prefix_len, src_port)
+
+
+def test_checksums_verify_after_reusing_the_template():
+    template = FrameTemplate(SRC_MAC, DST_MAC, DST_IP, DST_PORT)
+    # A long payload followed by a short one, the leftover bytes must not leak into the frame
+    template.build(template.prepare_block(0xDEADBEEF, 32), 4000)
+    frame = template.build(template.prepare_block(0x01020300, 24), 5000)
+    packet = scapy.Ether(frame)
+    ip_checksum, tcp_checksum = packet[scapy.IP].chksum, packet[scapy.TCP].chksum
+    del packet[scapy.IP].chksum
+    del packet[scapy.TCP].chksum
+    rebuilt = scapy.Ether(bytes(packet))
+    assert (rebuilt[scapy.IP].chksum, rebuilt[scapy.TCP].chksum) == (ip_checksum, tcp_checksum)
+    assert bytes(packet[scapy.TCP].payload) == b"1.2.3.0/24"
+
+
+def test_payload_that_does_not_fit_is_refused():
+    template = FrameTemplate(SRC_MAC, DST_MAC, DST_IP, DST_PORT, max_payload_len=8)
+    with pytest.raises(ValueError):
+        template.prepare_block(0x0A000000, 24)